@@ -0,0 +1,3 @@
+// Built-in globals (and pins) aren't in the root scope, so every lookup checks if the name is a pin first
+var a;
+for (i=0;i<10000;i++) { a = Math; a = JSON; a = D5; a = E; a = D25; }
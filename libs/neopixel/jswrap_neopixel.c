@@ -148,9 +148,9 @@ bool neopixelWrite(Pin pin, unsigned char *rgbData, size_t rgbSize) {
   JshPinFunction spiDevice = 0;
   unsigned int i;
   for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-    if (JSH_PINFUNCTION_IS_SPI(pinInfo[pin].functions[i]) &&
-        ((pinInfo[pin].functions[i] & JSH_MASK_INFO)==JSH_SPI_MOSI)) {
-      spiDevice = pinInfo[pin].functions[i];
+    if (JSH_PINFUNCTION_IS_SPI(JSH_PININFO_FUNCTION(pin,i)) &&
+        ((JSH_PININFO_FUNCTION(pin,i) & JSH_MASK_INFO)==JSH_SPI_MOSI)) {
+      spiDevice = JSH_PININFO_FUNCTION(pin,i);
     }
   }
   IOEventFlags device = jshGetFromDevicePinFunction(spiDevice);
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Generates the files the Makefile generates before compiling (platform_config.h,
+# jspininfo.c/h, linker.ld and jswrapper*.c) plus the board JSON, for every board in
+# boards/ (or just the boards given), in parallel. Each board's files go in
+# gen/all_boards/BOARDNAME (or -oDIR/BOARDNAME), with the scripts' output in log.txt.
+#
+# The arguments for each script come from 'make BOARD=... generatorargs', so the files
+# are the same as a normal build would make. The scripts are run in a pool of processes,
+# which are forked once all the jswrap files have been scanned, so every board shares
+# the same scanned JSON. At the end it prints how long each stage took for each board.
+# ----------------------------------------------------------------------------------------
+
+import sys;
+import os;
+import time;
+import glob;
+import shlex;
+import shutil;
+import runpy;
+import traceback;
+import subprocess;
+import multiprocessing;
+import multiprocessing.pool;
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+basedir = os.path.realpath(scriptdir+"/..")
+sys.path.append(basedir+"/scripts");
+sys.path.append(basedir+"/boards");
+
+import common;
+
+STAGES = [ "make", "platform_config", "pininfo", "linker", "jswrapper", "boardjson" ]
+
+jobs = os.cpu_count() or 1
+outdir = basedir+"/gen/all_boards"
+boardnames = []
+for arg in sys.argv[1:]:
+  if arg.startswith("-j"): jobs = int(arg[2:])
+  elif arg.startswith("-o"): outdir = os.path.realpath(arg[2:])
+  elif arg.startswith("-"):
+    print("USAGE: build_all_boards.py [-jJOBS] [-oOUTDIR] [BOARDNAME ...]")
+    exit(1)
+  else: boardnames.append(arg)
+if not boardnames:
+  boardnames = sorted(os.path.basename(f)[:-3] for f in glob.glob(basedir+"/boards/*.py"))
+
+os.chdir(basedir) # the scripts expect to be run from the root, like the Makefile does
+
+# Get the arguments the Makefile would give the scripts for a board
+def get_generator_args(boardname):
+  boarddir = outdir+"/"+boardname
+  if not os.path.isdir(boarddir): os.makedirs(boarddir)
+  start = time.time()
+  result = subprocess.run(["make", "-s", "BOARD="+boardname, "GENDIR="+boarddir, "generatorargs"],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  output = result.stdout.decode("utf-8", "replace")
+  args = { "board" : boardname, "dir" : boarddir, "time" : time.time()-start }
+  for line in output.splitlines():
+    if "=" in line:
+      name, value = line.split("=", 1)
+      args[name] = shlex.split(value) # these are passed through the shell in the Makefile
+  if result.returncode or not "DEFINES" in args:
+    args["error"] = output.strip().splitlines()[-1] if output.strip() else "make failed"
+  return args
+
+# Run one of the scripts in this process, with the given arguments and output to log
+def run_script(script, argv, log):
+  log.write("================================== "+script+" "+" ".join(argv)+"\n")
+  common.loadedBoards.clear() # some scripts change the board
+  sys.argv = [script] + argv
+  stdout, stderr = sys.stdout, sys.stderr
+  sys.stdout = sys.stderr = log
+  try:
+    runpy.run_path(scriptdir+"/"+script, run_name="__main__")
+  except SystemExit as e:
+    if e.code: raise Exception(script+" exited with "+str(e.code))
+  finally:
+    sys.stdout, sys.stderr = stdout, stderr
+    os.chdir(basedir)
+
+def build_board(args):
+  boardname = args["board"]
+  boarddir = args["dir"]
+  times = { "make" : args["time"] }
+  if "error" in args:
+    return { "board" : boardname, "times" : times, "error" : "make: "+args["error"] }
+  defines = args["DEFINES"]
+  stages = [("platform_config", "build_platform_config.py", [boardname, boarddir+"/platform_config.h"] + defines)]
+  if args["PININFOFILE"]:
+    pininfo = args["PININFOFILE"][0]
+    stages.append(("pininfo", "build_pininfo.py", [boardname, pininfo+".c", pininfo+".h"]))
+  if args["LINKER_FILE"] and os.path.dirname(os.path.realpath(args["LINKER_FILE"][0]))==boarddir:
+    stages.append(("linker", "build_linker.py", [boardname, args["LINKER_FILE"][0]] + args["BUILD_LINKER_FLAGS"]))
+  stages.append(("jswrapper", "build_jswrapper.py", args["WRAPPERSOURCES"] + args["JSMODULESOURCES"] + defines +
+                                                    ["-B"+boardname, "-F"+boarddir+"/jswrapper.c"]))
+  boardjsonDefines = defines
+  if args["USE_NET"]: # as in the Makefile, so Pico/etc have all possible firmware configs listed
+    boardjsonDefines = defines + ["-DUSE_WIZNET=1", "-DUSE_CC3000=1"]
+  stages.append(("boardjson", "build_board_json.py", args["WRAPPERSOURCES"] + boardjsonDefines + ["-B"+boardname]))
+  error = False
+  log = open(boarddir+"/log.txt", "w")
+  for stage, script, argv in stages:
+    start = time.time()
+    try:
+      run_script(script, argv, log)
+      if stage=="boardjson":
+        shutil.move(basedir+"/boards/"+boardname+".json", boarddir+"/"+boardname+".json")
+    except Exception as e:
+      log.write(traceback.format_exc())
+      error = stage+": "+str(e)
+    times[stage] = time.time()-start
+    if error: break
+  log.close()
+  return { "board" : boardname, "times" : times, "error" : error }
+
+def init_worker():
+  os.environ["JSWRAP_JOBS"] = "1" # pool processes can't have their own pools
+
+startTime = time.time()
+# Get the arguments for every board - this is mostly waiting for make, so use threads
+threadPool = multiprocessing.pool.ThreadPool(jobs)
+boardargs = threadPool.map(get_generator_args, boardnames)
+threadPool.close()
+makeTime = time.time()-startTime
+
+# Scan every jswrap file any board uses before forking, so the processes all share them.
+# Missing files are left for that board's build_jswrapper.py to fail on
+start = time.time()
+jswraps = []
+for args in boardargs:
+  for f in args.get("WRAPPERSOURCES", []):
+    if f.endswith(".c") and not f in jswraps and os.path.isfile(f): jswraps.append(f)
+common.scan_jswrap_files(jswraps)
+scanTime = time.time()-start
+
+start = time.time()
+try:
+  pool = multiprocessing.get_context("fork").Pool(jobs, init_worker)
+except (ValueError, OSError):
+  pool = False # no fork on this platform
+if pool:
+  results = pool.map(build_board, boardargs, 1)
+  pool.close()
+  pool.join()
+else:
+  init_worker()
+  results = list(map(build_board, boardargs))
+buildTime = time.time()-start
+
+# -----------------------------------------------------------------------------------------
+print("Times in seconds (make is getting the arguments with 'make generatorargs')")
+print("")
+print("Board".ljust(28)+"".join(stage.rjust(16) for stage in STAGES)+"Total".rjust(10))
+stageTotals = dict((stage, 0) for stage in STAGES)
+failed = []
+for result in results:
+  times = result["times"]
+  line = result["board"].ljust(28)
+  for stage in STAGES:
+    if stage in times:
+      stageTotals[stage] += times[stage]
+      line += ("%.2f" % times[stage]).rjust(16)
+    else:
+      line += "-".rjust(16)
+  line += ("%.2f" % sum(times.values())).rjust(10)
+  print(line)
+  if result["error"]: failed.append(result)
+print("Total".ljust(28)+"".join(("%.2f" % stageTotals[stage]).rjust(16) for stage in STAGES)+("%.2f" % sum(stageTotals.values())).rjust(10))
+print("")
+print("%d boards with %d processes in %.2fs (make %.2fs, scanning %d jswrap files %.2fs, generating %.2fs)" %
+      (len(results), jobs, time.time()-startTime, makeTime, len(jswraps), scanTime, buildTime))
+print("Output in "+outdir)
+if failed:
+  print("")
+  print("FAILED ("+str(len(failed))+" boards, see BOARDNAME/log.txt):")
+  for result in failed:
+    print("  "+result["board"].ljust(26)+" "+result["error"])
+  exit(1)
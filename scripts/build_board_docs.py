@@ -25,6 +25,7 @@ sys.path.append(basedir+"scripts");
 sys.path.append(basedir+"boards");
 
 import pinutils;
+import common;
 
 # -----------------------------------------------------------------------------------------
 
@@ -52,7 +53,7 @@ htmlFile = open(htmlFilename, 'w')
 def writeHTML(s): htmlFile.write(s+"\n");
 
 # import the board def
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 # Call the included board_specific file - it sets up 'pins' and 'fill_gaps'
 pins = board.get_pins()
 pins = pinutils.append_devices_to_pin_list(pins, board)
@@ -63,15 +64,10 @@ pins = pinutils.remove_used_pinfunctions(pins, board)
 #  exit(0);
 
 # -----------------------------------------------------------------------------------------
-functionsOnBoard = [];
-
 for pin in pins:
   if pin["name"][0] == 'P':
     pin["name"] = pin["name"][1:];
-  for func in pin["functions"]:
-    if func in pinutils.CLASSES:
-      if not pinutils.CLASSES[func] in functionsOnBoard:
-        functionsOnBoard.append(pinutils.CLASSES[func])
+functionsOnBoard = pins.classes();
 
 #print(json.dumps(functionsOnBoard))
 
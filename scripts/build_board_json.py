@@ -49,7 +49,7 @@ jsonFilename = "boards/"+boardname+".json"
 print("JSON_FILENAME "+jsonFilename)
 print("BOARD "+boardname)
 # import the board def
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 # Call the included board_specific file - it sets up 'pins' and 'fill_gaps'
 pins = board.get_pins()
 pins = pinutils.append_devices_to_pin_list(pins, board)
@@ -78,29 +78,22 @@ for pin in pins:
   if pin["name"][0] == 'P':
     pin["name"] = pin["name"][1:];
   pin["simplefunctions"] = {};
+
+for f in pins.function_classes():
+  pin = f["pin"]
+  name = f["class"]
+  # list for individual pin
   pinfuncs = pin["simplefunctions"]
-  for func in sorted(pin["functions"]):
-    if func in pinutils.CLASSES:       
-      name = pinutils.CLASSES[func]
-   
-      # list for individual pin
-      if name in pinfuncs:
-        pinfuncs[name].append(func)
-      else:
-        pinfuncs[name] = [ func ];
-   
-      # now handle more detailed
-      if name=="SPI" or name=="I2C" or name=="USART":
-        fs = pinutils.ALLOWED_FUNCTIONS[func].split("|")        
-        periph = fs[0][4:]
-        periphpin = fs[1][fs[1].rfind("_")+1:]
-        if not periph in pinperipherals: pinperipherals[periph]={}
-        if not periphpin in pinperipherals[periph]: pinperipherals[periph][periphpin]=[]
-        pinperipherals[periph][periphpin].append(pin["name"])
-      else:
-        if not name in pinperipherals: pinperipherals[name]={}
-        if not "" in pinperipherals[name]: pinperipherals[name][""]=[]
-        pinperipherals[name][""].append(pin["name"]);
+  if name in pinfuncs:
+    pinfuncs[name].append(f["function"])
+  else:
+    pinfuncs[name] = [ f["function"] ];
+  # now handle more detailed (peripheral is eg. SPI1, or the class for ADC/PWM/etc)
+  periph = f["peripheral"]
+  periphpin = f["peripheralPin"]
+  if not periph in pinperipherals: pinperipherals[periph]={}
+  if not periphpin in pinperipherals[periph]: pinperipherals[periph][periphpin]=[]
+  pinperipherals[periph][periphpin].append(pin["name"])
   
 boarddata = {
  "info" : board.info,
@@ -42,6 +42,15 @@ boardName = boardName[2:]
 
 wrapperFileName = sys.argv[len(sys.argv)-1]
 wrapperFileName = wrapperFileName[2:]
+# The generated code is split into several files, so a change to one part only recompiles that part:
+#   main     - wrapperFileName: looking up symbol tables for objects, JS modules, init/idle/kill, etc
+#   symbols  - the symbol tables themselves, and jswBinarySearch
+#   wrappers - the functions for 'generate_full'/'generate_js'
+wrapperFileNames = OrderedDict([
+  ("main", wrapperFileName),
+  ("symbols", wrapperFileName[:-2]+"_symbols.c"),
+  ("wrappers", wrapperFileName[:-2]+"_wrappers.c")
+])
 
 # Load any JS modules specified on command-line
 jsmodules = {}     # JS modules to be included
@@ -71,9 +80,27 @@ argSpecCalls = []
 
 # ------------------------------------------------------------------------------------------------------
 
+# Code is built up in memory for each of wrapperFileNames, and only written by writeWrapperFiles
+# if it's different to what's in the file already, so unchanged files don't get rebuilt
+wrapperCode = OrderedDict([(f,[]) for f in wrapperFileNames])
+wrapperFile = "main" # the file that codeOut currently outputs to
 def codeOut(s):
 #  print str(s)
-  wrapperFile.write(s+"\n");
+  wrapperCode[wrapperFile].append(s)
+
+def writeWrapperFiles(header):
+  for f in wrapperFileNames:
+    filename = wrapperFileNames[f]
+    code = "\n".join(header + wrapperCode[f])+"\n"
+    try:
+      existing = open(filename).read()
+    except (IOError, UnicodeDecodeError):
+      existing = None
+    if existing==code:
+      print(filename+" unchanged")
+    else:
+      print("Writing "+filename)
+      open(filename,'w').write(code)
 
 def FATAL_ERROR(s):
   sys.stderr.write("ERROR: "+s+"\n")
@@ -81,15 +108,21 @@ def FATAL_ERROR(s):
 
 # ------------------------------------------------------------------------------------------------------
 
+def getConstructorFor(className):
+    for jsondata in jsondatas:
+      if jsondata["type"]=="constructor" and jsondata["name"]==className:
+        return jsondata["generate"]
+    return False
+
 def getConstructorTestFor(className, variableName):
     # IMPORTANT - we expect built-in objects to be native functions with a pointer to
     # their constructor function inside
-    for jsondata in jsondatas:
-      if jsondata["type"]=="constructor" and jsondata["name"]==className:
-        if variableName=="constructorPtr": # jsvIsNativeFunction/etc has already been done
-          return "constructorPtr==(void*)"+jsondata["generate"];
-        else:
-          return "jsvIsNativeFunction("+variableName+") && (void*)"+variableName+"->varData.native.ptr==(void*)"+jsondata["generate"];
+    constructor = getConstructorFor(className)
+    if constructor:
+      if variableName=="constructorPtr": # jsvIsNativeFunction/etc has already been done
+        return "constructorPtr==(void*)"+constructor;
+      else:
+        return "jsvIsNativeFunction("+variableName+") && (void*)"+variableName+"->varData.native.ptr==(void*)"+constructor;
     print("No constructor found for "+className)
     exit(1)
 
@@ -109,6 +142,20 @@ def getTestFor(className, static):
     if className=="Function": return "jsvIsFunction(parent)"
     return getConstructorTestFor(className, "constructorPtr");
 
+# For the non-static tests from getTestFor, work out how to check them from a
+# 'switch' on the variable's type (varType = parent->flags&JSV_VARTYPEMASK).
+# Returns (caseLabels, condition). If caseLabels is None the test can't be done
+# with a 'case' and the condition must be checked in the 'default' branch
+def getTypeDispatchFor(className):
+  if className=="Array": return (["JSV_ARRAY"], None)
+  if className=="ArrayBuffer": return (["JSV_ARRAYBUFFER"], "parent->varData.arraybuffer.type==ARRAYBUFFERVIEW_ARRAYBUFFER")
+  if className=="ArrayBufferView": return (["JSV_ARRAYBUFFER"], "parent->varData.arraybuffer.type!=ARRAYBUFFERVIEW_ARRAYBUFFER")
+  if className=="Function": return (["JSV_FUNCTION","JSV_NATIVE_FUNCTION","JSV_FUNCTION_RETURN"], None)
+  # ranges of types - same as JSV_IS_STRING/JSV_IS_NUMERIC in jsvar.c
+  if className=="String": return (None, "varType>=_JSV_STRING_START && varType<=_JSV_STRING_END")
+  if className=="Number": return (None, "varType>=_JSV_NUMERIC_START && varType<=_JSV_NUMERIC_END")
+  return (None, getTestFor(className, False))
+
 def toArgumentType(argName):
   if argName=="": return "JSWAT_VOID";
   if argName=="JsVar": return "JSWAT_JSVAR";
@@ -199,35 +246,406 @@ def getCDeclaration(jsondata, name):
     s.append(toCType(param[1]));
   return toCType(result[0])+" "+name+"("+",".join(s)+")";
 
-def codeOutSymbolTable(builtin):
+# Work out which symbols go in a builtin's symbol table (sorted by name) - sets builtin["symbols"] and builtin["symbolNames"]
+def getSymbolTableSymbols(builtin):
   codeName = builtin["name"]
   # sort by name
   builtin["functions"] = sorted(builtin["functions"], key=lambda n: n["name"]);
-  # output tables
-  listSymbols = []
-  listChars = ""
-  strLen = 0
+  builtin["symbols"] = []
+  builtin["symbolNames"] = []
   for sym in builtin["functions"]:
     symName = sym["name"];
 
     if builtin["name"]=="global" and symName in libraries:
       continue # don't include libraries on global namespace
     if "generate" in sym:
-      listSymbols.append("JSWSYMPTR_ENTRY("+", ".join([str(strLen), getArgumentSpecifier(sym), "(void*)"+sym["generate"]])+")")
-      listChars = listChars + symName + "\\0";
-      strLen = strLen + len(symName) + 1
+      builtin["symbols"].append(sym)
+      builtin["symbolNames"].append(symName)
     else:
       print (codeName + "." + symName+" not included in Symbol Table because no 'generate'")
+
+# Work out one pool of symbol names for all symbol tables, sharing the ends of names
+# ('read' is in 'thread'). Each table points at the start of its names in the pool, so all
+# its names must be within the largest strOffset that'll fit in JswSymPtr of that - any
+# that aren't get their own string (and aren't in the pool). Sets builtin["symbolTablePooled"].
+# If the pool isn't being used (checkOffsets is False) it's only made once, with every
+# table in it, to estimate how much it'd save
+def getSymbolPool(builtins, checkOffsets):
+  if "ESPR_PACKED_SYMPTR" in board.defines:
+    maxSymbolOffset = (1<<12)-1 # top 12 bits of the function pointer
+  else:
+    maxSymbolOffset = 0xFFFF # unsigned short
+  pooled = [builtins[b] for b in builtins if builtins[b]["symbolNames"]]
+  while True:
+    symbolPool = common.get_string_pool([builtin["symbolNames"] for builtin in pooled])
+    if not checkOffsets: break
+    tooFar = []
+    for builtin in pooled:
+      poolOffsets = [symbolPool["offsets"][symName] for symName in builtin["symbolNames"]]
+      if max(poolOffsets)-min(poolOffsets) > maxSymbolOffset:
+        print("Symbols for "+builtin["name"]+" are too far apart in the symbol pool - using a separate string")
+        tooFar.append(builtin)
+    if not tooFar: break
+    pooled = [builtin for builtin in pooled if not builtin in tooFar]
+  for b in builtins:
+    builtins[b]["symbolTablePooled"] = builtins[b] in pooled
+  return symbolPool
+
+# Output a builtin's symbol table. If symbolPool is set and the table is in it (see
+# getSymbolPool) we use that for the names rather than a string per table
+def codeOutSymbolTable(builtin, symbolPool):
+  codeName = builtin["name"]
+  offsets = []
+  listChars = ""
+  strLen = 0
+  for symName in builtin["symbolNames"]:
+    offsets.append(strLen)
+    listChars = listChars + symName + "\\0";
+    strLen = strLen + len(symName) + 1
+  builtin["symbolTableChars"] = "\""+listChars+"\"";
+  builtin["symbolTableCharsLen"] = strLen
+  builtin["symbolTableCharsPtr"] = "jswSymbols_"+codeName+"_str"
+  if symbolPool and builtin["symbolTablePooled"]:
+    poolOffsets = [symbolPool["offsets"][symName] for symName in builtin["symbolNames"]]
+    base = min(poolOffsets)
+    offsets = [offset-base for offset in poolOffsets]
+    builtin["symbolTableCharsPtr"] = "&jswSymbolPool["+str(base)+"]"
   if strLen > 4096*1024:
     print("ERROR: strOffset is too long for packing into the function pointer")
     exit(1)
-  builtin["symbolTableChars"] = "\""+listChars+"\"";
+  listSymbols = []
+  for sym, offset in zip(builtin["symbols"], offsets):
+    listSymbols.append("JSWSYMPTR_ENTRY("+", ".join([str(offset), getArgumentSpecifier(sym), "(void*)"+sym.get("profileGenerate", sym["generate"])])+")")
   builtin["symbolTableCount"] = str(len(listSymbols));
   codeOut("static const JswSymPtr jswSymbols_"+codeName+"[] FLASH_SECT = {\n  "+",\n  ".join(listSymbols)+"\n};");
 
+# Work out a perfect hash for a symbol table (see common.get_perfect_hash), and output it if ESPR_SYMBOL_HASH.
+# If a name is in the table twice (eg. different implementations for different boards) we use the first.
+# Returns the amount of flash the hash needs
+def codeOutSymbolTableHash(builtin):
+  names = builtin["symbolNames"]
+  uniqueNames = [name for i,name in enumerate(names) if names.index(name)==i]
+  phash = common.get_perfect_hash(uniqueNames, len(names))
+  if not phash:
+    if len(names): print("WARNING: No perfect hash found for "+builtin["name"]+" - using binary search")
+    builtin["symbolTableHashPtrs"] = "0, 0"
+    builtin["symbolTableHashParams"] = "0, 0"
+    return 0
+  index = [names.index(uniqueNames[i]) for i in phash["index"]]
+  if symbolHash:
+    codeOut("static const unsigned char jswSymbols_"+builtin["name"]+"_hashDisplacements[] FLASH_SECT = { "+", ".join([str(d) for d in phash["displacements"]])+" };");
+    codeOut("static const unsigned char jswSymbols_"+builtin["name"]+"_hashIndex[] FLASH_SECT = { "+", ".join([str(i) for i in index])+" };");
+  builtin["symbolTableHashPtrs"] = "jswSymbols_"+builtin["name"]+"_hashDisplacements, jswSymbols_"+builtin["name"]+"_hashIndex"
+  builtin["symbolTableHashParams"] = str(phash["seed"])+", "+str(phash["buckets"])
+  # seed + bucket count + 2 pointers in JswSymList, plus the two arrays
+  return 2 + 2*4 + len(phash["displacements"]) + len(index)
+
+# Lookup counts for builtin symbols - see codeOutSymbolProfile. If JSWRAP_SYMBOL_PROFILE is set to the
+# file written by a build with ESPR_SYMBOL_PROFILE we use it to add a 'hot set' of the most used
+# symbols in each table, that jswBinarySearch checks first
+SYMBOL_HOT_SET_SIZE = 4
+SYMBOL_HOT_SET_MIN_SHARE = 0.1 # only put symbols in the hot set if they're at least this fraction of lookups for the table
+symbolProfileCounts = {} # { (table, name) : count }
+if os.environ.get("JSWRAP_SYMBOL_PROFILE"):
+  print("Loading symbol profile "+os.environ["JSWRAP_SYMBOL_PROFILE"])
+  for line in open(os.environ["JSWRAP_SYMBOL_PROFILE"]).read().splitlines():
+    fields = line.split("\t")
+    if len(fields)!=3: continue
+    key = (fields[0], fields[1])
+    symbolProfileCounts[key] = symbolProfileCounts.get(key, 0) + int(fields[2])
+
+def getSymbolHotSet(builtin):
+  counts = [symbolProfileCounts.get((builtin["name"], symName), 0) for symName in builtin["symbolNames"]]
+  total = sum(counts)
+  hotSet = []
+  for idx in sorted(range(len(counts)), key=lambda i: -counts[i])[:SYMBOL_HOT_SET_SIZE]:
+    if counts[idx]>0 and counts[idx] >= total*SYMBOL_HOT_SET_MIN_SHARE and idx<255 and not builtin["symbolNames"][idx] in [builtin["symbolNames"][i] for i in hotSet]:
+      hotSet.append(idx)
+  return hotSet
+
+# Output code to count how many times each symbol is found by jswBinarySearch, which is
+# written to the file in the ESPR_SYMBOL_PROFILE_FILE environment variable (or symbol_profile.txt)
+# at exit as 'table<tab>name<tab>count' lines. Only for builds (eg. Linux) with stdio.
+def codeOutSymbolProfile():
+  starts = []
+  count = 0
+  for b in builtins:
+    starts.append(str(count))
+    count += len(builtins[b]["symbolNames"])
+  codeOut("#include <stdio.h>")
+  codeOut("#include <stdlib.h>")
+  codeOut("static uint32_t jswSymbolProfileCounts["+str(max(count,1))+"];")
+  codeOut("static const unsigned short jswSymbolProfileStart[] = { "+", ".join(starts)+" };")
+  codeOut("static const char *jswSymbolProfileTableNames[] = { "+", ".join(['"'+builtins[b]["name"]+'"' for b in builtins])+" };")
+  codeOut("""static bool jswSymbolProfileStarted = false;
+
+static void jswSymbolProfileDump() {
+  const char *filename = getenv("ESPR_SYMBOL_PROFILE_FILE");
+  FILE *f = fopen(filename ? filename : "symbol_profile.txt", "a");
+  if (!f) return;
+  for (unsigned int t=0;t<sizeof(jswSymbolTables)/sizeof(JswSymList);t++) {
+    const JswSymList *symbolsPtr = &jswSymbolTables[t];
+    for (unsigned int i=0;i<symbolsPtr->symbolCount;i++) {
+      uint32_t count = jswSymbolProfileCounts[jswSymbolProfileStart[t]+i];
+      if (count) fprintf(f, "%s\\t%s\\t%u\\n", jswSymbolProfileTableNames[t], &symbolsPtr->symbolChars[JSWSYMPTR_OFFSET(&symbolsPtr->symbols[i])], (unsigned int)count);
+    }
+  }
+  fclose(f);
+}
+
+static void jswSymbolProfileFound(const JswSymList *symbolsPtr, const JswSymPtr *sym) {
+  if (!jswSymbolProfileStarted) {
+    jswSymbolProfileStarted = true;
+    atexit(jswSymbolProfileDump);
+  }
+  jswSymbolProfileCounts[jswSymbolProfileStart[symbolsPtr - jswSymbolTables] + (sym - symbolsPtr->symbols)]++;
+}
+""")
+
+# Print the most looked-up symbols in the profile
+def printSymbolProfileReport():
+  if not symbolProfileCounts: return
+  total = sum(symbolProfileCounts.values())
+  print("Most looked-up builtin symbols ("+str(total)+" lookups in profile):")
+  for key in sorted(symbolProfileCounts, key=lambda k: -symbolProfileCounts[k])[:20]:
+    print("  "+str(symbolProfileCounts[key]).rjust(10)+"  "+key[0]+"."+key[1])
+  hotSets = 0
+  for b in builtins:
+    if builtins[b]["symbolHotSet"]: hotSets += 1
+  print("Symbol hot sets added to "+str(hotSets)+" symbol tables")
+
+# Get the name a builtin symbol is reported as by E.getBuiltinProfile (eg. 'Math.sin', 'String.prototype.charAt')
+def getBuiltinProfileName(builtin, sym):
+  if builtin["className"]=="global": return sym["name"]
+  if builtin["isProto"]: return builtin["className"]+".prototype."+sym["name"]
+  return builtin["className"]+"."+sym["name"]
+
+# Output a wrapper for every function in the symbol tables that counts how many times it is called
+# and the total time spent in it (including any builtins it calls), and jswGetBuiltinProfile to return
+# the counts (for E.getBuiltinProfile). Sets sym["profileGenerate"] to the wrapper, which the symbol
+# table then points to. Constructors and BUILTIN_PROFILE_UNWRAPPED aren't wrapped as their function
+# pointers are compared against to identify them.
+BUILTIN_PROFILE_UNWRAPPED = [
+  "jswrap_eval", # jspeFunctionCall
+  "jswrap_object_toString", # jsvAsString, jsfGetJSONWithCallback
+]
+def codeOutBuiltinProfile():
+  profileNames = [] # one counter for each name
+  wrappers = []
+  for b in builtins:
+    builtin = builtins[b]
+    for sym in builtin["symbols"]:
+      if sym["type"]=="constructor" or sym["generate"] in BUILTIN_PROFILE_UNWRAPPED: continue
+      name = getBuiltinProfileName(builtin, sym)
+      if not name in profileNames: profileNames.append(name)
+      idx = profileNames.index(name)
+      sym["profileGenerate"] = "jswProfile_"+str(len(wrappers))
+      if sym["type"]=="object":
+        params, result, this = [], ["JsVar"], False
+      else:
+        params, result, this = getParams(sym), getResult(sym), hasThis(sym)
+      # Call through a pointer of the type jsnCallFunction would use, so we match its behaviour
+      types = [ ]
+      if this: types.append("JsVar*")
+      for param in params: types.append(toCType(param[1]))
+      args = ["a"+str(i) for i in range(len(types))]
+      call = "(("+toCType(result[0])+"(*)("+", ".join(types)+"))"+sym["generate"]+")("+", ".join(args)+")"
+      code = "static "+toCType(result[0])+" "+sym["profileGenerate"]+"("+", ".join([t+" "+a for t,a in zip(types,args)])+") {\n"
+      code += "  JsSysTime t = jshGetSystemTime();\n"
+      if result[0]:
+        code += "  "+toCType(result[0])+" r = "+call+";\n"
+      else:
+        code += "  "+call+";\n"
+      code += "  jswBuiltinProfileAdd("+str(idx)+", t);\n"
+      if result[0]:
+        code += "  return r;\n"
+      code += "}"
+      wrappers.append(code)
+  codeOut("// Call counts and time for each builtin (ESPR_BUILTIN_PROFILE)")
+  codeOut("#include \"jshardware.h\"")
+  codeOut("typedef struct {")
+  codeOut("  uint32_t calls;")
+  codeOut("  JsSysTime time;")
+  codeOut("} JswBuiltinProfile;")
+  codeOut("static JswBuiltinProfile jswBuiltinProfile["+str(max(len(profileNames),1))+"];")
+  codeOut("static const char *jswBuiltinProfileNames[] = {\n  "+",\n  ".join(['"'+name+'"' for name in profileNames])+"\n};")
+  codeOut("""
+static void jswBuiltinProfileAdd(unsigned int idx, JsSysTime startTime) {
+  jswBuiltinProfile[idx].calls++;
+  jswBuiltinProfile[idx].time += jshGetSystemTime() - startTime;
+}
+
+JsVar *jswGetBuiltinProfile(bool reset) {
+  JsVar *profile = jsvNewObject();
+  if (!profile) return 0;
+  for (unsigned int i=0;i<sizeof(jswBuiltinProfileNames)/sizeof(const char *);i++) {
+    if (!jswBuiltinProfile[i].calls) continue;
+    JsVar *entry = jsvNewObject();
+    if (!entry) break;
+    jsvObjectSetChildAndUnLock(entry, "calls", jsvNewFromInteger((JsVarInt)jswBuiltinProfile[i].calls));
+    jsvObjectSetChildAndUnLock(entry, "time", jsvNewFromFloat(jshGetMillisecondsFromTime(jswBuiltinProfile[i].time)));
+    jsvObjectSetChildAndUnLock(profile, jswBuiltinProfileNames[i], entry);
+  }
+  if (reset) memset(jswBuiltinProfile, 0, sizeof(jswBuiltinProfile));
+  return profile;
+}
+""")
+  for code in wrappers:
+    codeOut(code)
+    codeOut("")
+  print("Builtin profiling: "+str(len(wrappers))+" functions wrapped, "+str(len(profileNames))+" counters")
+
+# In jswBinarySearch we used to use READ_FLASH_UINT16 for sym->strOffset and sym->functionSpec for ESP8266
+# (where unaligned reads broke) but despite being packed, the structure JswSymPtr is still always an multiple
+# of 2 in length so they will always be halfword aligned.
+def codeOutBinarySearch():
+  if symbolProfile:
+    codeOut("")
+    codeOutSymbolProfile()
+  hotSets = any(builtins[b]["symbolHotSet"] for b in builtins)
+  if hotSets:
+    codeOut("")
+    codeOut("// Most used symbols in each table (from JSWRAP_SYMBOL_PROFILE) - checked before searching. 255 = unused")
+    codeOut("#define JSW_HOT_SET_SIZE "+str(SYMBOL_HOT_SET_SIZE))
+    codeOut("static const unsigned char jswSymbolHotSets[]["+str(SYMBOL_HOT_SET_SIZE)+"] FLASH_SECT = {")
+    for b in builtins:
+      hotSet = builtins[b]["symbolHotSet"]
+      codeOut("  { "+", ".join([str(i) for i in hotSet] + ["255"]*(SYMBOL_HOT_SET_SIZE-len(hotSet)))+" }, // "+builtins[b]["name"])
+    codeOut("};")
+  if symbolHash:
+    codeOut("")
+    codeOutHashFunction()
+  codeOut("""
+// Return the JsVar for a symbol found in a symbol table
+static JsVar *jswCreateFromSymbol(const JswSymList *symbolsPtr, const JswSymPtr *sym, JsVar *parent) {""")
+  if symbolProfile:
+    codeOut("  jswSymbolProfileFound(symbolsPtr, sym);")
+  else:
+    codeOut("  NOT_USED(symbolsPtr);")
+  codeOut("""  unsigned short functionSpec = READ_FLASH_UINT16(&sym->functionSpec);
+  if ((functionSpec & JSWAT_EXECUTE_IMMEDIATELY_MASK) == JSWAT_EXECUTE_IMMEDIATELY)
+    return jsnCallFunction(JSWSYMPTR_FUNCTION_PTR(sym), functionSpec, parent, 0, 0);
+  return jsvNewNativeFunction(JSWSYMPTR_FUNCTION_PTR(sym), functionSpec);
+}
+
+// Binary search coded to allow for JswSyms to be in flash on the esp8266 where they require
+// word accesses
+JsVar *jswBinarySearch(const JswSymList *symbolsPtr, JsVar *parent, const char *name) {
+  uint8_t symbolCount = READ_FLASH_UINT8(&symbolsPtr->symbolCount);""");
+  if hotSets:
+    codeOut("""  const unsigned char *hotSet = jswSymbolHotSets[symbolsPtr - jswSymbolTables];
+  for (int i=0;i<JSW_HOT_SET_SIZE;i++) {
+    unsigned char idx = READ_FLASH_UINT8(&hotSet[i]);
+    if (idx==255) break;
+    const JswSymPtr *sym = &symbolsPtr->symbols[idx];
+    if (FLASH_STRCMP(name, &symbolsPtr->symbolChars[JSWSYMPTR_OFFSET(sym)])==0)
+      return jswCreateFromSymbol(symbolsPtr, sym, parent);
+  }""");
+  if symbolHash:
+    codeOut("""  uint8_t hashBuckets = READ_FLASH_UINT8(&symbolsPtr->hashBuckets);
+  if (hashBuckets) {
+    // Perfect hash, so just one hash and one compare (see common.get_perfect_hash)
+    uint32_t h = jswSymbolHash(name, READ_FLASH_UINT8(&symbolsPtr->hashSeed));
+    unsigned int slot = ((h>>16) + READ_FLASH_UINT8(&symbolsPtr->hashDisplacements[h % hashBuckets])) % symbolCount;
+    const JswSymPtr *sym = &symbolsPtr->symbols[READ_FLASH_UINT8(&symbolsPtr->hashIndex[slot])];
+    if (FLASH_STRCMP(name, &symbolsPtr->symbolChars[JSWSYMPTR_OFFSET(sym)])!=0) return 0;
+    return jswCreateFromSymbol(symbolsPtr, sym, parent);
+  }""");
+  codeOut("""  int searchMin = 0;
+  int searchMax = symbolCount - 1;
+  while (searchMin <= searchMax) {
+    int idx = (searchMin+searchMax) >> 1;
+    const JswSymPtr *sym = &symbolsPtr->symbols[idx];
+    int cmp = FLASH_STRCMP(name, &symbolsPtr->symbolChars[JSWSYMPTR_OFFSET(sym)]);
+    if (cmp==0) {
+      return jswCreateFromSymbol(symbolsPtr, sym, parent);
+    } else {
+      if (cmp<0) {
+        // searchMin is the same
+        searchMax = idx-1;
+      } else {
+        searchMin = idx+1;
+        // searchMax is the same
+      }
+    }
+  }
+  return 0;
+}
+""");
+
 def codeOutBuiltins(indent, builtin):
   codeOut(indent+"jswBinarySearch(&jswSymbolTables["+builtin["indexName"]+"], parent, name);");
 
+# Output the hash function used for perfect hashes (only once in each file) and return its
+# name. It's static, so is named differently in each file in case they're all concatenated (ESPR_EMBED)
+hashFunctionOutput = [] # files it has been output to
+def codeOutHashFunction():
+  fnName = "jswSymbolHash" if wrapperFile=="symbols" else "jswNameHash"
+  if not wrapperFile in hashFunctionOutput:
+    codeOut(common.get_perfect_hash_c_function(fnName));
+    hashFunctionOutput.append(wrapperFile)
+  return fnName
+
+# Output 'static int fnName(const char *name)' which returns the index of name in
+# the list of names that we return (or -1 if not found). How it's done depends on
+# how many names there are:
+#  * A few: a chain of strcmp (smallest)
+#  * More: a table of names sorted so we can binary search
+#  * Lots: a perfect hash (see common.get_perfect_hash) so it's one strcmp
+# The returned list may be in a different order to 'names' (eg. sorted) so the
+# caller should output any table of results using that
+NAME_LOOKUP_CHAIN_MAX = 4
+NAME_LOOKUP_HASH_MIN = 16
+def codeOutNameLookup(fnName, names):
+  names = list(OrderedDict.fromkeys(names)) # first one wins, like a chain of ifs would
+  phash = False
+  if len(names) >= NAME_LOOKUP_HASH_MIN:
+    phash = common.get_perfect_hash(names)
+  if len(names) > NAME_LOOKUP_CHAIN_MAX and not phash:
+    names = sorted(names, key=lambda n: n.encode("latin-1")) # same order as strcmp
+  if phash: print(fnName+": "+str(len(names))+" names, using perfect hash")
+  elif len(names) > NAME_LOOKUP_CHAIN_MAX: print(fnName+": "+str(len(names))+" names, using binary search")
+  else: print(fnName+": "+str(len(names))+" names, using strcmp")
+  if len(names) > NAME_LOOKUP_CHAIN_MAX:
+    offsets = []
+    offset = 0
+    for name in names:
+      offsets.append(str(offset))
+      offset += len(name)+1
+    codeOut("FLASH_STR("+fnName+"_names, \""+"\\0".join(names)+"\");")
+    codeOut("static const unsigned short "+fnName+"_offsets[] FLASH_SECT = { "+", ".join(offsets)+" };")
+  if phash:
+    hashFn = codeOutHashFunction()
+    codeOut("static const unsigned char "+fnName+"_hashDisplacements[] FLASH_SECT = { "+", ".join([str(d) for d in phash["displacements"]])+" };")
+    codeOut("static const unsigned char "+fnName+"_hashIndex[] FLASH_SECT = { "+", ".join([str(i) for i in phash["index"]])+" };")
+    codeOut("static int "+fnName+"(const char *name) {")
+    codeOut("  uint32_t h = "+hashFn+"(name, "+str(phash["seed"])+");")
+    codeOut("  unsigned int slot = ((h>>16) + READ_FLASH_UINT8(&"+fnName+"_hashDisplacements[h % "+str(phash["buckets"])+"])) % "+str(len(names))+";")
+    codeOut("  int idx = READ_FLASH_UINT8(&"+fnName+"_hashIndex[slot]);")
+    codeOut("  return FLASH_STRCMP(name, &"+fnName+"_names[READ_FLASH_UINT16(&"+fnName+"_offsets[idx])]) ? -1 : idx;")
+    codeOut("}")
+  elif len(names) > NAME_LOOKUP_CHAIN_MAX:
+    codeOut("static int "+fnName+"(const char *name) {")
+    codeOut("  int searchMin = 0;")
+    codeOut("  int searchMax = "+str(len(names)-1)+";")
+    codeOut("  while (searchMin <= searchMax) {")
+    codeOut("    int idx = (searchMin+searchMax) >> 1;")
+    codeOut("    int cmp = FLASH_STRCMP(name, &"+fnName+"_names[READ_FLASH_UINT16(&"+fnName+"_offsets[idx])]);")
+    codeOut("    if (cmp==0) return idx;")
+    codeOut("    if (cmp<0) searchMax = idx-1;")
+    codeOut("    else searchMin = idx+1;")
+    codeOut("  }")
+    codeOut("  return -1;")
+    codeOut("}")
+  else:
+    codeOut("static int "+fnName+"(const char *name) {")
+    if not names: codeOut("  NOT_USED(name);")
+    for idx in range(len(names)):
+      codeOut("  if (!strcmp(name, \""+names[idx]+"\")) return "+str(idx)+";")
+    codeOut("  return -1;")
+    codeOut("}")
+  return names
+
 #================== to remove JS-definitions given by blacklist==============
 def delete_by_indices(lst, indices):
     indices_as_set = set(indices)
@@ -277,9 +695,21 @@ def removeBlacklistForWrapper(blacklistfile,datas):
 # ------------------------------------------------------------------------------------------------------
 
 print("BOARD "+boardName)
-board = importlib.import_module(boardName)
+board = common.get_board(boardName)
 
 jsondatas = common.get_jsondata(is_for_document = False, parseArgs = True, boardObject = board)
+# Should symbol tables be looked up with perfect hashes rather than binary search?
+symbolHash = "ESPR_SYMBOL_HASH" in board.defines
+useSymbolPool = "ESPR_SYMBOL_POOL" in board.defines
+symbolProfile = "ESPR_SYMBOL_PROFILE" in board.defines
+# Should calls to every builtin function be counted and timed (for E.getBuiltinProfile)?
+builtinProfile = "ESPR_BUILTIN_PROFILE" in board.defines
+# Should built-in JS modules be stored pretokenised and/or heatshrink compressed?
+pretokeniseJSModules = "ESPR_PRETOKENISE_JSMODULES" in board.defines
+compressJSModules = "ESPR_COMPRESS_JSMODULES" in board.defines
+if compressJSModules and not "USE_HEATSHRINK" in board.defines:
+  print("WARNING: ESPR_COMPRESS_JSMODULES needs heatshrink (USE_HEATSHRINK) - JS modules will not be compressed")
+  compressJSModules = False
 if 'BLACKLIST' in os.environ:
 	jsondatas = removeBlacklistForWrapper(os.environ['BLACKLIST'],jsondatas)
 
@@ -312,19 +742,24 @@ for className in classes:
 #print(json.dumps(tree, sort_keys=True, indent=2))
 # ------------------------------------------------------------------------------------------------------
 
-wrapperFile = open(wrapperFileName,'w')
-
-codeOut('// Automatically generated wrapper file ')
-codeOut('// Generated by scripts/build_jswrapper.py');
-codeOut('');
-codeOut('#include "jswrapper.h"');
-codeOut('#include "jsnative.h"');
-codeOut('#include "jsparse.h"');
+# Output to the start of every file
+wrapperHeader = [
+  '// Automatically generated wrapper file ',
+  '// Generated by scripts/build_jswrapper.py',
+  '',
+  '#include "jswrapper.h"',
+  '#include "jsnative.h"',
+  '#include "jsparse.h"']
 for include in includes:
-  codeOut('#include "'+include+'"');
-codeOut('');
-codeOut('');
+  wrapperHeader.append('#include "'+include+'"')
+wrapperHeader.append('')
+# For the ESP8266 we want to put the structures into flash, we need a fresh section 'cause the
+# .irom.literal section used elsewhere has different readability attributes, sigh
+wrapperHeader.append("#ifdef ESP8266\n#define FLASH_SECT __attribute__((section(\".irom.literal2\"))) __attribute__((aligned(4)))")
+wrapperHeader.append("#else\n#define FLASH_SECT\n#endif\n")
+wrapperDeclarations = [] # declarations for the functions in the 'wrappers' file
 
+wrapperFile = "wrappers"
 codeOut('// -----------------------------------------------------------------------------------------');
 codeOut('// ----------------------------------------------------------------- AUTO-GENERATED WRAPPERS');
 codeOut('// -----------------------------------------------------------------------------------------');
@@ -350,7 +785,8 @@ for jsondata in jsondatas:
       for param in params:
         s.append(toCType(param[1])+" "+param[0]);
 
-    codeOut("static "+toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {");
+    wrapperDeclarations.append(toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+");")
+    codeOut(toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {");
     if result[0]:
       codeOut("  return "+jsondata["generate_full"]+";");
     else:
@@ -392,7 +828,8 @@ for jsondata in jsondatas:
     if hasThis(jsondata): statement = statement + ", parent"
     else: statement = statement + ", NULL"
 
-    codeOut("static "+toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {")
+    wrapperDeclarations.append(toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+");")
+    codeOut(toCType(result[0])+" "+jsondata["generate"]+"("+", ".join(s)+") {")
     if len(params):
       codeOut("  JsVar *args[] = {");
       for param in params:
@@ -414,47 +851,11 @@ codeOut('// --------------------------------------------------------------------
 codeOut('// -----------------------------------------------------------------------------------------');
 codeOut('// -----------------------------------------------------------------------------------------');
 codeOut('');
-
-
-# In jswBinarySearch we used to use READ_FLASH_UINT16 for sym->strOffset and sym->functionSpec for ESP8266
-# (where unaligned reads broke) but despite being packed, the structure JswSymPtr is still always an multiple
-# of 2 in length so they will always be halfword aligned.
-codeOut("""
-// Binary search coded to allow for JswSyms to be in flash on the esp8266 where they require
-// word accesses
-JsVar *jswBinarySearch(const JswSymList *symbolsPtr, JsVar *parent, const char *name) {
-  uint8_t symbolCount = READ_FLASH_UINT8(&symbolsPtr->symbolCount);
-  int searchMin = 0;
-  int searchMax = symbolCount - 1;
-  while (searchMin <= searchMax) {
-    int idx = (searchMin+searchMax) >> 1;
-    const JswSymPtr *sym = &symbolsPtr->symbols[idx];
-    int cmp = FLASH_STRCMP(name, &symbolsPtr->symbolChars[JSWSYMPTR_OFFSET(sym)]);
-    if (cmp==0) {
-      unsigned short functionSpec = READ_FLASH_UINT16(&sym->functionSpec);
-      if ((functionSpec & JSWAT_EXECUTE_IMMEDIATELY_MASK) == JSWAT_EXECUTE_IMMEDIATELY)
-        return jsnCallFunction(JSWSYMPTR_FUNCTION_PTR(sym), functionSpec, parent, 0, 0);
-      return jsvNewNativeFunction(JSWSYMPTR_FUNCTION_PTR(sym), functionSpec);
-    } else {
-      if (cmp<0) {
-        // searchMin is the same
-        searchMax = idx-1;
-      } else {
-        searchMin = idx+1;
-        // searchMax is the same
-      }
-    }
-  }
-  return 0;
-}
-
-""");
-
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('// -----------------------------------------------------------------------------------------');
-codeOut('');
 codeOut('');
+wrapperHeader.append("// Functions in "+os.path.basename(wrapperFileNames["wrappers"]))
+wrapperHeader += wrapperDeclarations
+wrapperHeader.append("")
+wrapperHeader.append("")
 
 print("Finding Libraries")
 libraries = []
@@ -488,56 +889,187 @@ for jsondata in jsondatas:
       builtins[testCode] = { "name" : builtinName, "className" : className, "isProto" : isProto, "functions" : [] }
     builtins[testCode]["functions"].append(jsondata);
 
-# For the ESP8266 we want to put the structures into flash, we need a fresh section 'cause the
-# .irom.literal section used elsewhere has different readability attributes, sigh
-codeOut("#ifdef ESP8266\n#define FLASH_SECT __attribute__((section(\".irom.literal2\"))) __attribute__((aligned(4)))");
-codeOut("#else\n#define FLASH_SECT\n#endif\n");
-
+wrapperFile = "symbols"
 print("Outputting Symbol Tables")
+for b in builtins:
+  getSymbolTableSymbols(builtins[b])
+  builtins[b]["symbolHotSet"] = getSymbolHotSet(builtins[b])
+if builtinProfile:
+  codeOutBuiltinProfile()
+symbolPool = getSymbolPool(builtins, useSymbolPool)
+if useSymbolPool:
+  codeOut("FLASH_STR(jswSymbolPool, \""+symbolPool["pool"].replace("\0","\\0")+"\");");
 idx = 0
+symbolHashBytes = 0
 for b in builtins:
   builtin = builtins[b]
-  codeOutSymbolTable(builtin);
+  codeOutSymbolTable(builtin, symbolPool if useSymbolPool else False);
+  symbolHashBytes += codeOutSymbolTableHash(builtin);
   builtins[b]["indexName"] = "jswSymbolIndex_"+builtin["name"];
-  codeOut("static const unsigned char "+builtin["indexName"]+" = "+str(idx)+";");
+  builtins[b]["index"] = idx
   idx = idx + 1
+if symbolHash:
+  print("Symbol table perfect hashes use "+str(symbolHashBytes)+" bytes of flash on "+boardName+" (with 32 bit pointers)")
+else:
+  print("Symbol table perfect hashes would use "+str(symbolHashBytes)+" bytes of flash on "+boardName+" (with 32 bit pointers) - add -DESPR_SYMBOL_HASH to enable")
 codeOut('');
 codeOut('');
 
 # output the strings, possibly with __attribute__ to put them into flash
+symbolCharsBytes = 0
+symbolPoolBytes = len(symbolPool["pool"])
 for b in builtins:
   builtin = builtins[b]
-  codeOut("FLASH_STR(jswSymbols_"+builtin["name"]+"_str, " + builtin["symbolTableChars"] +");");
+  symbolCharsBytes += builtin["symbolTableCharsLen"]
+  if not builtin["symbolTablePooled"]:
+    symbolPoolBytes += builtin["symbolTableCharsLen"]
+  if not (useSymbolPool and builtin["symbolTablePooled"]):
+    codeOut("FLASH_STR(jswSymbols_"+builtin["name"]+"_str, " + builtin["symbolTableChars"] +");");
+if useSymbolPool:
+  print("Symbol string pool saves "+str(symbolCharsBytes-symbolPoolBytes)+" bytes of flash on "+boardName+" ("+str(symbolPoolBytes)+" bytes instead of "+str(symbolCharsBytes)+")")
+else:
+  print("Symbol string pool would save "+str(symbolCharsBytes-symbolPoolBytes)+" bytes of flash on "+boardName+" ("+str(symbolPoolBytes)+" bytes instead of "+str(symbolCharsBytes)+") - add -DESPR_SYMBOL_POOL to enable")
 codeOut('');
 # output the symbol table array referencing the above strings
 codeOut('const JswSymList jswSymbolTables[] FLASH_SECT = {');
 for b in builtins:
   builtin = builtins[b]
-  codeOut("  {"+", ".join(["jswSymbols_"+builtin["name"], "jswSymbols_"+builtin["name"]+"_str", builtin["symbolTableCount"]])+"},");
+  # same order as JswSymList - pointers first so they stay aligned
+  fields = ["jswSymbols_"+builtin["name"], builtin["symbolTableCharsPtr"]]
+  if symbolHash: fields.append(builtin["symbolTableHashPtrs"])
+  fields.append(builtin["symbolTableCount"])
+  if symbolHash: fields.append(builtin["symbolTableHashParams"])
+  codeOut("  {"+", ".join(fields)+"},");
 codeOut('};');
+codeOutBinarySearch()
+printSymbolProfileReport()
 
+wrapperFile = "main"
+codeOut("// Symbol tables (in "+os.path.basename(wrapperFileNames["symbols"])+")")
+codeOut("extern const JswSymList jswSymbolTables[];")
+for b in builtins:
+  codeOut("static const unsigned char "+builtins[b]["indexName"]+" = "+str(builtins[b]["index"])+";")
 codeOut('');
 codeOut('');
 
-codeOut('const JswSymList *jswGetSymbolListForConstructorProto(JsVar *constructor) {')
-codeOut('  void *constructorPtr = constructor->varData.native.ptr;')
+# Work out which symbol tables we get to from each built-in constructor function. These
+# used to be chains of 'if (ptr==X)' but now it's one table that we scan
+nativeCheck = "jsvIsNativeFunction(parent) && "
+constructorSymbols = OrderedDict()
+def addConstructorSymbols(constructor, field, builtin):
+  if not constructor in constructorSymbols:
+    constructorSymbols[constructor] = { "staticSymbols" : "JSW_NO_SYMBOLS", "basicProtoSymbols" : "JSW_NO_SYMBOLS", "protoSymbols" : "JSW_NO_SYMBOLS" }
+  if constructorSymbols[constructor][field]=="JSW_NO_SYMBOLS": # first match wins
+    constructorSymbols[constructor][field] = builtin["indexName"]
 for className in builtins:
   builtin = builtins[className]
+  if className in ["parent","!parent"]: continue
+  if not builtin["isProto"] and className.startswith(nativeCheck):
+    addConstructorSymbols(getConstructorFor(builtin["className"]), "staticSymbols", builtin)
   if builtin["isProto"] and "constructorPtr" in className:
-    codeOut("  if ("+className+") return &jswSymbolTables["+builtin["indexName"]+"];");
+    addConstructorSymbols(getConstructorFor(builtin["className"]), "protoSymbols", builtin)
+  if builtin["isProto"] and not "constructorPtr" in className:
+    constructor = getConstructorFor(builtin["className"])
+    if constructor:
+      addConstructorSymbols(constructor, "basicProtoSymbols", builtin)
+
+codeOut('#define JSW_NO_SYMBOLS 255')
+codeOut('typedef struct {')
+codeOut('  void *constructor; ///< Pointer to the native constructor function')
+codeOut('  unsigned char staticSymbols; ///< Symbols on the constructor itself (eg. Math.sin)')
+codeOut('  unsigned char basicProtoSymbols; ///< Prototype for a basic type (eg. String.prototype)')
+codeOut('  unsigned char protoSymbols; ///< Prototype for objects created with the constructor (eg. Date.prototype)')
+codeOut('} JswConstructorSymbols;')
+codeOut('')
+codeOut('static const JswConstructorSymbols jswConstructorSymbols[] FLASH_SECT = {')
+for constructor in constructorSymbols:
+  c = constructorSymbols[constructor]
+  codeOut("  {(void*)"+constructor+", "+c["staticSymbols"]+", "+c["basicProtoSymbols"]+", "+c["protoSymbols"]+"},")
+codeOut('  {0, JSW_NO_SYMBOLS, JSW_NO_SYMBOLS, JSW_NO_SYMBOLS}') # so we never have an empty array
+codeOut('};')
+codeOut('')
+codeOut('/// Return the symbol table with the given index in jswSymbolTables, or 0 if JSW_NO_SYMBOLS')
+codeOut('static const JswSymList *jswGetSymbolListFromIndex(unsigned char idx) {')
+codeOut('  return (idx==JSW_NO_SYMBOLS) ? 0 : &jswSymbolTables[idx];')
+codeOut('}')
+codeOut('')
+codeOut('/// Find the jswConstructorSymbols entry for the given native function, or 0')
+codeOut('static const JswConstructorSymbols *jswFindConstructorSymbols(JsVar *nativeFunction) {')
+codeOut('  void *constructorPtr = nativeFunction->varData.native.ptr;')
+codeOut('  const JswConstructorSymbols *c = jswConstructorSymbols;')
+codeOut('  while (c->constructor) {')
+codeOut('    if (c->constructor==constructorPtr) return c;')
+codeOut('    c++;')
+codeOut('  }')
 codeOut('  return 0;')
 codeOut('}')
+codeOut('')
+codeOut('')
+
+codeOut('const JswSymList *jswGetSymbolListForConstructorProto(JsVar *constructor) {')
+codeOut('  const JswConstructorSymbols *c = jswFindConstructorSymbols(constructor);')
+codeOut('  return c ? jswGetSymbolListFromIndex(READ_FLASH_UINT8(&c->protoSymbols)) : 0;')
+codeOut('}')
 
 codeOut('')
 codeOut('')
 
+# Output a 'switch' on the variable's type that checks all the basic types
+# (String/Array/etc) for a symbol table, in the same order as the old chain
+# of if (jsvIsX(parent)) checks. 'codeOutMatch' is called to output the code
+# for each table that matches
+def codeOutTypeSwitch(indent, codeOutMatch):
+  cases = OrderedDict() # case label -> [ (builtin, condition) ]
+  defaults = [] # [ (builtin, condition) ]
+  for className in builtins:
+    if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck):
+      builtin = builtins[className]
+      labels, condition = getTypeDispatchFor(builtin["className"])
+      if labels==None:
+        defaults.append((builtin, condition))
+      else:
+        for label in labels:
+          if not label in cases: cases[label] = []
+          cases[label].append((builtin, condition))
+  # group together labels that have exactly the same checks
+  groups = OrderedDict()
+  for label in cases:
+    key = "|".join([b["name"]+":"+str(cond) for b,cond in cases[label]])
+    if not key in groups: groups[key] = { "labels" : [], "checks" : cases[label] }
+    groups[key]["labels"].append(label)
+  codeOut(indent+'JsVarFlags varType = (JsVarFlags)(parent->flags&JSV_VARTYPEMASK);')
+  codeOut(indent+'switch (varType) {')
+  for key in groups:
+    group = groups[key]
+    codeOut(indent+'  '+" ".join(["case "+label+":" for label in group["labels"]]))
+    for builtin, condition in group["checks"]:
+      if condition:
+        codeOut(indent+'    if ('+condition+') {')
+        codeOutMatch(indent+'      ', builtin)
+        codeOut(indent+'    }')
+      else:
+        codeOutMatch(indent+'    ', builtin)
+    codeOut(indent+'    break;')
+  codeOut(indent+'  default:')
+  for builtin, condition in defaults:
+    codeOut(indent+'    if ('+condition+') {')
+    codeOutMatch(indent+'      ', builtin)
+    codeOut(indent+'    }')
+  codeOut(indent+'    break;')
+  codeOut(indent+'}')
+
+def codeOutFindInBuiltin(indent, builtin):
+  codeOutBuiltins(indent+"v = ", builtin)
+  codeOut(indent+'if (v) return v;');
+
+def codeOutReturnBuiltin(indent, builtin):
+  codeOut(indent+"return &jswSymbolTables["+builtin["indexName"]+"];");
 
 codeOut('JsVar *jswFindBuiltInFunction(JsVar *parent, const char *name) {')
 codeOut('  JsVar *v;')
 codeOut('  if (parent && !jsvIsRoot(parent)) {')
 
 codeOut('    // ------------------------------------------ INSTANCE + STATIC METHODS')
-nativeCheck = "jsvIsNativeFunction(parent) && "
 codeOut('    if (jsvIsNativeFunction(parent)) {')
 codeOut('      const JswSymList *l = jswGetSymbolListForObject(parent);')
 codeOut('      if (l) {');
@@ -545,12 +1077,7 @@ codeOut('        v = jswBinarySearch(l, parent, name);')
 codeOut('        if (v) return v;');
 codeOut('      }')
 codeOut('    }')
-for className in builtins:
-  if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck):
-    codeOut('    if ('+className+') {')
-    codeOutBuiltins("      v = ", builtins[className])
-    codeOut('      if (v) return v;');
-    codeOut("    }")
+codeOutTypeSwitch('    ', codeOutFindInBuiltin)
 codeOut('    // ------------------------------------------ INSTANCE METHODS WE MUST CHECK CONSTRUCTOR FOR')
 codeOut('    JsVar *proto = jsvIsObject(parent)?jsvSkipNameAndUnLock(jsvFindChildFromString(parent, JSPARSE_INHERITS_VAR)):0;')
 codeOut('    JsVar *constructor = jsvIsObject(proto)?jsvSkipNameAndUnLock(jsvFindChildFromString(proto, JSPARSE_CONSTRUCTOR_VAR)):0;')
@@ -588,16 +1115,16 @@ codeOut('')
 codeOut('')
 
 codeOut('const JswSymList *jswGetSymbolListForObject(JsVar *parent) {')
-nativeTestStr = "jsvIsNativeFunction(parent) && ";
 codeOut("  if (jsvIsNativeFunction(parent)) {");
-for className in builtins:
-  builtin = builtins[className]
-  if not className in ["parent","!parent"] and not builtin["isProto"] and className.startswith(nativeTestStr):
-    codeOut("    if ("+className[len(nativeTestStr):]+") return &jswSymbolTables["+builtin["indexName"]+"];");
+codeOut("    const JswConstructorSymbols *c = jswFindConstructorSymbols(parent);");
+codeOut("    if (c) {");
+codeOut("      const JswSymList *l = jswGetSymbolListFromIndex(READ_FLASH_UINT8(&c->staticSymbols));");
+codeOut("      if (l) return l;");
+codeOut("    }");
 codeOut("  }");
 for className in builtins:
   builtin = builtins[className]
-  if not className in ["parent","!parent"] and not builtin["isProto"] and not className.startswith(nativeTestStr):
+  if not className in ["parent","!parent"] and not builtin["isProto"] and not className.startswith(nativeCheck):
     codeOut("  if ("+className+") return &jswSymbolTables["+builtin["indexName"]+"];");
 codeOut("  if (parent==execInfo.root) return &jswSymbolTables[jswSymbolIndex_global];");
 codeOut("  return 0;")
@@ -607,16 +1134,13 @@ codeOut('')
 codeOut('')
 
 codeOut('const JswSymList *jswGetSymbolListForObjectProto(JsVar *parent) {')
+codeOut('  if (!parent) return &jswSymbolTables['+builtins["parent"]["indexName"]+'];')
 codeOut('  if (jsvIsNativeFunction(parent)) {')
-for className in builtins:
-  builtin = builtins[className]
-  if builtin["isProto"] and not "constructorPtr" in className and not className in ["parent","!parent"] :
-    check = className
-    for jsondata in jsondatas:
-      if jsondata["type"]=="constructor" and jsondata["name"]==builtin["className"]:
-        check = "(void*)parent->varData.native.ptr==(void*)"+jsondata["generate"]
-
-    codeOut("    if ("+check+") return &jswSymbolTables["+builtin["indexName"]+"];");
+codeOut('    const JswConstructorSymbols *c = jswFindConstructorSymbols(parent);')
+codeOut('    if (c) {')
+codeOut('      const JswSymList *l = jswGetSymbolListFromIndex(READ_FLASH_UINT8(&c->basicProtoSymbols));')
+codeOut('      if (l) return l;')
+codeOut('    }')
 codeOut('  }')
 codeOut('  JsVar *constructor = jsvIsObject(parent)?jsvSkipNameAndUnLock(jsvFindChildFromString(parent, JSPARSE_CONSTRUCTOR_VAR)):0;')
 codeOut('  if (constructor && jsvIsNativeFunction(constructor)) {')
@@ -624,10 +1148,7 @@ codeOut('    const JswSymList *l = jswGetSymbolListForConstructorProto(construct
 codeOut('    jsvUnLock(constructor);')
 codeOut('    if (l) return l;')
 codeOut('  }')
-nativeCheck = "jsvIsNativeFunction(parent) && "
-for className in builtins:
-  if className!="parent" and  className!="!parent" and not "constructorPtr" in className and not className.startswith(nativeCheck):
-    codeOut('  if ('+className+") return &jswSymbolTables["+builtins[className]["indexName"]+"];");
+codeOutTypeSwitch('  ', codeOutReturnBuiltin)
 codeOut("  return &jswSymbolTables["+builtins["parent"]["indexName"]+"];")
 codeOut('}')
 
@@ -643,24 +1164,30 @@ for jsondata in jsondatas:
         builtinObjectNames.append(builtinObjectName)
 
 
+codeOutNameLookup("jswFindBuiltInObject", builtinObjectNames)
+codeOut('')
 codeOut('bool jswIsBuiltInObject(const char *name) {')
-codeOut('  const char *objNames = "'+"\\0".join(builtinObjectNames)+'\\0";')
-codeOut('  const char *s = objNames;')
-codeOut('  while (*s) {')
-codeOut('    if (strcmp(s, name)==0) return true;') # OPT: I bet we could do this faster if not using strcmp, but it probably doesn't matter
-codeOut('    s+=strlen(s)+1;')
-codeOut('  }')
-codeOut('  return false;')
+codeOut('  return jswFindBuiltInObject(name)>=0;')
 codeOut('}')
 
 codeOut('')
 codeOut('')
 
 
+libraryNames = codeOutNameLookup("jswFindBuiltInLibrary", libraries)
+codeOut('')
+if libraryNames:
+  codeOut('static void * const jswBuiltInLibraries[] FLASH_SECT = {')
+  for lib in libraryNames:
+    codeOut('  (void*)gen_jswrap_'+lib+'_'+lib+',')
+  codeOut('};')
 codeOut('void *jswGetBuiltInLibrary(const char *name) {')
-for lib in libraries:
-  codeOut('  if (strcmp(name, "'+lib+'")==0) return (void*)gen_jswrap_'+lib+'_'+lib+';');
-codeOut('  return 0;')
+if libraryNames:
+  codeOut('  int idx = jswFindBuiltInLibrary(name);')
+  codeOut('  return (idx<0) ? 0 : jswBuiltInLibraries[idx];')
+else:
+  codeOut('  jswFindBuiltInLibrary(name);')
+  codeOut('  return 0;')
 codeOut('}')
 
 codeOut('')
@@ -689,13 +1216,24 @@ codeOut('')
 codeOut('')
 
 
-codeOut("/** Given the name of a Basic Object, eg, Uint8Array, String, etc. Return the prototype object's name - or 0. */")
-codeOut('const char *jswGetBasicObjectPrototypeName(const char *objectName) {')
+prototypeNames = OrderedDict()
 for jsondata in jsondatas:
   if "type" in jsondata and jsondata["type"]=="class":
-    if "prototype" in jsondata:
+    if "prototype" in jsondata and not jsondata["class"] in prototypeNames:
       #print json.dumps(jsondata, sort_keys=True, indent=2)
-      codeOut("  if (!strcmp(objectName, \""+jsondata["class"]+"\")) return \""+jsondata["prototype"]+"\";")
+      prototypeNames[jsondata["class"]] = jsondata["prototype"]
+objectNames = codeOutNameLookup("jswFindBasicObjectWithPrototype", prototypeNames.keys())
+if objectNames:
+  codeOut('static const char * const jswBasicObjectPrototypeNames[] = {')
+  for className in objectNames:
+    codeOut('  "'+prototypeNames[className]+'",')
+  codeOut('};')
+codeOut('')
+codeOut("/** Given the name of a Basic Object, eg, Uint8Array, String, etc. Return the prototype object's name - or 0. */")
+codeOut('const char *jswGetBasicObjectPrototypeName(const char *objectName) {')
+if objectNames:
+  codeOut('  int idx = jswFindBasicObjectWithPrototype(objectName);')
+  codeOut('  if (idx>=0) return jswBasicObjectPrototypeNames[idx];')
 codeOut('  return strcmp(objectName,"Object") ? "Object" : 0;')
 codeOut('}')
 
@@ -789,16 +1327,96 @@ codeOut('')
 codeOut('')
 codeOut('')
 
-codeOut("/** If we have a built-in module with the given name, return the module's contents - or 0 */")
-codeOut('const char *jswGetBuiltInJSLibrary(const char *name) {')
-used = False
-for modulename in jsmodules:
-  codeOut("  if (!strcmp(name,\""+modulename+"\")) return "+common.as_c_string(jsmodules[modulename])+";")
-  used = True
-if not used:
-  codeOut('  NOT_USED(name);')
+# Work out how to store each JS module (as text, pretokenised, compressed) and
+# return C code that creates a String containing it
+jsModuleReports = []
+def getJSModuleCode(modulename):
+  jscode = jsmodules[modulename]
+  data = bytearray(jscode, "latin-1")
+  report = { "name" : modulename, "size" : len(data) }
+  if any(ch>=128 for ch in data):
+    # already has token bytes (eg. Layout.min.js) - lexing it again as text would corrupt them
+    tokenised = False
+  else:
+    tokenised = common.pretokenise_js(jscode)
+    if tokenised==False:
+      print("WARNING: Unable to pretokenise JS module "+modulename+" - storing it as text")
+    else:
+      error = common.js_check_lexes(tokenised["code"].decode("latin-1"), jscode)
+      if error:
+        print("WARNING: Pretokenised JS module "+modulename+" doesn't match the original ("+error+") - storing it as text")
+        tokenised = False
+  if tokenised!=False:
+    report["tokenisedSize"] = len(tokenised["code"])
+    report["tokens"] = tokenised["tokens"]
+    if pretokeniseJSModules:
+      data = tokenised["code"]
+  # check what we store will lex when it's loaded
+  error = common.js_check_lexes(data.decode("latin-1"))
+  if error:
+    print("WARNING: JS module "+modulename+" as stored doesn't lex correctly ("+error+")")
+  report["lexSize"] = len(data) # the lexer has to step over every byte of this on load
+  compressed = common.heatshrink_compress(data)
+  report["compressedSize"] = len(compressed)
+  report["storedSize"] = len(data)
+  jsModuleReports.append(report)
+  if compressJSModules and len(compressed)<len(data):
+    report["storedSize"] = len(compressed)
+    return "jswNewFromCompressedJSLibrary("+common.as_c_string(compressed.decode("latin-1"))+", "+str(len(compressed))+", "+str(len(data))+")"
+  return "jsvNewNativeString((char*)"+common.as_c_string(data.decode("latin-1"))+", "+str(len(data))+")"
+
+def printJSModuleReport():
+  for r in jsModuleReports:
+    line = "JS module "+r["name"]+": "+str(r["size"])+" bytes of JS"
+    if "tokenisedSize" in r:
+      line += ", "+str(r["tokenisedSize"])+" pretokenised ("+str(r["tokens"])+" tokens)"
+    line += ", "+str(r["compressedSize"])+" compressed. Stored in "+str(r["storedSize"])+" bytes, lexer reads "+str(r["lexSize"])+" bytes on load"
+    print(line)
+  if jsModuleReports:
+    size = sum(r["size"] for r in jsModuleReports)
+    stored = sum(r["storedSize"] for r in jsModuleReports)
+    line = "JS modules stored in "+str(stored)+" bytes of flash instead of "+str(size)
+    if not pretokeniseJSModules: line += " - add -DESPR_PRETOKENISE_JSMODULES to pretokenise"
+    if not compressJSModules: line += " - add -DESPR_COMPRESS_JSMODULES to compress"
+    print(line)
+
+if compressJSModules and len(jsmodules) > 0:
+  codeOut('#include "compress_heatshrink.h"')
+  codeOut('')
+  codeOut("/** Decompress a heatshrink compressed built-in module into a new String */")
+  codeOut('static JsVar *jswNewFromCompressedJSLibrary(const char *data, size_t dataLen, size_t len) {')
+  codeOut('  JsVar *v = jsvNewStringOfLength((unsigned int)len, NULL);')
+  codeOut('  if (!v) return 0;')
+  codeOut('  HeatShrinkPtrInputCallbackInfo cbi;')
+  codeOut('  cbi.ptr = (unsigned char *)data;')
+  codeOut('  cbi.len = dataLen;')
+  codeOut('  JsvStringIterator it;')
+  codeOut('  jsvStringIteratorNew(&it, v, 0);')
+  codeOut('  heatshrink_decode_cb(heatshrink_ptr_input_cb, (uint32_t*)&cbi, heatshrink_var_output_cb, (uint32_t*)&it);')
+  codeOut('  jsvStringIteratorFree(&it);')
+  codeOut('  return v;')
+  codeOut('}')
+  codeOut('')
+if len(jsmodules) > NAME_LOOKUP_CHAIN_MAX:
+  moduleNames = codeOutNameLookup("jswFindBuiltInJSLibrary", jsmodules.keys())
+  codeOut('')
+codeOut("/** If we have a built-in module with the given name, return a String of the module's contents - or 0 */")
+codeOut('JsVar *jswGetBuiltInJSLibrary(const char *name) {')
+if len(jsmodules) > NAME_LOOKUP_CHAIN_MAX:
+  codeOut('  switch (jswFindBuiltInJSLibrary(name)) {')
+  for idx in range(len(moduleNames)):
+    codeOut("    case "+str(idx)+": return "+getJSModuleCode(moduleNames[idx])+";")
+  codeOut('  }')
+else:
+  used = False
+  for modulename in jsmodules:
+    codeOut("  if (!strcmp(name,\""+modulename+"\")) return "+getJSModuleCode(modulename)+";")
+    used = True
+  if not used:
+    codeOut('  NOT_USED(name);')
 codeOut('  return 0;')
 codeOut('}')
+printJSModuleReport()
 
 codeOut('')
 codeOut('')
@@ -812,67 +1430,140 @@ for lib in jsmodules:
 codeOut('  return "'+','.join(librarynames)+'";')
 codeOut('}')
 
-def writeCallFunctionHackEntry(argSpecs, jsondata):
+# Values from JsnArgumentType in src/jswrapper.h, so we can work out the value of an argument specifier
+JSWAT_MACROS = {
+  "JSWAT_VOID" : "0", "JSWAT_JSVAR" : "1", "JSWAT_ARGUMENT_ARRAY" : "2", "JSWAT_BOOL" : "3",
+  "JSWAT_INT32" : "4", "JSWAT_PIN" : "5", "JSWAT_FLOAT32" : "6", "JSWAT_JSVARFLOAT" : "7",
+  "JSWAT_MASK" : "7", "JSWAT_BITS" : "3",
+  "JSWAT_EXECUTE_IMMEDIATELY" : "0x7000", "JSWAT_THIS_ARG" : "0x8000"
+}
+# C types used to call a function returning each JSWAT_ type, and how to make a JsVar from them
+JSWAT_RETURN_TYPES = {
+  0 : ["void", ""], 1 : ["JsVar*", ""], 3 : ["bool", "jsvNewFromBool"], 4 : ["JsVarInt", "jsvNewFromInteger"],
+  5 : ["Pin", "jsvNewFromPin"], 7 : ["JsVarFloat", "jsvNewFromFloat"]
+}
+
+# Work out the 'shape' of the call for an argument specifier - the return type, and then whether
+# each argument goes in an integer register (i) or a float register (f). Arguments are decoded the
+# same way in jswCallFunctionHack
+def getCallFunctionHackShape(argSpecValue):
+  returnType = argSpecValue & 7
+  if not returnType in JSWAT_RETURN_TYPES: return False
+  args = ""
+  if argSpecValue & 0x8000: args += "i" # this
+  for n in range(1,5):
+    argType = (argSpecValue >> (3*n)) & 7
+    if argType==0: break
+    if argType==6: return False # JSWAT_FLOAT32 isn't used
+    args += "f" if argType==7 else "i"
+  return (returnType, args)
+
+def addCallFunctionHackEntry(argSpecs, jsondata):
   argSpec = getArgumentSpecifier(jsondata)
-  if not argSpec in argSpecs:
-    argSpecs.append(argSpec)
-    params = getParams(jsondata)
-    result = getResult(jsondata);
-    pTypes = []
-    pValues = []
-    if hasThis(jsondata):
-      pTypes.append("JsVar*")
-      pValues.append("thisParam")
-    cmd = "";
-    cmdstart = "";
-    cmdend = "";
-    n = 0
-    for param in params:
-      pTypes.append(toCType(param[1]));
-      if param[1]=="JsVarArray":
-        cmdstart =  "      JsVar *argArray = (paramCount>"+str(n)+")?jsvNewArray(&paramData["+str(n)+"],paramCount-"+str(n)+"):jsvNewEmptyArray();\n";
-        pValues.append("argArray");
-        cmdend = "      jsvUnLock(argArray);\n\n";
-      else:
-        pValues.append(toCUnbox(param[1])+"((paramCount>"+str(n)+")?paramData["+str(n)+"]:0)");
-      n = n+1
-
-    codeOut("    case "+argSpec+": {");
-    codeOut("      JsVar *result = 0;");
-    if cmdstart:  codeOut(cmdstart);
-    cmd = "(("+toCType(result[0])+"(*)("+",".join(pTypes)+"))function)("+",".join(pValues)+")";
-    if result[0]: codeOut("      result = "+toCBox(result[0])+"("+cmd+");");
-    else: codeOut("      "+cmd+";");
-    if cmdend:  codeOut(cmdend);
-    codeOut("      return result;");
-    codeOut("    }");
+  if argSpec in argSpecs: return
+  value, unknown = common.compile_c_expression(argSpec)(JSWAT_MACROS)
+  shape = getCallFunctionHackShape(value)
+  if unknown or shape==False or len(shape[1])!=len(getParams(jsondata))+(1 if hasThis(jsondata) else 0):
+    sys.stderr.write(json.dumps(jsondata, sort_keys=True, indent=2)+"\n")
+    FATAL_ERROR("addCallFunctionHackEntry: Can't work out how to call "+argSpec+"\n")
+  argSpecs[argSpec] = { "value" : value, "shape" : shape }
 
 if "USE_CALLFUNCTION_HACK" in board.defines:
-  codeOut('// on Emscripten and i386 we cant easily hack around function calls with floats/etc, plus we have enough')
-  codeOut('// resources, so just brute-force by handling every call pattern we use in a switch')
-  codeOut('JsVar *jswCallFunctionHack(void *function, JsnArgumentType argumentSpecifier, JsVar *thisParam, JsVar **paramData, int paramCount) {')
-  codeOut('  switch((int)argumentSpecifier) {')
-  #for argSpec in argSpecs:
-  #  codeOut('  case '+argSpec+":")
-  argSpecs = []
+  argSpecs = OrderedDict()
   # Ensure we force-add any entries we need
-  writeCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': []}) # jswrap_io
-  writeCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'JsVar', '']]}) # jswrap_promise
-  writeCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'JsVar', ''],['2', 'JsVar', '']]}) # jswrap_promise
-  writeCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'JsVar', ''],['2', 'JsVar', ''],['3', 'JsVar', '']]}) # jswrap_promise
-  writeCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'bool', '']]}) # jswrap_pixljs/banglejs
-  writeCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'int', '']]}) # jswrap_banglejs flip fn
-  writeCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': [['1', 'int', ''],['1', 'int', '']], 'return': ['JsVar','']}) # jswrap_banglejs
-  writeCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': [['1', 'float', ''],['1', 'float', '']], 'return': ['float','']}) # jswrap_banglejs + jswrap_arraybuffer
-  writeCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': [['1', 'int', ''],['1', 'int', '']], 'return': ['int','']}) # jswrap_arraybuffer
+  addCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': []}) # jswrap_io
+  addCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'JsVar', '']]}) # jswrap_promise
+  addCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'JsVar', ''],['2', 'JsVar', '']]}) # jswrap_promise
+  addCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'JsVar', ''],['2', 'JsVar', ''],['3', 'JsVar', '']]}) # jswrap_promise
+  addCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'bool', '']]}) # jswrap_pixljs/banglejs
+  addCallFunctionHackEntry(argSpecs, {'type': 'method', 'class': 'X', 'name': 'X', 'generate': 'X', 'params': [['1', 'int', '']]}) # jswrap_banglejs flip fn
+  addCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': [['1', 'int', ''],['1', 'int', '']], 'return': ['JsVar','']}) # jswrap_banglejs
+  addCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': [['1', 'float', ''],['1', 'float', '']], 'return': ['float','']}) # jswrap_banglejs + jswrap_arraybuffer
+  addCallFunctionHackEntry(argSpecs, {'type': 'function', 'name': 'X', 'generate': 'X', 'params': [['1', 'int', ''],['1', 'int', '']], 'return': ['int','']}) # jswrap_arraybuffer
   for jsondata in jsondatas:
     if "generate" in jsondata:
-        writeCallFunctionHackEntry(argSpecs, jsondata)
-  #((uint32_t (*)(size_t,size_t,size_t,size_t))function)(argData[0],argData[1],argData[2],argData[3]);
-  codeOut('  default: jsExceptionHere(JSET_ERROR,"Unknown argspec %d",argumentSpecifier);')
+      addCallFunctionHackEntry(argSpecs, jsondata)
+  # Argument specifiers that are called the same way share one trampoline
+  shapes = sorted(set(argSpecs[a]["shape"] for a in argSpecs), key=lambda shape: (shape[1], shape[0]))
+  print("jswCallFunctionHack: "+str(len(argSpecs))+" argument specifiers, "+str(len(shapes))+" call shapes")
+  codeOut('// on Emscripten and i386 we cant easily hack around function calls with floats/etc, plus we have enough')
+  codeOut('// resources, so we call each shape of function (return type, and int/float arguments) we use with its own trampoline')
+  codeOut('typedef JsVar *(*JswCallShape)(void *function, size_t *args, JsVarFloat *floats);')
+  for idx in range(len(shapes)):
+    returnType, args = shapes[idx]
+    cType, cBox = JSWAT_RETURN_TYPES[returnType]
+    pTypes = []
+    pValues = []
+    for arg in args:
+      if arg=="f":
+        pTypes.append("JsVarFloat")
+        pValues.append("floats["+str(pTypes.count("JsVarFloat")-1)+"]")
+      else:
+        pTypes.append("size_t")
+        pValues.append("args["+str(pTypes.count("size_t")-1)+"]")
+    cmd = "(("+cType+"(*)("+",".join(pTypes)+"))function)("+",".join(pValues)+")"
+    codeOut('static JsVar *jswCallShape'+str(idx)+'(void *function, size_t *args, JsVarFloat *floats) {')
+    if not "f" in args: codeOut('  NOT_USED(floats);')
+    if not "i" in args: codeOut('  NOT_USED(args);')
+    if returnType==0:
+      codeOut('  '+cmd+';')
+      codeOut('  return 0;')
+    else:
+      codeOut('  return '+cBox+'('+cmd+');')
+    codeOut('}')
+  codeOut('static const JswCallShape jswCallShapes[] = {')
+  codeOut('  '+', '.join('jswCallShape'+str(idx) for idx in range(len(shapes))))
+  codeOut('};')
+  # The argument specifiers we use, sorted so we can binary search, and the shape to call each with
+  sortedArgSpecs = sorted(argSpecs.keys(), key=lambda a: argSpecs[a]["value"])
+  codeOut('static const unsigned short jswCallArgSpecs[] = {')
+  for argSpec in sortedArgSpecs:
+    codeOut('  '+argSpec+',')
+  codeOut('};')
+  codeOut('static const unsigned char jswCallArgSpecShapes[] = {')
+  codeOut('  '+', '.join(str(shapes.index(argSpecs[a]["shape"])) for a in sortedArgSpecs))
+  codeOut('};')
+  codeOut('')
+  codeOut('JsVar *jswCallFunctionHack(void *function, JsnArgumentType argumentSpecifier, JsVar *thisParam, JsVar **paramData, int paramCount) {')
+  codeOut('  int min = 0, max = '+str(len(sortedArgSpecs)-1)+';')
+  codeOut('  while (min<max) { // find the shape of function to call')
+  codeOut('    int mid = (min+max) >> 1;')
+  codeOut('    if (jswCallArgSpecs[mid] < (unsigned short)argumentSpecifier) min = mid+1;')
+  codeOut('    else max = mid;')
   codeOut('  }')
-  codeOut('  return 0;')
+  codeOut('  if (jswCallArgSpecs[min] != (unsigned short)argumentSpecifier) {')
+  codeOut('    jsExceptionHere(JSET_ERROR,"Unknown argspec %d",argumentSpecifier);')
+  codeOut('    return 0;')
+  codeOut('  }')
+  codeOut('  // unbox arguments into integer and float registers - as in getCallFunctionHackShape')
+  codeOut('  size_t args[5];')
+  codeOut('  JsVarFloat floats[4];')
+  codeOut('  int argCount = 0, floatCount = 0;')
+  codeOut('  JsVar *argArray = 0;')
+  codeOut('  if (argumentSpecifier & JSWAT_THIS_ARG)')
+  codeOut('    args[argCount++] = (size_t)thisParam;')
+  codeOut('  for (int n=0;n<4;n++) {')
+  codeOut('    JsnArgumentType argType = (JsnArgumentType)((argumentSpecifier >> (JSWAT_BITS*(n+1))) & JSWAT_MASK);')
+  codeOut('    if (argType==JSWAT_FINISH) break;')
+  codeOut('    JsVar *param = (paramCount>n)?paramData[n]:0;')
+  codeOut('    switch (argType) {')
+  codeOut('      case JSWAT_ARGUMENT_ARRAY:')
+  codeOut('        argArray = (paramCount>n)?jsvNewArray(&paramData[n],paramCount-n):jsvNewEmptyArray();')
+  codeOut('        args[argCount++] = (size_t)argArray;')
+  codeOut('        break;')
+  codeOut('      case JSWAT_BOOL: args[argCount++] = (size_t)jsvGetBool(param); break;')
+  codeOut('      case JSWAT_INT32: args[argCount++] = (size_t)jsvGetInteger(param); break;')
+  codeOut('      case JSWAT_PIN: args[argCount++] = (size_t)jshGetPinFromVar(param); break;')
+  codeOut('      case JSWAT_JSVARFLOAT: floats[floatCount++] = jsvGetFloat(param); break;')
+  codeOut('      default: args[argCount++] = (size_t)param; break; // JSWAT_JSVAR')
+  codeOut('    }')
+  codeOut('  }')
+  codeOut('  JsVar *result = jswCallShapes[jswCallArgSpecShapes[min]](function, args, floats);')
+  codeOut('  jsvUnLock(argArray);')
+  codeOut('  return result;')
   codeOut('}')
 
 codeOut('')
 codeOut('')
+
+writeWrapperFiles(wrapperHeader)
@@ -58,7 +58,7 @@ print("BOARD "+boardname)
 print("IS_BOOTLOADER "+str(IS_BOOTLOADER))
 print("IS_USING_BOOTLOADER "+str(IS_USING_BOOTLOADER))
 # import the board def
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 
 # Check what board py says
 BOARD_BOOTLOADER = "bootloader" in board.info and board.info["bootloader"]!=0
@@ -207,3 +207,5 @@ codeOut("""
 }
 """);
 
+
+linkerFile.close()
@@ -21,6 +21,7 @@ import os;
 import importlib;
 import common;
 import copy;
+from collections import OrderedDict;
 
 scriptdir = os.path.dirname(os.path.realpath(__file__))
 basedir = scriptdir+"/../"
@@ -44,7 +45,7 @@ print("PININFO_HEADER_FILENAME" + pininfoHeaderFilename)
 print("BOARD " + boardname)
 # import the board def
 
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 
 # Call the included board_specific file - it sets up 'pins' and 'fill_gaps'
 pins = board.get_pins()
@@ -95,12 +96,67 @@ for pin in pins:
   if len(functions)>pinInfoFunctionCount: pinInfoFunctionCount = len(functions)
 
 
+# -----------------------------------------------------------------------------------------
+# Normally every pin has JSH_PININFO_FUNCTIONS functions (padded with 0), so one pin with
+# lots of functions makes every pin bigger. With ESPR_PACKED_PININFO all the functions go
+# in one array, pinInfoFunctions, and each pin has the offset and number of its functions.
+# Pins with the same functions, or whose functions are the end of another pin's, share them
+# (like common.get_string_pool). JSH_PININFO_FUNCTION(pin,i) works with either
+
+def getFunctionKey(function): # without the '/* x Uses */' comment
+  return function[:function.find("/*")] if "/*" in function else function
+
+def getFunctionPool(functionLists):
+  lists = list(OrderedDict.fromkeys(tuple(getFunctionKey(f) for f in functions) for functions in functionLists if functions))
+  # Sorted by reversed list, any list that is the end of another comes just before
+  # another list that it is the end of - so work back and find what contains what
+  ordered = sorted(lists, key=lambda l: l[::-1])
+  container = {}
+  for i in range(len(ordered)-1, -1, -1):
+    l = ordered[i]
+    if i+1<len(ordered) and ordered[i+1][len(ordered[i+1])-len(l):]==l:
+      container[l] = container[ordered[i+1]]
+    else:
+      container[l] = l
+  pool = []
+  offsets = {}
+  for l in lists:
+    c = container[l]
+    if not c in offsets:
+      offsets[c] = len(pool)
+      pool.extend(c)
+    offsets[l] = offsets[c] + len(c) - len(l)
+  return { "pool" : pool, "offsets" : offsets }
+
+functionPool = getFunctionPool([pin["jshFunctions"] for pin in pins])
+functionComments = {} # so the pool can have the '/* x Uses */' comments too
+for pin in pins:
+  for function in pin["jshFunctions"]:
+    functionComments[getFunctionKey(function)] = function
+packedOffsetType = "uint8_t" if len(functionPool["pool"])<=256 else "uint16_t"
+
+# The port/pin/analog fields are the same either way, so just compare the functions (JshPinFunction is 2 bytes)
+functionsSize = len(pins)*2*pinInfoFunctionCount
+packedFunctionsSize = len(pins)*(1+(1 if packedOffsetType=="uint8_t" else 2)) + 2*len(functionPool["pool"])
+print("pinInfo functions are "+str(functionsSize)+" bytes ("+str(pinInfoFunctionCount)+" per pin), or "+str(packedFunctionsSize)+
+      " bytes with ESPR_PACKED_PININFO ("+str(len(functionPool["pool"]))+" shared between "+str(len(pins))+" pins)")
+print("ESPR_PACKED_PININFO saves "+str(functionsSize-packedFunctionsSize)+" bytes")
+
 writesource("// auto-generated pin info file")
 writesource("// for board "+boardname)
 writesource("#include \"jspininfo.h\"")
 writesource("")
-writesource("const JshPinInfo pinInfo[JSH_PIN_COUNT] = {")
+writesource("#ifdef ESPR_PACKED_PININFO")
+writesource("const JshPinFunction pinInfoFunctions[JSH_PININFO_FUNCTIONS_POOL] = {")
+for function in functionPool["pool"]:
+  writesource("  "+functionComments[function]+",")
+if not functionPool["pool"]: writesource("  0")
+writesource("};")
+writesource("#endif")
+writesource("")
 
+pinInfoLines = []
+packedPinInfoLines = []
 for pin in pins:
   analog = "JSH_ANALOG_NONE";
   for function in pin["functions"]:
@@ -109,11 +165,21 @@ for pin in pins:
       adc = function[3:inpos]
       channel = function[inpos+3:]
       analog = "JSH_ANALOG"+adc+"|JSH_ANALOG_CH"+channel;
-  functions = pin["jshFunctions"]
+  functions = pin["jshFunctions"][:]
+  functionOffset = functionPool["offsets"][tuple(getFunctionKey(f) for f in functions)] if functions else 0
   while len(functions)<pinInfoFunctionCount: functions.append("0")
   portextra = ""
   if "NEGATED" in pin["functions"]: portextra="|JSH_PIN_NEGATED"
-  writesource("/* "+pin["name"].ljust(4)+" */ { JSH_PORT"+pin["port"]+portextra+", JSH_PIN0+"+pin["num"]+", "+analog+", { "+', '.join(functions)+" } },")
+  pinInfoStart = "/* "+pin["name"].ljust(4)+" */ { JSH_PORT"+pin["port"]+portextra+", JSH_PIN0+"+pin["num"]+", "+analog+", "
+  pinInfoLines.append(pinInfoStart+"{ "+', '.join(functions)+" } },")
+  packedPinInfoLines.append(pinInfoStart+str(len(pin["jshFunctions"]))+", "+str(functionOffset)+" },")
+
+writesource("const JshPinInfo pinInfo[JSH_PIN_COUNT] = {")
+writesource("#ifdef ESPR_PACKED_PININFO")
+for line in packedPinInfoLines: writesource(line)
+writesource("#else")
+for line in pinInfoLines: writesource(line)
+writesource("#endif")
 writesource("};")
 
 portinfo = {}
@@ -121,19 +187,76 @@ portinfo = {}
 for port in pinutils.ALLOWED_PORTS:
   c=0
   o=-1
-  for pin in pins:
-    if pin["port"]==port:
-      usernum=int(pin["name"][2:])
-      if usernum>=c: c = usernum+1 # user-visible number
-      if o<0: o=pins.index(pin)
+  for pin in pins.port_pins(port):
+    usernum=int(pin["name"][2:])
+    if usernum>=c: c = usernum+1 # user-visible number
+    if o<0: o=pins.position(pin)
   portinfo[port] = { 'count' : c, 'offset' : o };
 # Olimexino hack as things have been renamed
 if boardname in ["OLIMEXINO_STM32", "OLIMEXINO_STM32_RE", "MAPLERET6_STM32"]:
   for port in pinutils.ALLOWED_PORTS:
     if port=="A": portinfo[port] = { 'count' : 16, 'offset' : 15 }
     elif port=="D": portinfo[port] = { 'count' : 39, 'offset' : 0 }
-    else: portinfo[port] = { 'count' : 0, 'offset' : -1 }   
+    else: portinfo[port] = { 'count' : 0, 'offset' : -1 }
+
+writesource("")
 
+# -----------------------------------------------------------------------------------------
+# jshGetPinFromString is called for every global variable lookup that isn't found, so
+# rather than checking every port (or with PIN_NAMES_DIRECT, searching pinInfo) we output
+# a decoder for just this board's ports. With PIN_NAMES_DIRECT each port gets a table of
+# which pin each number is (numbers in a port are small, so this is a perfect hash of port
+# and number with no collisions)
+directPorts = {} # { port : [ pin index for each number ] }
+for port in pinutils.ALLOWED_PORTS:
+  for pin in pins.port_pins(port):
+    num = int(pin["num"])
+    if not port in directPorts: directPorts[port] = []
+    table = directPorts[port]
+    while len(table)<=num: table.append("PIN_UNDEFINED")
+    if table[num]=="PIN_UNDEFINED": table[num] = str(pins.position(pin)) # first pin found wins
+
+writesource("#ifdef PIN_NAMES_DIRECT")
+for port in directPorts:
+  writesource("static const Pin jshPort"+port+"Pins["+str(len(directPorts[port]))+"] = { "+", ".join(directPorts[port])+" };")
+writesource("#endif")
+writesource("")
+writesource("/// Get a pin from a name like 'A5', or PIN_UNDEFINED (generated by build_pininfo.py)")
+writesource("Pin jshGetPinFromString(const char *s) {")
+writesource("  // Most names we get aren't pins, so check the port first")
+writesource("#ifdef PIN_NAMES_DIRECT")
+writesource("  const Pin *portPins;")
+writesource("  int count;")
+writesource("  switch (s[0]) {")
+for port in directPorts:
+  writesource("    case '"+port+"': portPins = jshPort"+port+"Pins; count = "+str(len(directPorts[port]))+"; break;")
+writesource("#else")
+writesource("  int offset, count;")
+writesource("  switch (s[0]) {")
+for port in pinutils.ALLOWED_PORTS:
+  if portinfo[port]['offset']>=0:
+    writesource("    case '"+port+"': offset = JSH_PORT"+port+"_OFFSET; count = JSH_PORT"+port+"_COUNT; break;")
+writesource("#endif")
+writesource("    default: return PIN_UNDEFINED;")
+writesource("  }")
+writesource("  int pin;")
+writesource("  if (s[1]<'0' || s[1]>'9') return PIN_UNDEFINED;")
+writesource("  if (!s[2]) { // D0-D9")
+writesource("    pin = s[1]-'0';")
+writesource("  } else if (s[2]>='0' && s[2]<='9' && !s[3]) {")
+writesource("    pin = (s[1]-'0')*10 + (s[2]-'0');")
+writesource("#ifdef LINUX")
+writesource("  } else if (s[2]>='0' && s[2]<='9' && s[3]>='0' && s[3]<='9' && !s[4]) {")
+writesource("    pin = (s[1]-'0')*100 + (s[2]-'0')*10 + (s[3]-'0');")
+writesource("#endif")
+writesource("  } else return PIN_UNDEFINED;")
+writesource("  if (pin>=count) return PIN_UNDEFINED;")
+writesource("#ifdef PIN_NAMES_DIRECT")
+writesource("  return portPins[pin];")
+writesource("#else")
+writesource("  return (Pin)(offset + pin);")
+writesource("#endif")
+writesource("}")
 writesource("")
 
 
@@ -154,6 +277,21 @@ for port in pinutils.ALLOWED_PORTS:
 writeheader("")
 writeheader("#define JSH_PININFO_FUNCTIONS "+str(pinInfoFunctionCount))
 writeheader("")
+writeheader("#ifdef ESPR_PACKED_PININFO")
+writeheader("#define JSH_PININFO_FUNCTIONS_POOL "+str(max(1,len(functionPool["pool"]))))
+writeheader("")
+writeheader("typedef struct JshPinInfo {")
+writeheader("  JsvPinInfoPort port;")
+writeheader("  JsvPinInfoPin pin;")
+writeheader("  JsvPinInfoAnalog analog; // TODO: maybe we don't need to store analogs separately")
+writeheader("  uint8_t functionCount; ///< how many functions this pin has")
+writeheader("  "+packedOffsetType+" functionOffset; ///< index of this pin's first function in pinInfoFunctions")
+writeheader("} PACKED_FLAGS JshPinInfo;")
+writeheader("")
+writeheader("extern const JshPinFunction pinInfoFunctions[JSH_PININFO_FUNCTIONS_POOL];")
+writeheader("/// Get function I (0 to JSH_PININFO_FUNCTIONS-1) of PIN, or JSH_NOTHING")
+writeheader("#define JSH_PININFO_FUNCTION(PIN,I) (((I)<pinInfo[PIN].functionCount) ? pinInfoFunctions[pinInfo[PIN].functionOffset+(I)] : JSH_NOTHING)")
+writeheader("#else")
 writeheader("typedef struct JshPinInfo {")
 writeheader("  JsvPinInfoPort port;")
 writeheader("  JsvPinInfoPin pin;")
@@ -161,6 +299,13 @@ writeheader("  JsvPinInfoAnalog analog; // TODO: maybe we don't need to store an
 writeheader("  JshPinFunction functions[JSH_PININFO_FUNCTIONS];")
 writeheader("} PACKED_FLAGS JshPinInfo;")
 writeheader("")
+writeheader("/// Get function I (0 to JSH_PININFO_FUNCTIONS-1) of PIN, or JSH_NOTHING")
+writeheader("#define JSH_PININFO_FUNCTION(PIN,I) (pinInfo[PIN].functions[I])")
+writeheader("#endif")
+writeheader("")
 writeheader("extern const JshPinInfo pinInfo[JSH_PIN_COUNT];");
 writeheader("")
 writeheader("#endif // JSPININFO_H")
+
+pininfoSourceFile.close()
+pininfoHeaderFile.close()
@@ -45,7 +45,7 @@ defines = sys.argv[3:]
 print("HEADER_FILENAME "+headerFilename)
 print("BOARD "+boardname)
 # import the board def
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 pins = board.get_pins()
 # -----------------------------------------------------------------------------------------
 #allow to override board name so we can build for same board from multiple board files
@@ -138,9 +138,9 @@ def die(err):
   sys.exit(1)
 
 def toPinDef(pin):
-  for p in pins:
-    if p["name"]=="P"+pin:
-      return str(pins.index(p))+"/* "+pin+" */";
+  p = pins.find("P"+pin)
+  if p:
+    return str(pins.position(p))+"/* "+pin+" */";
   die("Pin named '"+pin+"' not found");
 
 def codeOutDevice(device):
@@ -617,3 +617,5 @@ if len(defines) > 0:
 codeOut("""
 #endif // _PLATFORM_CONFIG_H
 """);
+
+headerFile.close()
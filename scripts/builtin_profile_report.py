@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Merges the output of E.getBuiltinProfile() from one or more runs of a build with
+# ESPR_BUILTIN_PROFILE defined, and prints a table of builtins sorted by total time.
+#
+# Save the profile with print(JSON.stringify(E.getBuiltinProfile())) - any other lines
+# of output in the file (eg. the console log) are ignored.
+# ----------------------------------------------------------------------------------------
+
+import json;
+import sys;
+
+if len(sys.argv)<2:
+  print("USAGE:")
+  print("scripts/builtin_profile_report.py [--calls] [--top N] profile.json [profile2.json ...]")
+  print("")
+  print("  --calls   Sort by number of calls rather than time")
+  print("  --top N   Only show the first N builtins")
+  exit(1)
+
+# Get the list of profile objects in a file - either the whole file is JSON, or it's a log
+# with JSON objects on their own lines
+def get_profiles(filename):
+  text = open(filename).read()
+  try:
+    return [json.loads(text)]
+  except ValueError:
+    pass
+  profiles = []
+  for line in text.splitlines():
+    line = line.strip()
+    if not line.startswith("{"): continue
+    try:
+      profiles.append(json.loads(line))
+    except ValueError:
+      print("WARNING: Couldn't parse line in "+filename+": "+line[:40])
+  return profiles
+
+sortByCalls = False
+top = 0
+files = []
+args = sys.argv[1:]
+while args:
+  arg = args.pop(0)
+  if arg=="--calls": sortByCalls = True
+  elif arg=="--top": top = int(args.pop(0))
+  else: files.append(arg)
+
+totals = {} # { name : [calls, time] }
+runs = 0
+for filename in files:
+  for profile in get_profiles(filename):
+    runs += 1
+    for name in profile:
+      if not name in totals: totals[name] = [0, 0.0]
+      totals[name][0] += int(profile[name]["calls"])
+      totals[name][1] += float(profile[name]["time"])
+
+if not runs:
+  print("ERROR: No profiles found")
+  exit(1)
+
+names = sorted(totals, key=lambda n: (-totals[n][0], -totals[n][1]) if sortByCalls else (-totals[n][1], -totals[n][0]))
+if top: names = names[:top]
+totalCalls = sum(totals[n][0] for n in totals)
+totalTime = sum(totals[n][1] for n in totals)
+
+print("Builtin profile: "+str(runs)+" run(s), "+str(len(totals))+" builtins, "+str(totalCalls)+" calls, "+("%.3f" % totalTime)+"ms")
+print("Times include the time spent in any builtins that are called, so may add up to more than the total")
+print("")
+print("      Calls      Time (ms)   us/call   %Time  Builtin")
+for name in names:
+  calls, time = totals[name]
+  print(str(calls).rjust(11)+"  "+("%.3f" % time).rjust(13)+"  "+("%.2f" % (time*1000/calls if calls else 0)).rjust(8)+"  "+("%5.1f" % (time*100/totalTime if totalTime else 0)).rjust(6)+"  "+name)
@@ -4,8 +4,6 @@
 # for nRF5x parts (which don't generate binaries and which
 # put Storage *after* code)
 
-import subprocess;
-import re;
 import json;
 import sys;
 import os;
@@ -16,6 +14,8 @@ basedir = scriptdir+"/../"
 sys.path.append(basedir+"scripts");
 sys.path.append(basedir+"boards");
 
+import elfutils;
+
 if len(sys.argv)!=3:
   print("USAGE:")
   print("scripts/check_elf_size.py BOARDNAME board.elf")
@@ -35,20 +35,22 @@ areaName = "Storage"
 areaStart = storageStart
 areaEnd = storageEnd
 
-text = subprocess.check_output('arm-none-eabi-objdump -h '+ELF+' | grep "\\.text"', shell=True).strip().split()
-codeSize = int(text[2], 16)
-codeStart = int(text[4], 16)
+elf = elfutils.ElfFile(ELF)
+text = elf.section(".text")
+codeSize = text.size
+codeStart = text.lma
 codeEnd = codeSize + codeStart
 
 # nRF52 builds have this extra data dumped on the end - need to check this doesn't overlap too!
-fsdata = subprocess.check_output('arm-none-eabi-objdump -h '+ELF+' | grep "\\.fs_data" || true', shell=True).strip().split()
-if len(fsdata):
-  fsSize = int(fsdata[2], 16)
-  fsStart = int(fsdata[4], 16)
+fsdata = elf.section(".fs_data")
+if fsdata:
+  fsSize = fsdata.size
+  fsStart = fsdata.lma
   fsEnd = fsStart + fsSize
   if (fsEnd > codeEnd): 
     print("FS DATA: "+hex(fsStart)+" -> "+hex(fsEnd)+" ("+str(fsSize)+" bytes)");
     codeEnd = fsEnd
+elf.close()
 
 if storageStart == 0x60000000: # it's the memory-mapped external flash
   if board.chip['part']=="NRF52832":
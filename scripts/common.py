@@ -21,8 +21,15 @@ import sys;
 import os;
 import importlib;
 import traceback;
+import hashlib;
+import pickle;
+import copy;
+import io;
+import marshal;
+from collections import OrderedDict;
 # Local
 import pinutils;
+import pincsv;
 
 # Exported - this is set if a board is specified on the command-line
 board = False
@@ -56,6 +63,850 @@ if "check_output" not in dir( subprocess ):
 
 #
 
+# Parsed /*JSON ... */ blocks are cached in this directory, in one file per jswrap
+# file named after the SHA1 of its contents - so unchanged files never get rescanned.
+# Only the raw JSON is cached, as ifdef/#if/patch handling depends on the board.
+# JSWRAP_CACHE=path moves the cache, JSWRAP_CACHE=0 disables it
+JSWRAP_CACHE_VERSION = 1
+
+def get_jswrap_cache_dir():
+  cachedir = os.getenv("JSWRAP_CACHE")
+  if cachedir=="0": return False
+  if not cachedir: cachedir = get_script_dir()+"/../gen/jswrap_cache"
+  return cachedir
+
+# Parse all /*JSON ... */ comments out of some C code. Returns a dict with
+# a list of blocks of the form {"line", "json", "jsonstring", "description"}
+# This is one pass over the code, counting lines as we go. Raises ValueError
+# (with a plain message, so it can come back from a worker process) on bad JSON
+def parse_jswrap_code(code):
+  blocks = []
+  linenumber = 1
+  lastpos = 0
+  for match in re.finditer(r"/\*JSON.*?\*/", code, re.DOTALL):
+    linenumber += code.count("\n", lastpos, match.start())
+    lastpos = match.start()
+    # Strip off /*JSON .. */ bit
+    comment = match.group(0)[6:-2]
+
+    endOfJson = comment.find("\n}")+2;
+    jsonstring = comment[0:endOfJson];
+    description =  comment[endOfJson:].strip();
+    try:
+      jsondata = json.loads(jsonstring)
+    except ValueError as e:
+      raise ValueError("JSON PARSE FAILED for " +  jsonstring + " - "+ str(e))
+    blocks.append({ "line" : linenumber, "json" : jsondata, "jsonstring" : jsonstring, "description" : description })
+  return {
+    "version" : JSWRAP_CACHE_VERSION,
+    "do_not_include_in_docs" : "DO_NOT_INCLUDE_IN_DOCS" in code,
+    "blocks" : blocks
+  }
+
+def parse_jswrap_file(jswrap):
+  return parse_jswrap_code(open(jswrap, "r").read())
+
+# Like map(fn, items) but fans out over a pool of processes, returning results in the
+# same order as items. JSWRAP_JOBS=n sets the number of processes (JSWRAP_JOBS=1 for no pool).
+# We only use 'fork' - other start methods re-run the calling script in each process
+def parallel_map(fn, items):
+  jobs = int(os.getenv("JSWRAP_JOBS", "0")) or os.cpu_count() or 1
+  jobs = min(jobs, len(items))
+  if jobs>1:
+    try:
+      import multiprocessing
+      ctx = multiprocessing.get_context("fork")
+      pool = ctx.Pool(jobs)
+    except (ImportError, ValueError, OSError):
+      pool = False # no fork on this platform
+    if pool:
+      try:
+        return pool.map(fn, items)
+      finally:
+        pool.close()
+        pool.join()
+  return list(map(fn, items))
+
+# Scan jswrap files for JSON blocks (see parse_jswrap_code), using the cache for any
+# file we have seen before and parsing the rest in parallel. Results are in the same
+# order as jswraps, so generated files don't depend on which files were cached.
+# Files are also remembered for the rest of the process (eg. for build_all_boards.py,
+# which builds many boards from the same files). get_jsondata changes what it gets back,
+# so they're stored marshalled and each call gets its own copy
+scannedJswraps = {} # { SHA1 of file : marshalled result }
+def scan_jswrap_files(jswraps):
+  cachedir = get_jswrap_cache_dir()
+  results = [False] * len(jswraps)
+  cachefiles = [False] * len(jswraps)
+  sha1s = [hashlib.sha1(open(jswrap, "rb").read()).hexdigest() for jswrap in jswraps]
+  toparse = []
+  for i in range(len(jswraps)):
+    if sha1s[i] in scannedJswraps:
+      results[i] = marshal.loads(scannedJswraps[sha1s[i]])
+      continue
+    if cachedir:
+      cachefiles[i] = cachedir+"/"+sha1s[i]+".json"
+      try:
+        scanned = json.load(open(cachefiles[i], "r"))
+        if scanned["version"]==JSWRAP_CACHE_VERSION:
+          results[i] = scanned
+      except (IOError, OSError, ValueError, KeyError):
+        pass # not cached, or cache file was corrupt
+    if not results[i]:
+      toparse.append(i)
+  try:
+    parsed = parallel_map(parse_jswrap_file, [jswraps[i] for i in toparse])
+  except ValueError as e:
+    sys.stderr.write(str(e)+"\n")
+    exit(1)
+  for i, scanned in zip(toparse, parsed):
+    results[i] = scanned
+    if not cachefiles[i]: continue
+    try:
+      if not os.path.isdir(cachedir): os.makedirs(cachedir, exist_ok=True)
+      # write then rename, so parallel builds never see a half-written file
+      tmpfile = cachefiles[i]+"."+str(os.getpid())
+      with open(tmpfile, "w") as f:
+        json.dump(scanned, f)
+      os.replace(tmpfile, cachefiles[i])
+    except (IOError, OSError) as e:
+      print("WARNING: Unable to write jswrap cache "+cachefiles[i]+" - "+str(e))
+  for i in range(len(jswraps)):
+    if not sha1s[i] in scannedJswraps:
+      scannedJswraps[sha1s[i]] = marshal.dumps(results[i])
+  return results
+
+# ----------------------------------------------------------------------------------------
+# get_board(boardname) returns boards/BOARDNAME.py with everything the build scripts use
+# (info, chip, devices, etc, and the result of get_pins()) already resolved. Resolving the
+# pins means parsing the CSV files in boards/pins, and each script used to do that again,
+# so the resolved board is cached (pickled) in gen/board_cache/BOARDNAME.pickle, along with
+# the SHA1 of every file it came from (the board file, pinutils.py, pincsv.py and any CSV files) to
+# check it's still valid. BOARD_CACHE=path moves the cache, BOARD_CACHE=0 disables it
+# ----------------------------------------------------------------------------------------
+
+BOARD_CACHE_VERSION = 2
+
+def get_board_cache_dir():
+  cachedir = os.getenv("BOARD_CACHE")
+  if cachedir=="0": return False
+  if not cachedir: cachedir = get_script_dir()+"/../gen/board_cache"
+  return cachedir
+
+def get_file_sha1(filename):
+  return hashlib.sha1(open(filename, "rb").read()).hexdigest()
+
+# A board loaded by get_board. This has the same fields as the board's module, and
+# get_pins() returns a copy of the board's pins (and prints anything get_pins printed)
+class Board:
+  def __init__(self, name, fields, pins, pinsOutput):
+    self.__dict__.update(fields)
+    self._name = name
+    self._pins = pins
+    self._pinsOutput = pinsOutput
+
+  def get_pins(self):
+    if self._pinsOutput: sys.stdout.write(self._pinsOutput)
+    return copy.deepcopy(self._pins)
+
+# Import the board's module and resolve it into a Board
+def load_board(boardname):
+  module = importlib.import_module(boardname)
+  fields = {}
+  for name in dir(module):
+    value = getattr(module, name)
+    if name.startswith("_") or callable(value) or isinstance(value, type(sys)): continue
+    fields[name] = value
+  pins = False
+  pinsOutput = ""
+  if hasattr(module, "get_pins"):
+    # get_pins may print (eg. 'Added fake pin') but some scripts' output is used
+    # directly (eg. get_makefile_decls.py) so store it and print it when get_pins is called
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    resolved = False
+    try:
+      pins = pinutils.PinSet(module.get_pins())
+      resolved = True
+    finally:
+      pinsOutput = sys.stdout.getvalue()
+      sys.stdout = stdout
+      if not resolved: sys.stdout.write(pinsOutput) # failed - show what happened
+  return Board(boardname, fields, pins, pinsOutput)
+
+loadedBoards = {} # so every get_board for a board in one script gets the same object
+def get_board(boardname):
+  if boardname in loadedBoards: return loadedBoards[boardname]
+  cachedir = get_board_cache_dir()
+  cachefile = cachedir and cachedir+"/"+boardname+".pickle"
+  boardfile = os.path.realpath(get_script_dir()+"/../boards/"+boardname+".py")
+  # the files from this tree that the board depends on, so a cache copied from or shared
+  # with another checkout is only used if it was made from these exact files
+  sourcefiles = [boardfile, os.path.realpath(pinutils.__file__), os.path.realpath(pincsv.__file__)]
+  board = False
+  if cachefile and os.path.isfile(boardfile):
+    try:
+      cached = pickle.load(open(cachefile, "rb"))
+      if (cached["version"]==BOARD_CACHE_VERSION and all(f in cached["files"] for f in sourcefiles) and
+          all(get_file_sha1(f)==cached["files"][f] for f in cached["files"])):
+        board = cached["board"]
+    except (IOError, OSError, EOFError, KeyError, ValueError, pickle.UnpicklingError):
+      pass # not cached, a file has gone, or cache file was corrupt
+  if not board:
+    pinutils.pin_files_read = []
+    board = load_board(boardname)
+    if cachefile and os.path.isfile(boardfile):
+      files = sourcefiles + pinutils.pin_files_read
+      try:
+        if not os.path.isdir(cachedir): os.makedirs(cachedir, exist_ok=True)
+        # write then rename, so parallel builds never see a half-written file
+        tmpfile = cachefile+"."+str(os.getpid())
+        with open(tmpfile, "wb") as f:
+          pickle.dump({ "version" : BOARD_CACHE_VERSION, "files" : { f : get_file_sha1(f) for f in files }, "board" : board }, f)
+        os.replace(tmpfile, cachefile)
+      except (IOError, OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+        # not print, as the output of some scripts is used directly
+        sys.stderr.write("WARNING: Unable to write board cache "+cachefile+" - "+str(e)+"\n")
+  loadedBoards[boardname] = board
+  return board
+
+# ----------------------------------------------------------------------------------------
+# A small evaluator for the C preprocessor expressions used in "#if" in the JSON.
+#
+# compile_c_expression("defined(A) && B>2") parses the expression once and returns
+# a function that takes a dict of macros (from get_c_macros) and returns
+# (value, unknown) where unknown is a sorted list of identifiers that weren't
+# defined. As in the C preprocessor, unknown identifiers evaluate to 0.
+# Raises ValueError if the expression can't be parsed.
+# ----------------------------------------------------------------------------------------
+
+C_EXPR_TOKEN = re.compile(r"\s*(?:(0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*|([A-Za-z_][A-Za-z0-9_]*)|(\|\||&&|==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^()?:]))")
+
+def c_int_literal(s):
+  if s[:2] in ["0x","0X"]: return int(s, 16)
+  if len(s)>1 and s[0]=="0": return int(s, 8)
+  return int(s)
+
+def c_div(a, b, mod):
+  if b==0: raise ValueError("Division by zero")
+  q = abs(a) // abs(b)
+  if (a<0) != (b<0): q = -q # C rounds towards zero
+  return a - q*b if mod else q
+
+# Binary operators, lowest precedence first
+C_EXPR_BINARY_OPS = [
+  { "||" : None }, # short-circuit, handled specially
+  { "&&" : None },
+  { "|" : lambda a,b: a|b },
+  { "^" : lambda a,b: a^b },
+  { "&" : lambda a,b: a&b },
+  { "==" : lambda a,b: int(a==b), "!=" : lambda a,b: int(a!=b) },
+  { "<" : lambda a,b: int(a<b), "<=" : lambda a,b: int(a<=b), ">" : lambda a,b: int(a>b), ">=" : lambda a,b: int(a>=b) },
+  { "<<" : lambda a,b: a<<b, ">>" : lambda a,b: a>>b },
+  { "+" : lambda a,b: a+b, "-" : lambda a,b: a-b },
+  { "*" : lambda a,b: a*b, "/" : lambda a,b: c_div(a,b,False), "%" : lambda a,b: c_div(a,b,True) },
+]
+C_EXPR_UNARY_OPS = {
+  "!" : lambda a: int(not a),
+  "~" : lambda a: ~a,
+  "-" : lambda a: -a,
+  "+" : lambda a: a,
+}
+
+def parse_c_expression(expr):
+  tokens = [] # list of (kind, value) where kind is 'num', 'id' or 'op'
+  pos = 0
+  expr = expr.rstrip()
+  while pos < len(expr):
+    m = C_EXPR_TOKEN.match(expr, pos)
+    if not m: raise ValueError("Unexpected character in '"+expr+"' at "+str(pos))
+    pos = m.end()
+    if m.group(1): tokens.append(("num", c_int_literal(m.group(1))))
+    elif m.group(2): tokens.append(("id", m.group(2)))
+    else: tokens.append(("op", m.group(3)))
+  tokens.append(("end", None))
+  state = { "pos" : 0 }
+
+  def peek():
+    return tokens[state["pos"]]
+  def take(op = None):
+    t = tokens[state["pos"]]
+    if op!=None and t!=("op", op):
+      raise ValueError("Expected '"+op+"' in '"+expr+"'")
+    state["pos"] += 1
+    return t
+
+  def parse_primary():
+    kind, value = take()
+    if kind=="num":
+      return lambda env: value
+    if kind=="id" and value=="defined":
+      bracketed = peek()==("op","(")
+      if bracketed: take("(")
+      kind, name = take()
+      if kind!="id": raise ValueError("Expected identifier after 'defined' in '"+expr+"'")
+      if bracketed: take(")")
+      return lambda env: int(name in env["macros"])
+    if kind=="id":
+      return lambda env: c_macro_value(value, env)
+    if kind=="op" and value=="(":
+      e = parse_ternary()
+      take(")")
+      return e
+    if kind=="op" and value in C_EXPR_UNARY_OPS:
+      fn = C_EXPR_UNARY_OPS[value]
+      a = parse_primary()
+      return lambda env: fn(a(env))
+    raise ValueError("Unexpected "+("end" if kind=="end" else "'"+str(value)+"'")+" in '"+expr+"'")
+
+  def parse_binary(level):
+    if level>=len(C_EXPR_BINARY_OPS): return parse_primary()
+    ops = C_EXPR_BINARY_OPS[level]
+    a = parse_binary(level+1)
+    while peek()[0]=="op" and peek()[1] in ops:
+      op = take()[1]
+      b = parse_binary(level+1)
+      if op=="||": a = (lambda a,b: lambda env: int(bool(a(env)) or bool(b(env))))(a,b)
+      elif op=="&&": a = (lambda a,b: lambda env: int(bool(a(env)) and bool(b(env))))(a,b)
+      else: a = (lambda a,b,fn: lambda env: fn(a(env), b(env)))(a,b,ops[op])
+    return a
+
+  def parse_ternary():
+    c = parse_binary(0)
+    if peek()!=("op","?"): return c
+    take("?")
+    a = parse_ternary()
+    take(":")
+    b = parse_ternary()
+    return lambda env: a(env) if c(env) else b(env)
+
+  root = parse_ternary()
+  if peek()[0]!="end": raise ValueError("Unexpected '"+str(peek()[1])+"' in '"+expr+"'")
+  return root
+
+def compile_c_expression(expr):
+  root = parse_c_expression(expr)
+  def evaluate(macros):
+    env = { "macros" : macros, "unknown" : set(), "expanding" : set() }
+    value = root(env)
+    return value, sorted(env["unknown"])
+  return evaluate
+
+# The value of a macro used in an expression - macros may be defined as expressions themselves
+c_macro_expressions = {}
+def c_macro_value(name, env):
+  if not name in env["macros"] or name in env["expanding"]:
+    env["unknown"].add(name)
+    return 0
+  value = env["macros"][name]
+  if not value in c_macro_expressions:
+    c_macro_expressions[value] = parse_c_expression(value) if value.strip() else lambda env: 0
+  env["expanding"].add(name)
+  v = c_macro_expressions[value](env)
+  env["expanding"].discard(name)
+  return v
+
+# Turn a list of defines ("FOO", "BAR=5") into a dict of macros for compile_c_expression.
+# 'defined(X)=True/False' is used by get_jsondata to say whether X should count as defined.
+# Like the old string replacement, the first definition of a name wins
+def get_c_macros(defines):
+  macros = {}
+  for d in defines:
+    if "=" in d:
+      name = d[:d.find("=")]
+      value = d[d.find("=")+1:]
+    else:
+      name = d
+      value = "1" # like gcc -DFOO
+    if name.startswith("defined(") and name.endswith(")"):
+      name = name[8:-1]
+      if value!="True": continue
+      value = "1"
+    if not name in macros:
+      macros[name] = value
+  return macros
+
+# Used to find the JSON that a "patch" applies to
+def get_jsondata_key(jsondata):
+  return (jsondata.get("type"), jsondata.get("class"), jsondata.get("name"))
+
+# Copy the fields from a "patch" JSON block into the JSON it patches
+def patch_jsondata(targetjsondata, jsondata):
+  for key in jsondata:
+    if not key in ["type","class","name","patch","description"]:
+      print("Copying "+key+" --- "+str(jsondata[key]))
+      targetjsondata[key] = jsondata[key]
+
+# ----------------------------------------------------------------------------------------
+# Minimal perfect hashing of strings, for lookup tables in generated C code.
+#
+# get_perfect_hash(names, size) works out a 'hash and displace' (CHD-style) table so
+# that each name hashes to a different slot in 0..size-1 (size>=len(names)):
+#
+#   h = perfect_hash_fn(name, seed)
+#   slot = ((h>>16) + displacements[h % buckets]) % size
+#
+# and index[slot] is that name's position in names. Lookups are then one hash and one
+# string compare. get_perfect_hash_c_function outputs the matching C hash function.
+# Returns False if no hash could be found (eg. duplicate names)
+# ----------------------------------------------------------------------------------------
+
+def perfect_hash_fn(name, seed):
+  h = 2166136261 ^ seed # FNV-1a...
+  for ch in bytearray(name, "latin-1"):
+    h = ((h ^ ch) * 16777619) & 0xFFFFFFFF
+  h ^= h >> 16 # ... plus a little extra mixing
+  h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+  h ^= h >> 13
+  return h
+
+def get_perfect_hash(names, size = 0):
+  if size < len(names): size = len(names)
+  if size==0 or size>255: return False
+  # Try fewer buckets first (less flash), then more if we couldn't find a hash
+  for buckets in range((len(names)+2)//3, size+1):
+    if buckets==0: continue
+    for seed in range(256):
+      hashes = [perfect_hash_fn(name, seed) for name in names]
+      bucketItems = [[] for b in range(buckets)]
+      for i in range(len(names)):
+        bucketItems[hashes[i] % buckets].append(i)
+      displacements = [0] * buckets
+      index = [0] * size
+      taken = [False] * size
+      ok = True
+      # place the fullest buckets first
+      for b in sorted(range(buckets), key=lambda b: -len(bucketItems[b])):
+        if not bucketItems[b]: break
+        for d in range(size):
+          slots = [((hashes[i]>>16) + d) % size for i in bucketItems[b]]
+          if len(set(slots))==len(slots) and not any(taken[slot] for slot in slots): break
+        else:
+          ok = False
+          break
+        displacements[b] = d
+        for slot, i in zip(slots, bucketItems[b]):
+          taken[slot] = True
+          index[slot] = i
+      if ok:
+        return { "seed" : seed, "buckets" : buckets, "displacements" : displacements, "index" : index }
+  return False
+
+def get_perfect_hash_slot(name, phash):
+  h = perfect_hash_fn(name, phash["seed"])
+  return ((h>>16) + phash["displacements"][h % phash["buckets"]]) % len(phash["index"])
+
+def get_perfect_hash_c_function(fnName):
+  return """/// Hash function for perfect hash tables - must match perfect_hash_fn in scripts/common.py
+static uint32_t """+fnName+"""(const char *name, unsigned char seed) {
+  uint32_t h = 2166136261U ^ seed;
+  while (*name) h = (h ^ (unsigned char)*(name++)) * 16777619U;
+  h ^= h >> 16;
+  h *= 0x85EBCA6BU;
+  h ^= h >> 13;
+  return h;
+}
+"""
+
+# ----------------------------------------------------------------------------------------
+# get_string_pool(stringLists) puts all the strings in the lists into one pool of
+# '\0'-terminated strings, where any string that's the end of another one (eg. 'read'
+# in 'thread') shares its characters. Strings are added to the pool in the order the
+# lists first use them, so each list's strings stay close together.
+# Returns { "pool" : str, "offsets" : { string : offset in pool } }
+# ----------------------------------------------------------------------------------------
+
+def get_string_pool(stringLists):
+  strings = []
+  for stringList in stringLists:
+    strings.extend(stringList)
+  strings = list(OrderedDict.fromkeys(strings))
+  # Sorted by reversed string, any string that is the end of another comes just before
+  # another string that it is the end of - so work back and find what contains what
+  ordered = sorted(strings, key=lambda s: s[::-1])
+  container = {}
+  for i in range(len(ordered)-1, -1, -1):
+    s = ordered[i]
+    if i+1<len(ordered) and ordered[i+1].endswith(s):
+      container[s] = container[ordered[i+1]]
+    else:
+      container[s] = s
+  pool = ""
+  offsets = {}
+  for s in strings:
+    c = container[s]
+    if not c in offsets:
+      offsets[c] = len(pool)
+      pool += c + "\0"
+    offsets[s] = offsets[c] + len(c) - len(s)
+  return { "pool" : pool, "offsets" : offsets }
+
+# ----------------------------------------------------------------------------------------
+# pretokenise_js(code) does the same job as jslNewTokenisedStringFromLexer in
+# src/jslex.c for a whole JS file: comments and whitespace are removed, operators and
+# reserved words become single token bytes, and strings/ints are stored raw where
+# possible. Returns { "code" : bytearray, "tokens" : number of tokens }, or False
+# if the code couldn't be tokenised (eg. an unfinished comment)
+# ----------------------------------------------------------------------------------------
+
+# Token numbers from LEX_TYPES in src/jslex.h. These can't change, as the Web IDE/App
+# Loader pretokenise code too
+LEX_EOF = 0
+LEX_ID = 128
+LEX_INT = 129
+LEX_FLOAT = 130
+LEX_STR = 131
+LEX_TEMPLATE_LITERAL = 133
+LEX_REGEX = 135
+LEX_OPERATORS = [ "==", "===", "!=", "!==", "<=", "<<", "<<=", ">=", ">>", ">>>", ">>=", ">>>=",
+                  "+=", "-=", "++", "--", "*=", "/=", "%=", "&=", "&&", "|=", "||", "^=", "=>" ]
+LEX_OPERATORS_START = 138
+LEX_RESERVED_WORDS = [ "if", "else", "do", "while", "for", "break", "continue", "function", "return",
+                       "var", "let", "const", "this", "throw", "try", "catch", "finally", "true",
+                       "false", "null", "undefined", "new", "in", "instanceof", "switch", "case",
+                       "default", "delete", "typeof", "void", "debugger", "class", "extends",
+                       "super", "static", "of" ]
+LEX_R_LIST_START = 163
+LEX_R_LIST_END = LEX_R_LIST_START + len(LEX_RESERVED_WORDS) - 1
+LEX_NULLISH = 0xD0
+LEX_RAW_STRING8 = 0xD1
+LEX_RAW_STRING16 = 0xD2
+LEX_RAW_INT0 = 0xD3
+LEX_RAW_INT8 = 0xD4
+LEX_RAW_INT16 = 0xD5
+
+js_token_ops = {}
+for i in range(len(LEX_OPERATORS)):
+  js_token_ops[LEX_OPERATORS[i]] = LEX_OPERATORS_START+i
+js_token_ops["??"] = LEX_NULLISH
+js_token_words = {}
+for i in range(len(LEX_RESERVED_WORDS)):
+  js_token_words[LEX_RESERVED_WORDS[i]] = LEX_R_LIST_START+i
+# Tokens after which a '/' starts a regex (see JSLJT_FORWARDSLASH in jslGetNextToken)
+js_regex_after = [ord(ch) for ch in "!%&*+-/<=>?[{}(,;:"]
+js_regex_after_values = [js_token_words["true"], js_token_words["false"], js_token_words["null"], js_token_words["undefined"]]
+
+def js_is_whitespace(ch):
+  return ch in "\t\x0B\x0C \n\r"
+
+def js_is_digit(ch):
+  return ch>="0" and ch<="9"
+
+def js_is_id_start(ch):
+  return (ch>="a" and ch<="z") or (ch>="A" and ch<="Z") or ch=="_" or ch=="$"
+
+def js_is_id_char(ch):
+  return js_is_id_start(ch) or js_is_digit(ch)
+
+# Lex a string starting at code[pos] like jslLexString. Returns (tk, end, value), where
+# value is the string's contents if it can be stored raw, or None
+def js_lex_string(code, pos):
+  delim = code[pos]
+  pos += 1
+  value = ""
+  raw = True
+  lastCh = delim
+  nesting = 0
+  hasTemplate = False
+  while pos<len(code) and code[pos]!="\0" and (code[pos]!=delim or nesting):
+    ch = code[pos]
+    if delim=="`":
+      if (lastCh=="$" or nesting) and ch=="{":
+        nesting += 1
+        hasTemplate = True
+      elif nesting and ch=="}":
+        nesting -= 1
+    if nesting==0 and ch=="\\":
+      pos += 1
+      ch = code[pos] if pos<len(code) else "\0"
+      pos += 1
+      escapes = { "n":"\n", "b":"\b", "f":"\f", "r":"\r", "t":"\t", "v":"\x0B" }
+      if ch in escapes:
+        ch = escapes[ch]
+      elif ch=="u" or ch=="x":
+        digits = code[pos:pos+(4 if ch=="u" else 2)]
+        if ch=="u" or len(digits)<2 or not all(d in "0123456789abcdefABCDEF" for d in digits):
+          raw = False # UTF8 or invalid - leave it to the lexer
+        else:
+          pos += 2
+          ch = chr(int(digits,16))
+      elif ch>="0" and ch<="7":
+        digits = ch
+        while len(digits)<3 and pos<len(code) and code[pos]>="0" and code[pos]<="7":
+          digits += code[pos]
+          pos += 1
+        ch = chr(int(digits,8) & 255)
+      value += ch
+      lastCh = ch
+    elif ch=="\n" and delim!="`":
+      break
+    else:
+      value += ch
+      lastCh = ch
+      pos += 1
+  tk = LEX_TEMPLATE_LITERAL if (delim=="`" and hasTemplate) else LEX_STR
+  if pos>=len(code) or code[pos]!=delim:
+    tk += 1 # unfinished
+  if any(ord(ch)>=128 for ch in value): raw = False
+  return (tk, pos+1, value if raw else None)
+
+# Lex a regex starting at code[pos] like jslLexRegex, returns (tk, end)
+def js_lex_regex(code, pos):
+  pos += 1
+  while pos<len(code) and code[pos]!="\0" and code[pos]!="/":
+    if code[pos]=="\\":
+      pos += 1
+    elif code[pos]=="\n":
+      break
+    pos += 1
+  if pos>=len(code) or code[pos]!="/":
+    return (LEX_REGEX+1, pos)
+  pos += 1
+  while pos<len(code) and code[pos] in "gimyu":
+    pos += 1
+  return (LEX_REGEX, pos)
+
+# Lex a number starting at code[pos] like the JSLJT_NUMBER case of jslGetNextToken, returns (tk, end)
+def js_lex_number(code, pos):
+  def ch(): return code[pos] if pos<len(code) else "\0"
+  tk = LEX_INT
+  canBeFloating = True
+  if ch()==".":
+    pos += 1
+    if not js_is_digit(ch()): return (ord("."), pos)
+    tk = LEX_FLOAT
+  else:
+    if ch()=="0":
+      pos += 1
+      if ch() in "xXbBoO":
+        canBeFloating = False
+        pos += 1
+    while js_is_digit(ch()) or (not canBeFloating and ch() in "abcdefABCDEF") or ch()=="_":
+      pos += 1
+    if canBeFloating and ch()==".":
+      tk = LEX_FLOAT
+      pos += 1
+  if tk==LEX_FLOAT:
+    while js_is_digit(ch()) or ch()=="_":
+      pos += 1
+  if canBeFloating and ch() in "eE":
+    tk = LEX_FLOAT
+    pos += 1
+    if ch() in "-+": pos += 1
+    while js_is_digit(ch()) or ch()=="_":
+      pos += 1
+  return (tk, pos)
+
+# Token bytes that can be in pretokenised code (apart from the LEX_RAW_ ones)
+js_token_bytes = set(js_token_ops.values()) | set(js_token_words.values())
+
+# Split JS code into tokens. Returns a list of (tk, source text, raw string value or None),
+# or False if the code couldn't be tokenised. Like jslGetNextToken, any character >=128
+# outside a string is a token, so this can also read pretokenised code - LEX_RAW_STRING8/16
+# become LEX_STR with the string as the value, and LEX_RAW_INT0/8/16 become LEX_INT with
+# the number as the text
+def js_tokenise(code):
+  tokens = []
+  lastTk = LEX_EOF
+  pos = 0
+  while True:
+    # skip whitespace and comments
+    while pos<len(code):
+      if js_is_whitespace(code[pos]):
+        pos += 1
+      elif code.startswith("//", pos):
+        pos = code.find("\n", pos)
+        if pos<0: pos = len(code)
+      elif code.startswith("/*", pos):
+        end = code.find("*/", pos+2)
+        if end<0: return False # unfinished comment
+        pos = end+2
+      else:
+        break
+    if pos>=len(code) or code[pos]=="\0": break
+    start = pos
+    ch = code[pos]
+    value = None
+    text = None
+    if ord(ch)>=LEX_ID: # pretokenised
+      tk = ord(ch)
+      pos += 1
+      if tk==LEX_RAW_STRING8 or tk==LEX_RAW_STRING16:
+        lengthBytes = 2 if tk==LEX_RAW_STRING16 else 1
+        if pos+lengthBytes>len(code): return False
+        length = ord(code[pos])
+        if lengthBytes==2: length |= ord(code[pos+1])<<8
+        pos += lengthBytes
+        if pos+length>len(code): return False
+        value = code[pos:pos+length]
+        pos += length
+        tk = LEX_STR
+      elif tk==LEX_RAW_INT0 or tk==LEX_RAW_INT8 or tk==LEX_RAW_INT16:
+        valueBytes = [0,1,2][tk-LEX_RAW_INT0]
+        if pos+valueBytes>len(code): return False
+        intValue = 0
+        for i in range(valueBytes):
+          intValue |= ord(code[pos+i])<<(8*i)
+        if valueBytes and intValue>=1<<(8*valueBytes-1): intValue -= 1<<(8*valueBytes) # signed
+        pos += valueBytes
+        tk = LEX_INT
+        text = str(intValue)
+      elif not tk in js_token_bytes:
+        return False # not a token we'd ever store
+    elif js_is_id_start(ch):
+      while pos<len(code) and js_is_id_char(code[pos]):
+        pos += 1
+      tk = js_token_words.get(code[start:pos], LEX_ID)
+    elif js_is_digit(ch) or ch==".":
+      tk, pos = js_lex_number(code, pos)
+    elif ch in "\"'`":
+      tk, pos, value = js_lex_string(code, pos)
+    elif ch=="/" and (lastTk==LEX_EOF or lastTk in js_regex_after or
+                      (lastTk>=LEX_OPERATORS_START and lastTk<=LEX_NULLISH and not lastTk in js_regex_after_values)):
+      tk, pos = js_lex_regex(code, pos)
+    else:
+      tk = ord(ch)
+      pos += 1
+      for l in [4,3,2]:
+        if code[start:start+l] in js_token_ops:
+          tk = js_token_ops[code[start:start+l]]
+          pos = start+l
+          break
+    if tk in [LEX_STR+1, LEX_TEMPLATE_LITERAL+1, LEX_REGEX+1]: return False # unfinished
+    tokens.append((tk, code[start:pos] if text==None else text, value))
+    lastTk = tk
+  return tokens
+
+# get the value of an integer token, or None if we'd rather leave it to the lexer (eg. 010)
+def js_int_value(s):
+  s = s.replace("_","")
+  if len(s)>1 and s[0]=="0" and not s[1] in "xXbBoO": return None
+  try:
+    return int(s, 0)
+  except ValueError:
+    return None
+
+# When pretokenising, do we need to insert a space between these tokens? See jslPreserveSpaceBetweenTokens
+def js_preserve_space_between_tokens(lastTk, newTk):
+  if lastTk in [LEX_ID, LEX_FLOAT, LEX_INT] and newTk in [LEX_ID, LEX_FLOAT, LEX_INT]: return True
+  return ((lastTk==ord("-") and newTk==ord("-")) or
+          (lastTk==ord("+") and newTk==ord("+")) or
+          (lastTk==ord("/") and newTk==LEX_REGEX) or
+          (lastTk==LEX_REGEX and (newTk==ord("/") or newTk==LEX_ID)))
+
+# Check JS code (text or pretokenised) lexes into whole tokens, with its brackets matched.
+# Returns an error message, or None if it's ok. If originalCode is given, also check code
+# has the same tokens as it (so code is originalCode correctly pretokenised)
+def js_check_lexes(code, originalCode=None):
+  tokens = js_tokenise(code)
+  if tokens==False: return "unable to lex it"
+  brackets = []
+  for tk, text, value in tokens:
+    if tk in [ord("("), ord("["), ord("{")]:
+      brackets.append(tk)
+    elif tk in [ord(")"), ord("]"), ord("}")]:
+      if not brackets or chr(brackets.pop())+chr(tk) not in ["()", "[]", "{}"]:
+        return "unmatched '"+chr(tk)+"'"
+  if brackets: return "no match for '"+chr(brackets[-1])+"'"
+  if originalCode!=None:
+    def tokenKey(token):
+      tk, text, value = token
+      if tk==LEX_STR: return (tk, text if value==None else value)
+      if tk==LEX_INT: return (tk, js_int_value(text) if js_int_value(text)!=None else text)
+      if tk in [LEX_ID, LEX_FLOAT, LEX_TEMPLATE_LITERAL, LEX_REGEX]: return (tk, text)
+      return (tk, None) # operator/reserved word/single character
+    originalTokens = js_tokenise(originalCode)
+    if originalTokens==False: return "unable to lex the original code"
+    if len(tokens)!=len(originalTokens): return "different number of tokens"
+    for token, originalToken in zip(tokens, originalTokens):
+      if tokenKey(token)!=tokenKey(originalToken):
+        return "got "+repr(token[1])+" instead of "+repr(originalToken[1])
+  return None
+
+def pretokenise_js(code):
+  tokens = js_tokenise(code)
+  if tokens==False: return False
+  out = bytearray()
+  lastTk = LEX_EOF
+  for tk, text, value in tokens:
+    if js_preserve_space_between_tokens(lastTk, tk):
+      out.append(32)
+    intValue = js_int_value(text) if tk==LEX_INT else None
+    if tk==LEX_STR and value!=None and len(value)>0 and len(value)<65536:
+      if len(value)<256:
+        out += bytearray([LEX_RAW_STRING8, len(value)])
+      else:
+        out += bytearray([LEX_RAW_STRING16, len(value)&255, len(value)>>8])
+      out += bytearray(value, "latin-1")
+    elif intValue==0:
+      out.append(LEX_RAW_INT0)
+    elif intValue!=None and intValue>=-128 and intValue<128:
+      out += bytearray([LEX_RAW_INT8, intValue&255])
+    elif intValue!=None and intValue>=-32768 and intValue<32768:
+      out += bytearray([LEX_RAW_INT16, intValue&255, (intValue>>8)&255])
+    elif tk in [LEX_ID, LEX_INT, LEX_FLOAT, LEX_STR, LEX_TEMPLATE_LITERAL, LEX_REGEX]:
+      out += bytearray(text, "latin-1")
+    else:
+      out.append(tk)
+    lastTk = tk
+  return { "code" : out, "tokens" : len(tokens) }
+
+# ----------------------------------------------------------------------------------------
+# heatshrink_compress(data) compresses a bytearray so that libs/compression/heatshrink
+# can decompress it - using the same window (8 bits) and lookahead (6 bits) as
+# heatshrink_config.h.
+# ----------------------------------------------------------------------------------------
+
+HEATSHRINK_WINDOW_BITS = 8
+HEATSHRINK_LOOKAHEAD_BITS = 6
+
+def heatshrink_compress(data):
+  window = 1 << HEATSHRINK_WINDOW_BITS
+  lookahead = 1 << HEATSHRINK_LOOKAHEAD_BITS
+  # A backref is 1+window+lookahead bits and a literal is 9 - only use backrefs when they're smaller
+  minMatch = (1 + HEATSHRINK_WINDOW_BITS + HEATSHRINK_LOOKAHEAD_BITS) // 9 + 1
+  bits = []
+  positions = {} # last positions of each pair of bytes
+  def addPosition(i):
+    if i+1<len(data):
+      positions.setdefault(bytes(data[i:i+2]), []).append(i)
+  i = 0
+  while i<len(data):
+    bestLen = 0
+    bestOffset = 0
+    for j in reversed(positions.get(bytes(data[i:i+2]), [])):
+      if i-j > window: break
+      l = 0
+      while l<lookahead and i+l<len(data) and data[j+l]==data[i+l]:
+        l += 1
+      if l>bestLen:
+        bestLen = l
+        bestOffset = i-j
+        if l==lookahead: break
+    if bestLen>=minMatch:
+      bits.append((0, 1))
+      bits.append((bestOffset-1, HEATSHRINK_WINDOW_BITS))
+      bits.append((bestLen-1, HEATSHRINK_LOOKAHEAD_BITS))
+    else:
+      bestLen = 1
+      bits.append((1, 1))
+      bits.append((data[i], 8))
+    for j in range(i, i+bestLen):
+      addPosition(j)
+    i += bestLen
+  out = bytearray()
+  acc = 0
+  accBits = 0
+  for value, count in bits:
+    acc = (acc << count) | value
+    accBits += count
+    while accBits>=8:
+      accBits -= 8
+      out.append((acc >> accBits) & 255)
+    acc &= (1 << accBits) - 1
+  if accBits:
+    out.append((acc << (8-accBits)) & 255)
+  return out
 
 # Scans files for comments of the form /*JSON......*/
 #
@@ -136,7 +987,7 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
             print("BOARD "+arg[2:]);
             print("Now ignore_ifdefs = False");
             ignore_ifdefs = False
-            board = importlib.import_module(arg[2:])
+            board = get_board(arg[2:])
           elif arg[1]=="F":
             "" # -Fxxx.yy in args is filename xxx.yy, which is mandatory for build_jswrapper.py
           else:
@@ -182,31 +1033,31 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
     githash = get_git_hash()
     if len(githash)==0: githash="master"
 
-    jsondatas = []
-    for jswrap in jswraps:
-      # ignore anything from archives
-      if jswrap.startswith("./archives/"): continue
+    # for evaluating "#if" - each distinct expression is only compiled once
+    macros = get_c_macros(defines)
+    compiled_ifs = {}
+
+    # ignore anything from archives
+    jswraps = [jswrap for jswrap in jswraps if not jswrap.startswith("./archives/")]
+    # now scan
+    allscanned = scan_jswrap_files(jswraps)
 
-      # now scan
+    jsondatas = []
+    jsondataIndex = {} # get_jsondata_key(jsondata) -> first jsondata with that key, for "patch"
+    pendingPatches = {} # get_jsondata_key(jsondata) -> [patches] for patches found before what they patch
+    for jswrap, scanned in zip(jswraps, allscanned):
       print("Scanning "+jswrap)
-      code = open(jswrap, "r").read()
 
-      if is_for_document and not explicit_files and "DO_NOT_INCLUDE_IN_DOCS" in code:
+      if is_for_document and not explicit_files and scanned["do_not_include_in_docs"]:
         print("FOUND 'DO_NOT_INCLUDE_IN_DOCS' IN FILE "+jswrap)
         continue
 
-      for comment in re.findall(r"/\*JSON.*?\*/", code, re.VERBOSE | re.MULTILINE | re.DOTALL):
-        charnumber = code.find(comment)
-        linenumber = 1+code.count("\n", 0, charnumber)
-        # Strip off /*JSON .. */ bit
-        comment = comment[6:-2]
-
-        endOfJson = comment.find("\n}")+2;
-        jsonstring = comment[0:endOfJson];
-        description =  comment[endOfJson:].strip();
-#            print("Parsing "+jsonstring)
+      for block in scanned["blocks"]:
+        linenumber = block["line"]
+        jsonstring = block["jsonstring"]
+        description = block["description"]
         try:
-          jsondata = json.loads(jsonstring)
+          jsondata = block["json"]
           if len(description): jsondata["description"] = description;
           else: jsondata["description"] = ""
           jsondata["filename"] = jswrap
@@ -243,36 +1094,33 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
               exit(1)
             if ("#if" in jsondata):
               expr = jsondata["#if"]
-              for defn in defines:
-                expr = expr.replace("defined("+defn+")", "True");
-                if defn.find('=')!=-1:
-                  dname = defn[:defn.find('=')]
-                  dkey = defn[defn.find('=')+1:]
-                  expr = expr.replace("defined("+dname+")", "True");
-                  expr = expr.replace(dname, dkey);
-              # Now replace any defined(...) we haven't heard of with false
-              expr = re.sub(r"defined\([^\)]*\)", "False", expr)
-              expr = expr.replace("||","or").replace("&&","and");
-              expr = expr.replace("!","not ");
               try:
-                r = eval(expr)
-              except:
-                print("WARNING: error evaluating '"+expr+"' - from '"+jsondata["#if"]+"'")
-                r = True
+                if not expr in compiled_ifs:
+                  compiled_ifs[expr] = compile_c_expression(expr)
+                r, unknown = compiled_ifs[expr](macros)
+              except ValueError as e:
+                sys.stderr.write( "Invalid '#if' in " + jsonstring + " - "+str(e) + "\n" )
+                exit(1)
+              if len(unknown):
+                print("WARNING: unknown identifiers "+", ".join(unknown)+" in '#if "+expr+"' - treated as 0")
               if not r:
-                print(dropped_prefix+" because of #if "+jsondata["#if"]+ " -> "+expr)
+                print(dropped_prefix+" because of #if "+expr+ " -> "+str(r))
                 drop = True
           if not drop and "patch" in jsondata:
-            targetjsondata = [x for x in jsondatas if x["type"]==jsondata["type"] and x["class"]==jsondata["class"] and x["name"]==jsondata["name"]]
-            if len(targetjsondata) > 0:
-              targetjsondata = targetjsondata[0]
-              for key in jsondata:
-                if not key in ["type","class","name","patch","description"]:
-                  print("Copying "+key+" --- "+jsondata[key])
-                  targetjsondata[key] = jsondata[key]
+            key = get_jsondata_key(jsondata)
+            if key in jsondataIndex:
+              patch_jsondata(jsondataIndex[key], jsondata)
+            else: # target may be in a file we haven't scanned yet
+              if not key in pendingPatches: pendingPatches[key] = []
+              pendingPatches[key].append(jsondata)
             drop = True
           if not drop:
             jsondatas.append(jsondata)
+            key = get_jsondata_key(jsondata)
+            if not key in jsondataIndex:
+              jsondataIndex[key] = jsondata
+              for patch in pendingPatches.pop(key, []):
+                patch_jsondata(jsondata, patch)
         except ValueError as e:
           sys.stderr.write( "JSON PARSE FAILED for " +  jsonstring + " - "+ str(e) + "\n")
           exc_obj = sys.exc_info()
@@ -283,6 +1131,8 @@ def get_jsondata(is_for_document, parseArgs = True, boardObject = False):
           exc_obj = sys.exc_info()
           print(''.join(traceback.format_exception(exc_obj)))
           exit(1)
+    for key in sorted(pendingPatches, key=lambda k: tuple(x or "" for x in k)): # class may be None
+      print("WARNING: Nothing to patch for "+".".join([k for k in key if k])+" - patch dropped")
     print("Scanning finished.")
 
     if board:
@@ -0,0 +1,156 @@
+#!/bin/false
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Reads the section headers and symbol table of 32 bit ELF files, so scripts can check
+# sizes and find symbols without needing objdump/nm from the board's toolchain.
+#
+#   elf = elfutils.ElfFile("espruino.elf")
+#   text = elf.section(".text") # name, addr, lma, size, ...
+#   entry = elf.symbol("call_user_start") # name, value, size, bind, ...
+#
+# The file is mmapped and only the parts we need are unpacked (the symbol table isn't
+# read unless it's asked for).
+# ----------------------------------------------------------------------------------------
+
+import mmap;
+import struct;
+
+# e_ident
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+# sh_type
+SHT_NOBITS = 8
+SHT_SYMTAB = 2
+# sh_flags
+SHF_ALLOC = 2
+# p_type
+PT_LOAD = 1
+# st_shndx
+SHN_UNDEF = 0
+SHN_ABS = 0xFFF1
+# st_info
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+
+class ElfSection:
+  def __init__(self, index, fields):
+    self.index = index
+    (self.nameOffset, self.type, self.flags, self.addr, self.offset,
+     self.size, self.link, self.info, self.addralign, self.entsize) = fields
+    self.name = ""
+    self.lma = self.addr # load address - set from the program headers
+  def __repr__(self):
+    return "<ElfSection %s addr=0x%08x lma=0x%08x size=0x%x>" % (self.name, self.addr, self.lma, self.size)
+
+class ElfSymbol:
+  def __init__(self, name, fields):
+    self.name = name
+    nameOffset, self.value, self.size, info, self.other, self.shndx = fields
+    self.bind = info >> 4
+    self.type = info & 15
+  def is_global(self):
+    return self.bind==STB_GLOBAL or self.bind==STB_WEAK
+  def is_defined(self):
+    return self.shndx!=SHN_UNDEF
+  def __repr__(self):
+    return "<ElfSymbol %s value=0x%08x size=%d>" % (self.name, self.value, self.size)
+
+class ElfFile:
+  def __init__(self, filename):
+    self.filename = filename
+    self.file = open(filename, "rb")
+    try:
+      self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError: # empty file
+      self.data = b""
+    if self.data[0:4]!=b"\x7fELF":
+      self.close()
+      raise ValueError(filename+" is not an ELF file")
+    if self.data[4]!=ELFCLASS32:
+      self.close()
+      raise ValueError(filename+" is not a 32 bit ELF file")
+    self.endian = ">" if self.data[5]==ELFDATA2MSB else "<"
+    (self.type, self.machine, self.version, self.entry, phoff, shoff, self.flags, ehsize,
+     phentsize, phnum, shentsize, shnum, shstrndx) = struct.unpack_from(self.endian+"HHIIIIIHHHHHH", self.data, 16)
+    # Program headers (p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align)
+    self.segments = [struct.unpack_from(self.endian+"8I", self.data, phoff + i*phentsize) for i in range(phnum)]
+    # Section headers
+    self.sections = [ElfSection(i, struct.unpack_from(self.endian+"10I", self.data, shoff + i*shentsize)) for i in range(shnum)]
+    if shstrndx < len(self.sections):
+      for section in self.sections:
+        section.name = self.get_string(self.sections[shstrndx], section.nameOffset)
+    # Work out load addresses the same way objdump does, from the segment each section is in
+    for section in self.sections:
+      if not (section.flags & SHF_ALLOC): continue
+      for ptype, poffset, pvaddr, ppaddr, pfilesz, pmemsz, pflags, palign in self.segments:
+        if ptype!=PT_LOAD: continue
+        if section.type==SHT_NOBITS:
+          if pvaddr <= section.addr and section.addr+section.size <= pvaddr+pmemsz:
+            section.lma = ppaddr + section.addr - pvaddr
+            break
+        elif poffset <= section.offset and section.offset+section.size <= poffset+pfilesz:
+          section.lma = ppaddr + section.offset - poffset
+          break
+    self.sectionsByName = {}
+    for section in reversed(self.sections): # first one wins if names are duplicated
+      self.sectionsByName[section.name] = section
+    self.symbolList = None
+
+  def close(self):
+    if isinstance(self.data, mmap.mmap): self.data.close()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  # Get a NULL-terminated string from a string table section
+  def get_string(self, strtab, offset):
+    start = strtab.offset + offset
+    end = self.data.find(b"\0", start, strtab.offset + strtab.size)
+    if end<0: end = strtab.offset + strtab.size
+    return self.data[start:end].decode("latin-1")
+
+  # Get a section by name, or None if there isn't one
+  def section(self, name):
+    return self.sectionsByName.get(name)
+
+  # Get the contents of a section (empty for .bss-style sections)
+  def section_data(self, section):
+    if section.type==SHT_NOBITS: return b""
+    return self.data[section.offset:section.offset+section.size]
+
+  # Get all the symbols in the symbol table (an empty list if it has been stripped)
+  def symbols(self):
+    if self.symbolList==None:
+      self.symbolList = []
+      for symtab in self.sections:
+        if symtab.type!=SHT_SYMTAB or symtab.link>=len(self.sections): continue
+        strtab = self.sections[symtab.link]
+        entsize = symtab.entsize or 16
+        count = symtab.size // entsize
+        table = self.data[symtab.offset:symtab.offset + count*entsize]
+        for fields in struct.iter_unpack(self.endian+"IIIBBH", table):
+          self.symbolList.append(ElfSymbol(self.get_string(strtab, fields[0]), fields))
+    return self.symbolList
+
+  # Get a symbol by name, or None. Defined global symbols are preferred (like 'nm -g')
+  def symbol(self, name):
+    found = None
+    for sym in self.symbols():
+      if sym.name!=name: continue
+      if sym.is_global() and sym.is_defined(): return sym
+      if found==None: found = sym
+    return found
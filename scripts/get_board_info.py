@@ -36,5 +36,5 @@ if len(sys.argv)!=3:
   exit(1)
 boardname = sys.argv[1]
 # import the board def
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 print(eval(sys.argv[2]));
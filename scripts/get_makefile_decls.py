@@ -35,7 +35,7 @@ if len(sys.argv)!=2:
   exit(1)
 boardname = sys.argv[1]
 # import the board def
-board = importlib.import_module(boardname)
+board = common.get_board(boardname)
 #print(json.dumps(board.info))
 
 print("# Generated with scripts/get_makefile_decls.py "+boardname);
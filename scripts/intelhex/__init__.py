@@ -36,9 +36,10 @@
 __docformat__ = "javadoc"
 
 from array import array
-from binascii import hexlify, unhexlify
+from binascii import crc32, hexlify, unhexlify
 from bisect import bisect_right
 import os
+import re
 import sys
 
 from intelhex.compat import (
@@ -56,6 +57,7 @@ from intelhex.compat import (
     )
 
 from intelhex.getsizeof import total_size
+from intelhex.segments import SegmentBuffer
 
 
 class _DeprecatedParam(object):
@@ -64,6 +66,14 @@ class _DeprecatedParam(object):
 _DEPRECATED = _DeprecatedParam()
 
 
+def _pad_bytes(pad, n, type=bytes):
+    """Return n padding bytes. Padding that is not a byte value raises
+    OverflowError, as array('B') does."""
+    if not 0 <= pad <= 255:
+        raise OverflowError("padding 0x%X is not a byte value" % pad)
+    return type(bytearray([pad]) * n)
+
+
 class IntelHex(object):
     ''' Intel HEX file reader. '''
 
@@ -98,6 +108,17 @@ class IntelHex(object):
             else:
                 raise ValueError("source: bad initializer type")
 
+    def _get_buf(self):
+        return self._segments
+
+    def _set_buf(self, buf):
+        if not isinstance(buf, SegmentBuffer):
+            buf = SegmentBuffer(buf)    # e.g. dict {addr: byte}
+        self._segments = buf
+
+    # data as SegmentBuffer; can also be set to dict {addr: byte}
+    _buf = property(_get_buf, _set_buf)
+
     def _decode_record(self, s, line=0):
         '''Decode one record of HEX file.
 
@@ -140,13 +161,16 @@ class IntelHex(object):
         if record_type == 0:
             # data record
             addr += self._offset
-            for i in range_g(4, 4+record_length):
-                if not self._buf.get(addr, None) is None:
-                    raise AddressOverlapError(address=addr, line=line)
-                self._buf[addr] = bin[i]
-                addr += 1   # FIXME: addr should be wrapped 
-                            # BUT after 02 record (at 64K boundary)
-                            # and after 04 record (at 4G boundary)
+            if self._buf.overlaps(addr, addr+record_length):
+                for i in range_g(record_length):
+                    if (addr+i) in self._buf:
+                        # data before the overlap is still loaded
+                        self._buf.write(addr, bin[4:4+i])
+                        raise AddressOverlapError(address=addr+i, line=line)
+            self._buf.write(addr, bin[4:4+record_length])
+            # FIXME: addr should be wrapped
+            # BUT after 02 record (at 64K boundary)
+            # and after 04 record (at 4G boundary)
 
         elif record_type == 1:
             # end of file record
@@ -201,21 +225,102 @@ class IntelHex(object):
         else:
             fclose = None
 
-        self._offset = 0
-        line = 0
-
         try:
-            decode = self._decode_record
-            try:
-                for s in fobj:
-                    line += 1
-                    decode(s, line)
-            except _EndOfFile:
-                pass
+            lines = fobj.readlines()
         finally:
             if fclose:
                 fclose()
 
+        self._offset = 0
+        if self._decode_records_fast(lines):
+            return
+        # something is wrong with the file: decode record by record
+        # to raise the right error
+        line = 0
+        decode = self._decode_record
+        try:
+            for s in lines:
+                line += 1
+                decode(s, line)
+        except _EndOfFile:
+            pass
+
+    def _decode_records_fast(self, lines):
+        '''Fast path for loadhex. Decodes all lines, joining data records
+        that follow each other into runs, and then writes each run with
+        one write. Data is only stored if the whole file is valid.
+
+        @param  lines   list of lines of HEX file.
+        @return         True if all data loaded, False if there is
+                        an error in the file (or its data overlaps)
+                        and nothing was changed.
+        '''
+        offset = self._offset
+        start_addr = self.start_addr
+        runs = []           # [start address, bytearray]
+        run = None
+        run_end = None
+        for s in lines:
+            s = s.rstrip('\r\n')
+            if not s:
+                continue
+            if s[0] != ':':
+                return False
+            try:
+                bin = bytearray(unhexlify(asbytes(s[1:])))
+            except (TypeError, ValueError):
+                return False
+            record_length = len(bin) - 5
+            if record_length < 0 or bin[0] != record_length or sum(bin) & 0x0FF:
+                return False
+            record_type = bin[3]
+            if record_type == 0:
+                if record_length == 0:
+                    continue
+                addr = offset + (bin[1]*256 + bin[2])
+                if addr == run_end:
+                    run += bin[4:-1]
+                else:
+                    run = bin[4:-1]
+                    runs.append((addr, run))
+                run_end = addr + record_length
+                continue
+            if record_type == 1 and record_length == 0:
+                break     # EOF record can have any address, as in loadhex
+            if bin[1] or bin[2]:
+                return False
+            if record_type == 2 and record_length == 2:
+                offset = (bin[4]*256 + bin[5]) * 16
+            elif record_type == 4 and record_length == 2:
+                offset = (bin[4]*256 + bin[5]) * 65536
+            elif record_type == 3 and record_length == 4 and not start_addr:
+                start_addr = {'CS': bin[4]*256 + bin[5],
+                              'IP': bin[6]*256 + bin[7],
+                             }
+            elif record_type == 5 and record_length == 4 and not start_addr:
+                start_addr = {'EIP': (bin[4]*16777216 +
+                                      bin[5]*65536 +
+                                      bin[6]*256 +
+                                      bin[7]),
+                             }
+            else:
+                return False
+            run_end = None
+        # check for overlaps as ranges, not byte by byte
+        runs.sort(key=lambda r: r[0])
+        prev_end = None
+        for start, data in runs:
+            if prev_end is not None and start < prev_end:
+                return False
+            prev_end = start + len(data)
+            if self._buf.overlaps(start, prev_end):
+                return False
+        for start, data in runs:
+            self._buf.write(start, data)
+        self.start_addr = start_addr
+        self._offset = offset
+        return True
+
     def loadbin(self, fobj, offset=0):
         """Load bin file into internal buffer. Not needed if source set in
         constructor. This will overwrite addresses without warning
@@ -282,16 +387,14 @@ class IntelHex(object):
         """Load data from array or list of bytes.
         Similar to loadbin() method but works directly with iterable bytes.
         """
-        for b in bytes:
-            self._buf[offset] = b
-            offset += 1
+        self._buf.write(offset, bytearray(bytes))
 
     def _get_start_end(self, start=None, end=None, size=None):
         """Return default values for start and end if they are None.
         If this IntelHex object is empty then it's error to
         invoke this method with both start and end as None. 
         """
-        if (start,end) == (None,None) and self._buf == {}:
+        if (start,end) == (None,None) and not self._buf:
             raise EmptyIntelHexError
         if size is not None:
             if None not in (start, end):
@@ -339,17 +442,7 @@ class IntelHex(object):
 
     def _tobinarray_really(self, start, end, pad, size):
         """Return binary array."""
-        if pad is None:
-            pad = self.padding
-        bin = array('B')
-        if self._buf == {} and None in (start, end):
-            return bin
-        if size is not None and size <= 0:
-            raise ValueError("tobinarray: wrong value for size")
-        start, end = self._get_start_end(start, end, size)
-        for i in range_g(start, end+1):
-            bin.append(self._buf.get(i, pad))
-        return bin
+        return array('B', self._tobinstr_really(start, end, pad, size))
 
     def tobinstr(self, start=None, end=None, pad=_DEPRECATED, size=None):
         ''' Convert to binary form and return as binary string.
@@ -373,7 +466,24 @@ class IntelHex(object):
         return self._tobinstr_really(start, end, pad, size)
 
     def _tobinstr_really(self, start, end, pad, size):
-        return array_tobytes(self._tobinarray_really(start, end, pad, size))
+        """Return binary data as bytes. The output is filled with padding
+        and then each segment is copied in with one slice assignment."""
+        if pad is None:
+            pad = self.padding
+        if not self._buf and None in (start, end):
+            return asbytes('')
+        if size is not None and size <= 0:
+            raise ValueError("tobinarray: wrong value for size")
+        start, end = self._get_start_end(start, end, size)
+        data = self._buf.read(start, end-start+1)
+        if data is not None:
+            return data     # all in one segment, so no padding
+        bin = _pad_bytes(pad, end-start+1, bytearray)
+        for seg_start, seg in self._buf.chunks(start, end+1):
+            lo = max(seg_start, start)
+            hi = min(seg_start+len(seg), end+1)
+            bin[lo-start:hi-start] = seg[lo-seg_start:hi-seg_start]
+        return bytes(bin)
 
     def tobinfile(self, fobj, start=None, end=None, pad=_DEPRECATED, size=None):
         '''Convert to binary and write to file.
@@ -401,10 +511,41 @@ class IntelHex(object):
         else:
             close_fd = False
 
-        fobj.write(self._tobinstr_really(start, end, pad, size))
+        try:
+            self._tobinfile_really(fobj, start, end, pad, size)
+        finally:
+            if close_fd:
+                fobj.close()
 
-        if close_fd:
-            fobj.close()
+    def _tobinfile_really(self, fobj, start, end, pad, size):
+        """Write binary data to file object segment by segment, with
+        padding written in blocks between them."""
+        if pad is None:
+            pad = self.padding
+        if not self._buf and None in (start, end):
+            return
+        if size is not None and size <= 0:
+            raise ValueError("tobinarray: wrong value for size")
+        start, end = self._get_start_end(start, end, size)
+        chunks = self._buf.chunks(start, end+1)
+        if (len(chunks) != 1 or chunks[0][0] > start or
+                chunks[0][0] + len(chunks[0][1]) <= end):
+            # there will be gaps to fill
+            pad_block = _pad_bytes(pad, min(end+1-start, 65536))
+        addr = start
+        for seg_start, seg in chunks + [(end+1, None)]:
+            while addr < seg_start:
+                n = min(seg_start - addr, len(pad_block))
+                fobj.write(pad_block[:n])
+                addr += n
+            if seg is None:
+                break
+            hi = min(seg_start+len(seg), end+1)
+            if addr == seg_start and hi == seg_start+len(seg):
+                fobj.write(seg)     # whole segment, without a copy
+            else:
+                fobj.write(seg[addr-seg_start:hi-seg_start])
+            addr = hi
 
     def todict(self):
         '''Convert to python dictionary.
@@ -412,7 +553,7 @@ class IntelHex(object):
         @return         dict suitable for initializing another IntelHex object.
         '''
         r = {}
-        r.update(self._buf)
+        r.update(self._buf.items())
         if self.start_addr:
             r['start_addr'] = self.start_addr
         return r
@@ -421,29 +562,19 @@ class IntelHex(object):
         '''Returns all used addresses in sorted order.
         @return         list of occupied data addresses in sorted order. 
         '''
-        aa = dict_keys(self._buf)
-        aa.sort()
-        return aa
+        return self._buf.keys()
 
     def minaddr(self):
         '''Get minimal address of HEX content.
         @return         minimal address or None if no data
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
-            return None
-        else:
-            return min(aa)
+        return self._buf.minaddr()
 
     def maxaddr(self):
         '''Get maximal address of HEX content.
         @return         maximal address or None if no data
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
-            return None
-        else:
-            return max(aa)
+        return self._buf.maxaddr()
 
     def __getitem__(self, addr):
         ''' Get requested byte from address.
@@ -457,17 +588,22 @@ class IntelHex(object):
                 raise TypeError('Address should be >= 0.')
             return self._buf.get(addr, self.padding)
         elif t == slice:
-            addresses = dict_keys(self._buf)
             ih = IntelHex()
-            if addresses:
-                addresses.sort()
-                start = addr.start or addresses[0]
-                stop = addr.stop or (addresses[-1]+1)
+            if self._buf:
+                start = addr.start or self._buf.minaddr()
+                stop = addr.stop or (self._buf.maxaddr()+1)
                 step = addr.step or 1
-                for i in range_g(start, stop, step):
-                    x = self._buf.get(i)
-                    if x is not None:
-                        ih[i] = x
+                if step == 1:
+                    # copy the parts of segments that are in range
+                    for s, buf in self._buf.chunks():
+                        if s < stop and s+len(buf) > start:
+                            a = max(s, start)
+                            ih._buf.write(a, buf[a-s:min(s+len(buf), stop)-s])
+                else:
+                    for i in range_g(start, stop, step):
+                        x = self._buf.get(i)
+                        if x is not None:
+                            ih[i] = x
             return ih
         else:
             raise TypeError('Address has unsupported type: %s' % t)
@@ -500,10 +636,13 @@ class IntelHex(object):
                 raise TypeError('start address cannot be negative')
             if stop < 0:
                 raise TypeError('stop address cannot be negative')
-            j = 0
-            for i in range_g(start, stop, step):
-                self._buf[i] = byte[j]
-                j += 1
+            if step == 1:
+                self._buf.write(start, byte)
+            else:
+                j = 0
+                for i in range_g(start, stop, step):
+                    self._buf[i] = byte[j]
+                    j += 1
         else:
             raise TypeError('Address has unsupported type: %s' % t)
 
@@ -515,22 +654,23 @@ class IntelHex(object):
                 raise TypeError('Address should be >= 0.')
             del self._buf[addr]
         elif t == slice:
-            addresses = dict_keys(self._buf)
-            if addresses:
-                addresses.sort()
-                start = addr.start or addresses[0]
-                stop = addr.stop or (addresses[-1]+1)
+            if self._buf:
+                start = addr.start or self._buf.minaddr()
+                stop = addr.stop or (self._buf.maxaddr()+1)
                 step = addr.step or 1
-                for i in range_g(start, stop, step):
-                    x = self._buf.get(i)
-                    if x is not None:
-                        del self._buf[i]
+                if step == 1:
+                    self._buf.delete(start, stop)
+                else:
+                    for i in range_g(start, stop, step):
+                        x = self._buf.get(i)
+                        if x is not None:
+                            del self._buf[i]
         else:
             raise TypeError('Address has unsupported type: %s' % t)
 
     def __len__(self):
         """Return count of bytes with real values."""
-        return len(dict_keys(self._buf))
+        return len(self._buf)
 
     def _get_eol_textfile(eolstyle, platform):
         if eolstyle == 'native':
@@ -623,86 +763,43 @@ class IntelHex(object):
                 raise InvalidStartAddressValueError(start_addr=self.start_addr)
 
         # data
-        addresses = dict_keys(self._buf)
-        addresses.sort()
-        addr_len = len(addresses)
-        if addr_len:
-            minaddr = addresses[0]
-            maxaddr = addresses[-1]
-
-            if maxaddr > 65535:
-                need_offset_record = True
-            else:
-                need_offset_record = False
-            high_ofs = 0
-
-            cur_addr = minaddr
-            cur_ix = 0
-
-            while cur_addr <= maxaddr:
-                if need_offset_record:
-                    bin = array('B', asbytes('\0'*7))
-                    bin[0] = 2      # reclen
-                    bin[1] = 0      # offset msb
-                    bin[2] = 0      # offset lsb
-                    bin[3] = 4      # rectyp
-                    high_ofs = int(cur_addr>>16)
-                    b = divmod(high_ofs, 256)
-                    bin[4] = b[0]   # msb of high_ofs
-                    bin[5] = b[1]   # lsb of high_ofs
-                    bin[6] = (-sum(bin)) & 0x0FF    # chksum
-                    fwrite(':' +
-                           asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                           eol)
-
-                while True:
-                    # produce one record
+        # Each segment is written a 64K block at a time: the block is
+        # hexlified at once, cut into records, and all its lines are
+        # written with one call.
+        chunks = self._buf.chunks()
+        if chunks:
+            need_offset_record = self._buf.maxaddr() > 65535
+            high_ofs = None
+
+            for seg_start, seg in chunks:
+                cur_addr = seg_start
+                seg_end = seg_start + len(seg)
+                while cur_addr < seg_end:
+                    high_addr = cur_addr >> 16
+                    block_end = min(seg_end, (high_addr+1) << 16)
+                    lines = []
+                    if need_offset_record and high_addr != high_ofs:
+                        if high_addr > 0x0FFFF:
+                            raise OverflowError("address 0x%X is too big for "
+                                                "HEX file" % cur_addr)
+                        high_ofs = high_addr
+                        lines.append(':02000004%04X%02X%s' % (high_ofs,
+                            (-(6 + (high_ofs >> 8) + (high_ofs & 0x0FF))) & 0x0FF,
+                            eol))
+
+                    data = seg[cur_addr-seg_start:block_end-seg_start]
+                    hexdata = asstr(hexlify(data).translate(table))
                     low_addr = cur_addr & 0x0FFFF
-                    # chain_len off by 1
-                    chain_len = min(byte_count-1, 65535-low_addr, maxaddr-cur_addr)
-
-                    # search continuous chain
-                    stop_addr = cur_addr + chain_len
-                    if chain_len:
-                        ix = bisect_right(addresses, stop_addr,
-                                          cur_ix,
-                                          min(cur_ix+chain_len+1, addr_len))
-                        chain_len = ix - cur_ix     # real chain_len
-                        # there could be small holes in the chain
-                        # but we will catch them by try-except later
-                        # so for big continuous files we will work
-                        # at maximum possible speed
-                    else:
-                        chain_len = 1               # real chain_len
-
-                    bin = array('B', asbytes('\0'*(5+chain_len)))
-                    b = divmod(low_addr, 256)
-                    bin[1] = b[0]   # msb of low_addr
-                    bin[2] = b[1]   # lsb of low_addr
-                    bin[3] = 0          # rectype
-                    try:    # if there is small holes we'll catch them
-                        for i in range_g(chain_len):
-                            bin[4+i] = self._buf[cur_addr+i]
-                    except KeyError:
-                        # we catch a hole so we should shrink the chain
-                        chain_len = i
-                        bin = bin[:5+i]
-                    bin[0] = chain_len
-                    bin[4+chain_len] = (-sum(bin)) & 0x0FF    # chksum
-                    fwrite(':' +
-                           asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                           eol)
-
-                    # adjust cur_addr/cur_ix
-                    cur_ix += chain_len
-                    if cur_ix < addr_len:
-                        cur_addr = addresses[cur_ix]
-                    else:
-                        cur_addr = maxaddr + 1
-                        break
-                    high_addr = int(cur_addr>>16)
-                    if high_addr > high_ofs:
-                        break
+                    for i in range_g(0, len(data), byte_count):
+                        chunk = data[i:i+byte_count]
+                        n = len(chunk)
+                        addr = low_addr + i
+                        chksum = (-(n + (addr >> 8) + (addr & 0x0FF) +
+                                    sum(chunk))) & 0x0FF
+                        lines.append(':%02X%04X00%s%02X%s' % (n, addr,
+                            hexdata[2*i:2*(i+n)], chksum, eol))
+                    fwrite(''.join(lines))
+                    cur_addr = block_end
 
         # end-of-file record
         fwrite(":00000001FF"+eol)
@@ -729,21 +826,18 @@ class IntelHex(object):
         from addr through addr+length, a NotEnoughDataError exception will
         be raised. Padding is not used.
         """
-        a = array('B', asbytes('\0'*length))
-        try:
-            for i in range_g(length):
-                a[i] = self._buf[addr+i]
-        except KeyError:
+        if length == 0:
+            return asbytes('')
+        b = self._buf.read(addr, length)
+        if b is None:
             raise NotEnoughDataError(address=addr, length=length)
-        return array_tobytes(a)
+        return b
 
     def puts(self, addr, s):
         """Put string of bytes at given address. Will overwrite any previous
         entries.
         """
-        a = array('B', asbytes(s))
-        for i in range_g(len(a)):
-            self._buf[addr+i] = a[i]
+        self._buf.write(addr, array('B', asbytes(s)))
 
     def getsz(self, addr):
         """Get zero-terminated bytes string from given address. Will raise 
@@ -868,15 +962,33 @@ class IntelHex(object):
                 "'error', 'ignore' or 'replace'")
         # merge data
         this_buf = self._buf
-        other_buf = other._buf
-        for i in other_buf:
-            if i in this_buf:
-                if overlap == 'error':
-                    raise AddressOverlapError(
-                        'Data overlapped at address 0x%X' % i)
-                elif overlap == 'ignore':
+        other_chunks = other._buf.chunks()
+        if overlap == 'error':
+            # check everything first, so nothing is merged on error
+            for start, buf in other_chunks:
+                stop = start + len(buf)
+                for s, e in this_buf.segments():
+                    if s < stop and e > start:
+                        raise AddressOverlapError(
+                            'Data overlapped at address 0x%X' % max(s, start))
+        for start, buf in other_chunks:
+            stop = start + len(buf)
+            if overlap != 'ignore':
+                this_buf.write(start, buf)
+                continue
+            # only the parts of this segment that aren't in this object yet
+            gaps = []
+            a = start
+            for s, e in this_buf.segments():
+                if e <= a or s >= stop:
                     continue
-            this_buf[i] = other_buf[i]
+                if s > a:
+                    gaps.append((a, s))
+                a = e
+            if a < stop:
+                gaps.append((a, stop))
+            for s, e in gaps:
+                this_buf.write(s, buf[s-start:e-start])
         # merge start_addr
         if self.start_addr != other.start_addr:
             if self.start_addr is None:     # set start addr from other
@@ -896,18 +1008,14 @@ class IntelHex(object):
         The second entry of the tuple is always an integer greater than the first entry.
         @param min_gap      the minimum gap size between data in order to separate the segments
         """
-        addresses = self.addresses()
-        if not addresses:
-            return []
-        elif len(addresses) == 1:
-            return([(addresses[0], addresses[0]+1)])
-        adjacent_differences = [(b - a) for (a, b) in zip(addresses[:-1], addresses[1:])]
-        breaks = [i for (i, x) in enumerate(adjacent_differences) if x > min_gap]
-        endings = [addresses[b] for b in breaks]
-        endings.append(addresses[-1])
-        beginnings = [addresses[b+1] for b in breaks]
-        beginnings.insert(0, addresses[0])
-        return [(a, b+1) for (a, b) in zip(beginnings, endings)]
+        result = []
+        for start, stop in self._buf.segments():
+            # join segments if the gap between them is small enough
+            if result and start - result[-1][1] + 1 <= min_gap:
+                result[-1] = (result[-1][0], stop)
+            else:
+                result.append((start, stop))
+        return result
         
     def get_memory_size(self):
         """Returns the approximate memory footprint for data."""
@@ -987,22 +1095,20 @@ class IntelHex16bit(IntelHex):
 
         @return         minimal address used in this object
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
+        if not self._buf:
             return 0
         else:
-            return min(aa)>>1
+            return self._buf.minaddr()>>1
 
     def maxaddr(self):
         '''Get maximal address of HEX content in 16-bit mode.
 
         @return         maximal address used in this object 
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
+        if not self._buf:
             return 0
         else:
-            return max(aa)>>1
+            return self._buf.maxaddr()>>1
 
     def tobinarray(self, start=None, end=None, size=None):
         '''Convert this object to binary form as array (of 2-bytes word data).
@@ -1015,7 +1121,7 @@ class IntelHex16bit(IntelHex):
         '''
         bin = array('H')
 
-        if self._buf == {} and None in (start, end):
+        if not self._buf and None in (start, end):
             return bin
 
         if size is not None and size <= 0:
@@ -1032,6 +1138,362 @@ class IntelHex16bit(IntelHex):
 #/class IntelHex16bit
 
 
+class IntelHexStream(object):
+    """Read-only access to HEX file without loading all data into memory.
+
+    The file is memory-mapped and only an index of where the data
+    records are is built (one pass over the file, checking every record
+    as loadhex does). Data is decoded from the file when it is read, so
+    converting even big files uses little memory, and any address range
+    can be read without decoding the rest of the file.
+
+    The index is kept as runs of data records: records with contiguous
+    addresses, of the same length, that are evenly spaced in the file.
+    For usual HEX files that is one run per 64K block.
+    """
+
+    def __init__(self, source):
+        """Open HEX file and build index of its data.
+
+        @param  source  file name of HEX file or binary file object
+                        (must be a real file, as it is memory-mapped).
+
+        @raise  HexReaderError  if HEX file is not valid. The error is
+                                the same IntelHex would raise for it.
+        """
+        import mmap
+        if getattr(source, "fileno", None) is None:
+            self._fobj = open(source, "rb")
+        else:
+            self._fobj = None
+        fobj = self._fobj or source
+        try:
+            self._data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._data = b''    # empty file can't be mapped
+        self.padding = 0x0FF
+        self.start_addr = None
+        # runs of data records: address, offset in file of data of
+        # first record, data length of records, distance between records
+        # in file, number of records, data length of last record
+        self._addrs = array('L')
+        self._offsets = array('L')
+        self._lengths = array('B')
+        self._strides = array('L')
+        self._counts = array('L')
+        self._last_lengths = array('B')
+        try:
+            self._build_index()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        """Close HEX file. Data can't be read after that."""
+        if not isinstance(self._data, bytes):
+            self._data.close()
+        self._data = b''
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _build_index(self):
+        data = self._data
+        if not len(data):
+            return
+        addrs = self._addrs
+        offsets = self._offsets
+        lengths = self._lengths
+        strides = self._strides
+        counts = self._counts
+        last_lengths = self._last_lengths
+        offset = 0
+        start_addr = None
+        run_next = None     # address that would continue last run
+        line = 0
+        for line_pos, s in self._lines():
+            line += 1
+            s = s.rstrip(b'\r\n')
+            if not s:
+                continue
+            if s[:1] != b':':
+                return self._raise_error(line)
+            try:
+                bin = bytearray(unhexlify(s[1:]))
+            except (TypeError, ValueError):
+                return self._raise_error(line)
+            record_length = len(bin) - 5
+            if record_length < 0 or bin[0] != record_length or sum(bin) & 0x0FF:
+                return self._raise_error(line)
+            record_type = bin[3]
+            if record_type == 0:
+                if record_length == 0:
+                    continue
+                addr = offset + (bin[1]*256 + bin[2])
+                data_pos = line_pos + 9     # after ':', length, address, type
+                if addr == run_next and record_length <= lengths[-1]:
+                    n = counts[-1]
+                    if n == 1:
+                        strides[-1] = data_pos - offsets[-1]
+                    if data_pos == offsets[-1] + n*strides[-1]:
+                        counts[-1] = n + 1
+                        last_lengths[-1] = record_length
+                        if record_length == lengths[-1]:
+                            run_next = addr + record_length
+                        else:
+                            run_next = None     # run can't continue
+                        continue
+                addrs.append(addr)
+                offsets.append(data_pos)
+                lengths.append(record_length)
+                strides.append(0)
+                counts.append(1)
+                last_lengths.append(record_length)
+                run_next = addr + record_length
+                continue
+            run_next = None
+            if record_type == 1 and record_length == 0:
+                break     # EOF record can have any address, as in loadhex
+            if bin[1] or bin[2]:
+                return self._raise_error(line)
+            if record_type == 2 and record_length == 2:
+                offset = (bin[4]*256 + bin[5]) * 16
+            elif record_type == 4 and record_length == 2:
+                offset = (bin[4]*256 + bin[5]) * 65536
+            elif record_type == 3 and record_length == 4 and not start_addr:
+                start_addr = {'CS': bin[4]*256 + bin[5],
+                              'IP': bin[6]*256 + bin[7],
+                             }
+            elif record_type == 5 and record_length == 4 and not start_addr:
+                start_addr = {'EIP': (bin[4]*16777216 +
+                                      bin[5]*65536 +
+                                      bin[6]*256 +
+                                      bin[7]),
+                             }
+            else:
+                return self._raise_error(line)
+        self.start_addr = start_addr
+        # sort runs by address (usually they already are) and check
+        # that they don't overlap
+        n = len(addrs)
+        order = range_l(n)
+        if any(addrs[i] < addrs[i-1] for i in range_g(1, n)):
+            order.sort(key=addrs.__getitem__)
+            for a in (addrs, offsets, lengths, strides, counts, last_lengths):
+                a[:] = array(a.typecode, [a[i] for i in order])
+        prev_end = None
+        for i in range_g(n):
+            if prev_end is not None and addrs[i] < prev_end:
+                return self._raise_error(line)
+            prev_end = self._run_end(i)
+
+    def _lines(self):
+        '''Iterate over (offset in file, line) for lines of file. Lines
+        end with '\n', '\r\n' or just '\r', as IntelHex reads them when
+        opening the file by name (in text mode).'''
+        data = self._data
+        if not re.search(b'\r(?!\n)', data):
+            # no line ends with just '\r': readline is much faster
+            data.seek(0)
+            readline = data.readline
+            pos = 0
+            while True:
+                s = readline()
+                if not s:
+                    return
+                yield pos, s
+                pos += len(s)
+        for m in re.finditer(b'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$', data):
+            yield m.start(), m.group()
+
+    def _raise_error(self, line=0):
+        '''Raise the error IntelHex raises for this file (HEX files with
+        errors are not expected, so it is fine to load it all here).'''
+        text = asstr(self._data[:]).replace('\r\n', '\n').replace('\r', '\n')
+        IntelHex(StringIO(text))
+        raise HexRecordError(line=line)     # in case IntelHex reads it fine
+
+    def _run_end(self, i):
+        '''End address (exclusive) of run of records i.'''
+        return (self._addrs[i] + self._lengths[i]*(self._counts[i]-1) +
+                self._last_lengths[i])
+
+    def _read_run(self, i, first, last):
+        '''Decode data of records first..last-1 of run of records i.'''
+        offset = self._offsets[i]
+        stride = self._strides[i]
+        length = self._lengths[i]*2
+        data = self._data
+        hexdata = [data[offset+k*stride:offset+k*stride+length]
+                   for k in range_g(first, last)]
+        if last == self._counts[i]:
+            hexdata[-1] = hexdata[-1][:self._last_lengths[i]*2]
+        return unhexlify(b''.join(hexdata))
+
+    def chunks(self, start=None, end=None, chunk_size=65536):
+        '''Iterate over data in address order, decoding it from the file
+        as it goes.
+
+        @param  start       start address of data to read (default all).
+        @param  end         end address of data to read (inclusive).
+        @param  chunk_size  maximal number of bytes in one chunk.
+        @return             iterator of (address, memoryview) of chunks
+                            of data. Chunks that follow each other can
+                            be contiguous.
+        '''
+        addrs = self._addrs
+        if start is None:
+            start = 0
+        i = max(bisect_right(addrs, start) - 1, 0)
+        while i < len(addrs) and (end is None or addrs[i] <= end):
+            run_addr = addrs[i]
+            run_end = self._run_end(i)
+            length = self._lengths[i]
+            lo = max(start, run_addr)
+            hi = run_end if end is None else min(run_end, end+1)
+            if lo < hi:
+                step = max(chunk_size // length, 1)
+                first = (lo - run_addr) // length
+                last = (hi - 1 - run_addr) // length + 1
+                for k in range_g(first, last, step):
+                    addr = run_addr + k*length
+                    data = memoryview(self._read_run(i, k, min(k+step, last)))
+                    if addr < lo:
+                        data = data[lo-addr:]
+                        addr = lo
+                    if addr + len(data) > hi:
+                        data = data[:hi-addr]
+                    yield addr, data
+            i += 1
+
+    def segments(self):
+        '''Return list of (start, stop) address ranges with data,
+        like IntelHex.segments().'''
+        result = []
+        for i in range_g(len(self._addrs)):
+            start = self._addrs[i]
+            stop = self._run_end(i)
+            if result and result[-1][1] == start:
+                result[-1] = (result[-1][0], stop)
+            else:
+                result.append((start, stop))
+        return result
+
+    def minaddr(self):
+        '''Get minimal address of HEX content.
+        @return         minimal address or None if no data
+        '''
+        if not self._addrs:
+            return None
+        return self._addrs[0]
+
+    def maxaddr(self):
+        '''Get maximal address of HEX content.
+        @return         maximal address or None if no data
+        '''
+        if not self._addrs:
+            return None
+        return self._run_end(len(self._addrs)-1) - 1
+
+    def __len__(self):
+        return sum(self._run_end(i) - self._addrs[i]
+                   for i in range_g(len(self._addrs)))
+
+    def _get_start_end(self, start, end, size):
+        '''Start and end address for binary output, as in IntelHex.'''
+        if size is not None:
+            if size <= 0:
+                raise ValueError("tobinarray: wrong value for size")
+            if None not in (start, end):
+                raise ValueError("tobinarray: you can't use start,end and size"
+                                 " arguments in the same time")
+            if (start, end) == (None, None):
+                start = self.minaddr()
+            if start is not None:
+                end = start + size - 1
+            else:
+                start = end - size + 1
+                if start < 0:
+                    raise ValueError("tobinarray: invalid size (%d) "
+                                     "for given end address (%d)" % (size,end))
+        else:
+            if start is None:
+                start = self.minaddr()
+            if end is None:
+                end = self.maxaddr()
+            if start > end:
+                start, end = end, start
+        return start, end
+
+    def _iter_bin(self, start, end, size):
+        '''Iterate over blocks of binary data (with padding) from start
+        to end, as IntelHex.tobinstr() would return it.'''
+        if not self._addrs and None in (start, end):
+            return
+        start, end = self._get_start_end(start, end, size)
+        pad_block = bytes(bytearray([self.padding]) * 65536)
+        addr = start
+        for chunk_addr, data in self.chunks(start, end):
+            while addr < chunk_addr:
+                n = min(chunk_addr - addr, len(pad_block))
+                yield pad_block[:n]
+                addr += n
+            yield data
+            addr += len(data)
+        while addr <= end:
+            n = min(end + 1 - addr, len(pad_block))
+            yield pad_block[:n]
+            addr += n
+
+    def tobinstr(self, start=None, end=None, size=None):
+        '''Read address range as binary string, with empty addresses
+        filled with self.padding.
+        @param  start   start address of output bytes.
+        @param  end     end address of output bytes (inclusive).
+        @param  size    size of the block, used with start or end parameter.
+        @return         bytes string of binary data.
+        '''
+        return b''.join(self._iter_bin(start, end, size))
+
+    def tobinfile(self, fobj, start=None, end=None, size=None):
+        '''Convert to binary and write to file, a block at a time.
+
+        @param  fobj    file name or file object for writing output bytes.
+        @param  start   start address of output bytes.
+        @param  end     end address of output bytes (inclusive).
+        @param  size    size of the block, used with start or end parameter.
+        '''
+        if getattr(fobj, "write", None) is None:
+            fobj = open(fobj, "wb")
+            close_fd = True
+        else:
+            close_fd = False
+        try:
+            for data in self._iter_bin(start, end, size):
+                fobj.write(data)
+        finally:
+            if close_fd:
+                fobj.close()
+
+    def crc32(self, start=None, end=None, size=None):
+        '''CRC32 (as binascii.crc32) of binary data of address range,
+        with empty addresses filled with self.padding.
+        @return         unsigned 32-bit CRC.
+        '''
+        crc = 0
+        for data in self._iter_bin(start, end, size):
+            crc = crc32(data, crc)
+        return crc & 0x0FFFFFFFF
+
+#/class IntelHexStream
+
+
 def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
     """Hex-to-Bin convertor engine.
     @return     0   if all OK
@@ -1044,7 +1506,14 @@ def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
     @param  pad     padding byte (optional)
     """
     try:
-        h = IntelHex(fin)
+        if isinstance(fin, StrType):
+            # read from file as it is written, not all loaded at once
+            try:
+                h = IntelHexStream(fin)
+            except HexReaderError:
+                h = IntelHex(fin)   # report error just as loadhex does
+        else:
+            h = IntelHex(fin)
     except HexReaderError:
         e = sys.exc_info()[1]     # current exception
         txt = "ERROR: bad HEX file: %s" % str(e)
@@ -1073,6 +1542,9 @@ def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
         txt = "ERROR: Could not write to file: %s: %s" % (fout, str(e))
         print(txt)
         return 1
+    finally:
+        if isinstance(h, IntelHexStream):
+            h.close()
 
     return 0
 #/def hex2bin
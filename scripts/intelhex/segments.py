@@ -0,0 +1,280 @@
+# Copyright (c) 2005-2018, Alexander Belchenko
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms,
+# with or without modification, are permitted provided
+# that the following conditions are met:
+#
+# * Redistributions of source code must retain
+#   the above copyright notice, this list of conditions
+#   and the following disclaimer.
+# * Redistributions in binary form must reproduce
+#   the above copyright notice, this list of conditions
+#   and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the author nor the names
+#   of its contributors may be used to endorse
+#   or promote products derived from this software
+#   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING,
+# BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+# OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Storage of IntelHex data as sorted segments of contiguous bytes.'''
+
+__docformat__ = "javadoc"
+
+from bisect import bisect_left, bisect_right
+import sys
+
+
+class SegmentBuffer(object):
+    """Data of IntelHex object: mapping of address to byte value.
+
+    Data is kept as a sorted list of contiguous segments, each one
+    a bytearray, instead of a dict with an entry for every byte.
+    Segments never overlap or touch - writes that join two segments
+    merge them into one.
+
+    It can be used as the {addr: byte} dict that IntelHex used before
+    (get, keys, items, update, copy, len, in, del, comparison with dict),
+    and also has methods working with whole segments.
+    """
+
+    def __init__(self, source=None):
+        ''' Constructor.
+        @param  source  dict {addr: byte} or other SegmentBuffer to copy.
+        '''
+        self._starts = []   # start address of every segment, ascending
+        self._bufs = []     # bytearray with data of every segment
+        if source is not None:
+            self.update(source)
+
+    def get(self, addr, default=None):
+        '''Get byte at address, or default if there is no data there.'''
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0:
+            buf = self._bufs[i]
+            offset = addr - self._starts[i]
+            if offset < len(buf):
+                return buf[offset]
+        return default
+
+    def __getitem__(self, addr):
+        x = self.get(addr)
+        if x is None:
+            raise KeyError(addr)
+        return x
+
+    def __contains__(self, addr):
+        return self.get(addr) is not None
+
+    def __setitem__(self, addr, byte):
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0:
+            buf = self._bufs[i]
+            offset = addr - self._starts[i]
+            if offset < len(buf):
+                buf[offset] = byte
+                return
+        self.write(addr, (byte,))
+
+    def write(self, addr, data):
+        '''Write sequence of bytes starting at address, overwriting
+        any existing data there.
+
+        @param  addr    address of first byte.
+        @param  data    bytes, bytearray, array('B') or list of ints.
+        '''
+        if not len(data):
+            return
+        starts = self._starts
+        bufs = self._bufs
+        i = bisect_right(starts, addr) - 1
+        if i >= 0 and starts[i] + len(bufs[i]) >= addr:
+            # overlaps or continues segment i
+            buf = bufs[i]
+            offset = addr - starts[i]
+            buf[offset:offset+len(data)] = data
+        else:
+            i += 1
+            buf = bytearray(data)
+            starts.insert(i, addr)
+            bufs.insert(i, buf)
+        # absorb following segments reached by the new data
+        end = starts[i] + len(buf)
+        j = i + 1
+        while j < len(starts) and starts[j] <= end:
+            skip = end - starts[j]
+            if skip < len(bufs[j]):
+                buf += bufs[j][skip:]
+                end = starts[i] + len(buf)
+            j += 1
+        del starts[i+1:j]
+        del bufs[i+1:j]
+
+    def read(self, addr, length):
+        '''Read bytes from one segment.
+
+        @return bytes, or None if there is not data for all addresses
+                from addr to addr+length-1.
+        '''
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0:
+            buf = self._bufs[i]
+            offset = addr - self._starts[i]
+            if offset + length <= len(buf):
+                return bytes(buf[offset:offset+length])
+        return None
+
+    def overlaps(self, start, stop):
+        '''Return True if there is data at any address from start to stop-1.'''
+        i = bisect_right(self._starts, stop-1) - 1
+        return i >= 0 and self._starts[i] + len(self._bufs[i]) > start
+
+    def __delitem__(self, addr):
+        if self.get(addr) is None:
+            raise KeyError(addr)
+        self.delete(addr, addr+1)
+
+    def delete(self, start, stop):
+        '''Delete all data from address start to stop-1.'''
+        starts = self._starts
+        bufs = self._bufs
+        i = bisect_right(starts, start) - 1
+        if i < 0 or starts[i] + len(bufs[i]) <= start:
+            i += 1
+        new_starts = []
+        new_bufs = []
+        j = i
+        while j < len(starts) and starts[j] < stop:
+            s = starts[j]
+            buf = bufs[j]
+            if s < start:
+                new_starts.append(s)
+                new_bufs.append(buf[:start-s])
+            if s + len(buf) > stop:
+                new_starts.append(stop)
+                new_bufs.append(buf[stop-s:])
+            j += 1
+        starts[i:j] = new_starts
+        bufs[i:j] = new_bufs
+
+    def segments(self):
+        '''Return list of (start, stop) address ranges of the segments.'''
+        return [(s, s+len(b)) for s, b in zip(self._starts, self._bufs)]
+
+    def chunks(self, start=None, stop=None):
+        '''Return list of (start, bytearray) for all the segments, or only
+        the ones with data from address start to stop-1 (they are not cut
+        to that range). The bytearrays are the ones used for storage, so
+        should not be changed.
+        '''
+        if start is None and stop is None:
+            return list(zip(self._starts, self._bufs))
+        i = 0
+        if start is not None:
+            i = bisect_right(self._starts, start) - 1
+            if i < 0 or self._starts[i] + len(self._bufs[i]) <= start:
+                i += 1
+        j = len(self._starts)
+        if stop is not None:
+            j = bisect_left(self._starts, stop)
+        return list(zip(self._starts[i:j], self._bufs[i:j]))
+
+    def minaddr(self):
+        '''Return lowest address with data, or None if empty.'''
+        if not self._starts:
+            return None
+        return self._starts[0]
+
+    def maxaddr(self):
+        '''Return highest address with data, or None if empty.'''
+        if not self._starts:
+            return None
+        return self._starts[-1] + len(self._bufs[-1]) - 1
+
+    def __len__(self):
+        return sum(map(len, self._bufs))
+
+    def __bool__(self):
+        return bool(self._starts)
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        for s, b in zip(self._starts, self._bufs):
+            for addr in range(s, s+len(b)):
+                yield addr
+
+    def keys(self):
+        '''Return list of all addresses with data, sorted.'''
+        return list(self)
+
+    def items(self):
+        '''Iterate over (address, byte) pairs, sorted by address.'''
+        for s, b in zip(self._starts, self._bufs):
+            for i, x in enumerate(b):
+                yield s+i, x
+
+    def values(self):
+        for b in self._bufs:
+            for x in b:
+                yield x
+
+    def update(self, other):
+        '''Write all data from dict {addr: byte} or other SegmentBuffer.'''
+        if isinstance(other, SegmentBuffer):
+            for s, b in zip(other._starts, other._bufs):
+                self.write(s, b)
+            return
+        addresses = sorted(other)
+        n = len(addresses)
+        i = 0
+        while i < n:
+            j = i + 1
+            while j < n and addresses[j] == addresses[j-1] + 1:
+                j += 1
+            self.write(addresses[i], [other[a] for a in addresses[i:j]])
+            i = j
+
+    def copy(self):
+        sb = SegmentBuffer()
+        sb._starts = list(self._starts)
+        sb._bufs = [bytearray(b) for b in self._bufs]
+        return sb
+
+    def __eq__(self, other):
+        if isinstance(other, SegmentBuffer):
+            return self._starts == other._starts and self._bufs == other._bufs
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        if r is NotImplemented:
+            return r
+        return not r
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'SegmentBuffer(%s)' % ', '.join('0x%X:%d bytes' % (s, len(b))
+            for s, b in zip(self._starts, self._bufs))
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) +
+                sys.getsizeof(self._starts) + sys.getsizeof(self._bufs) +
+                sum(map(sys.getsizeof, self._starts)) +
+                sum(map(sys.getsizeof, self._bufs)))
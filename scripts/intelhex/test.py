@@ -45,6 +45,7 @@ import intelhex
 from intelhex import (
     IntelHex,
     IntelHexError,
+    IntelHexStream,
     HexReaderError,
     AddressOverlapError,
     HexRecordError,
@@ -64,6 +65,7 @@ from intelhex import (
     Record,
     )
 from intelhex import compat
+from intelhex.segments import SegmentBuffer
 from intelhex.compat import (
     BytesIO,
     StringIO,
@@ -1793,6 +1795,275 @@ class TestWriteHexFileByteCount(unittest.TestCase):
         self.assertEqual(ih.tobinstr(), ih2.tobinstr(),
                          "Written hex file does not equal with original")
 
+
+class TestLoadHexRuns(TestIntelHexBase):
+    """loadhex joins records that follow each other into runs"""
+
+    def test_records_out_of_order(self):
+        hexstr = '\n'.join([Record.data(0x10, [4, 5]),
+                            Record.data(0x12, [6]),
+                            Record.data(0x00, [1, 2, 3]),
+                            Record.extended_linear_address(1),
+                            Record.data(0x00, [7]),
+                            Record.eof(),
+                            'not read after EOF'])
+        ih = IntelHex(StringIO(hexstr))
+        self.assertEqual({0:1, 1:2, 2:3, 0x10:4, 0x11:5, 0x12:6, 0x10000:7},
+                         ih.todict())
+        self.assertEqual([(0, 3), (0x10, 0x13), (0x10000, 0x10001)],
+                         ih.segments())
+
+    def test_overlap_between_runs(self):
+        hexstr = '\n'.join([Record.data(0x10, [1, 2, 3, 4]),
+                            Record.data(0x00, [1]),
+                            Record.data(0x0E, [5, 6, 7]),
+                            Record.eof()])
+        ih = IntelHex()
+        self.assertRaisesMsg(AddressOverlapError,
+            'Hex file has data overlap at address 0x10 on line 3',
+            ih.loadhex, StringIO(hexstr))
+        # data before the overlap was loaded, as when reading record by record
+        self.assertEqual({0:1, 0xE:5, 0xF:6, 0x10:1, 0x11:2, 0x12:3, 0x13:4},
+                         ih.todict())
+
+    def test_overlap_with_existing_data(self):
+        ih = IntelHex({0x11: 0})
+        self.assertRaisesMsg(AddressOverlapError,
+            'Hex file has data overlap at address 0x11 on line 1',
+            ih.loadhex, StringIO(Record.data(0x10, [1, 2])))
+
+
+class TestIntelHexStream(TestIntelHexBase):
+    """IntelHexStream reads data from the file as it is needed"""
+
+    def setUp(self):
+        handle, self.fname = tempfile.mkstemp('.hex')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.fname)
+
+    def write(self, hexstr):
+        f = open(self.fname, 'w')
+        try:
+            f.write(hexstr)
+        finally:
+            f.close()
+
+    def open_stream(self, hexstr):
+        self.write(hexstr)
+        st = IntelHexStream(self.fname)
+        self.addCleanup(st.close)
+        return st
+
+    def test_same_as_intelhex(self):
+        st = self.open_stream(hex8)
+        ih = IntelHex(StringIO(hex8))
+        self.assertEqual(ih.segments(), st.segments())
+        self.assertEqual((ih.minaddr(), ih.maxaddr(), len(ih)),
+                         (st.minaddr(), st.maxaddr(), len(st)))
+        self.assertEqual(array_tobytes(bin8), st.tobinstr())
+        self.assertEqual(ih.tobinstr(start=0x10, end=0x1000),
+                         st.tobinstr(start=0x10, end=0x1000))
+        self.assertEqual(ih.tobinstr(end=0x200, size=0x100),
+                         st.tobinstr(end=0x200, size=0x100))
+        st.close()
+        # records of 16 bytes one after another are indexed as one run
+        st = self.open_stream(hex_simple)
+        self.assertEqual(1, len(st._addrs))
+        self.assertEqual(IntelHex(StringIO(hex_simple)).tobinstr(),
+                         st.tobinstr())
+
+    def test_chunks(self):
+        st = self.open_stream('\n'.join([Record.data(0x10, [4, 5]),
+                                         Record.data(0x12, [6]),
+                                         Record.data(0x00, [1, 2, 3]),
+                                         Record.extended_linear_address(1),
+                                         Record.data(0x00, [7]),
+                                         Record.eof()]))
+        chunks = [(addr, data.tobytes()) for addr, data in st.chunks()]
+        self.assertEqual([(0, b'\x01\x02\x03'), (0x10, b'\x04\x05\x06'),
+                          (0x10000, b'\x07')], chunks)
+        chunks = [(addr, data.tobytes()) for addr, data in
+                  st.chunks(start=0x11, end=0xFFFF, chunk_size=1)]
+        self.assertEqual([(0x11, b'\x05'), (0x12, b'\x06')], chunks)
+        self.assertEqual([(0, 3), (0x10, 0x13), (0x10000, 0x10001)],
+                         st.segments())
+
+    def test_padding_and_crc32(self):
+        st = self.open_stream('\n'.join([Record.data(0x0, [1]),
+                                         Record.data(0x3, [2]),
+                                         Record.eof()]))
+        self.assertEqual(b'\x01\xFF\xFF\x02', st.tobinstr())
+        st.padding = 0
+        self.assertEqual(b'\x00\x01\x00\x00\x02\x00',
+                         st.tobinstr(start=-1, end=4))
+        bio = BytesIO()
+        st.tobinfile(bio, size=8)
+        self.assertEqual(b'\x01\x00\x00\x02\x00\x00\x00\x00', bio.getvalue())
+        import binascii
+        self.assertEqual(binascii.crc32(bio.getvalue()) & 0xFFFFFFFF,
+                         st.crc32(size=8))
+
+    def test_empty_file(self):
+        st = self.open_stream('')
+        self.assertEqual((None, None, 0), (st.minaddr(), st.maxaddr(), len(st)))
+        self.assertEqual(b'', st.tobinstr())
+        self.assertEqual([], list(st.chunks()))
+
+    def test_start_addr(self):
+        st = self.open_stream('\n'.join([Record.start_linear_address(0x1234),
+                                         Record.data(0, [1]),
+                                         Record.eof()]))
+        self.assertEqual({'EIP': 0x1234}, st.start_addr)
+
+    def test_errors(self):
+        self.write(':0100000000FF\n' + Record.data(0, [1]) + '\n')
+        self.assertRaisesMsg(AddressOverlapError,
+            'Hex file has data overlap at address 0x0 on line 2',
+            IntelHexStream, self.fname)
+        self.write(':0100000000FE\n')
+        self.assertRaisesMsg(RecordChecksumError,
+            'Record at line 1 has invalid checksum',
+            IntelHexStream, self.fname)
+        # EOF record can have any address, other records can't
+        self.write(':0400000001020304F2\n:00010001FE\n')
+        with IntelHexStream(self.fname) as h:
+            self.assertEqual(b'\x01\x02\x03\x04', h.tobinstr())
+        self.assertEqual(0, hex2bin(self.fname, BytesIO()))
+        self.write(':0400000001020304F2\n:02000104000FEA\n')
+        self.assertRaisesMsg(ExtendedLinearAddressRecordError,
+            'Invalid Extended Linear Address Record at line 2',
+            IntelHexStream, self.fname)
+
+    def test_line_endings(self):
+        # IntelHex reads files opened by name in text mode, so lines can
+        # end with just '\r'
+        for eol in ('\r\n', '\r', '\r\r\n'):
+            st = self.open_stream(hex8.replace('\n', eol))
+            self.assertEqual(array_tobytes(bin8), st.tobinstr())
+            self.assertEqual(0, hex2bin(self.fname, BytesIO()))
+        self.write(':0100000000FF\r' + Record.data(0, [1]) + '\r')
+        self.assertRaisesMsg(AddressOverlapError,
+            'Hex file has data overlap at address 0x0 on line 2',
+            IntelHexStream, self.fname)
+
+    def test_hex2bin_filename(self):
+        self.write(hex8)
+        fout = BytesIO()
+        self.assertEqual(0, hex2bin(self.fname, fout, start=0x10, size=0x40))
+        self.assertEqual(array_tobytes(bin8[0x10:0x50]), fout.getvalue())
+
+
+class TestSegmentBuffer(unittest.TestCase):
+
+    def test_write_coalesce(self):
+        sb = SegmentBuffer()
+        sb.write(10, [1, 2])
+        sb.write(20, [5])
+        self.assertEqual([(10, 12), (20, 21)], sb.segments())
+        sb.write(12, [3])               # continues first segment
+        sb[9] = 0                       # just before first segment
+        self.assertEqual([(9, 13), (20, 21)], sb.segments())
+        sb.write(13, array.array('B', [4]*7))     # fills the gap
+        self.assertEqual([(9, 21)], sb.segments())
+        self.assertEqual(asbytes('\x00\x01\x02\x03' + '\x04'*7 + '\x05'),
+                         sb.read(9, 12))
+        sb.write(0, asbytes('\xFF'*30))   # covers everything
+        self.assertEqual([(0, 30)], sb.segments())
+        self.assertEqual(30, len(sb))
+
+    def test_overwrite(self):
+        sb = SegmentBuffer({0:1, 1:2, 2:3, 3:4})
+        sb.write(1, [9, 9])
+        sb[3] = 8
+        self.assertEqual({0:1, 1:9, 2:9, 3:8}, sb)
+        self.assertEqual([(0, 4)], sb.segments())
+
+    def test_get(self):
+        sb = SegmentBuffer({5:1, 6:2, 10:3})
+        self.assertEqual(1, sb[5])
+        self.assertEqual(3, sb.get(10))
+        self.assertEqual(None, sb.get(7))
+        self.assertEqual(0xFF, sb.get(4, 0xFF))
+        self.assertRaises(KeyError, lambda: sb[11])
+        self.assertTrue(6 in sb)
+        self.assertFalse(7 in sb)
+        self.assertEqual(None, sb.read(5, 3))
+        self.assertEqual([5, 6, 10], sb.keys())
+        self.assertEqual([(5, 1), (6, 2), (10, 3)], list(sb.items()))
+        self.assertEqual(5, sb.minaddr())
+        self.assertEqual(10, sb.maxaddr())
+        self.assertEqual(None, SegmentBuffer().minaddr())
+
+    def test_delete(self):
+        sb = SegmentBuffer()
+        sb.write(0, range_l(10))
+        del sb[0]
+        del sb[5]
+        del sb[9]
+        self.assertEqual([(1, 5), (6, 9)], sb.segments())
+        self.assertRaises(KeyError, sb.__delitem__, 5)
+        sb.delete(3, 8)
+        self.assertEqual({1:1, 2:2, 8:8}, sb)
+        sb.delete(0, 100)
+        self.assertEqual({}, sb)
+        self.assertFalse(sb)
+
+    def test_copy_and_compare(self):
+        sb = SegmentBuffer({0:1, 2:3})
+        sb2 = sb.copy()
+        sb2[0] = 5
+        self.assertEqual({0:1, 2:3}, sb)
+        self.assertNotEqual(sb, sb2)
+        self.assertEqual(SegmentBuffer({0:5, 2:3}), sb2)
+
+    def test_intelhex_buf(self):
+        ih = IntelHex()
+        ih._buf = {0:1, 1:2, 5:3}  # dicts are converted
+        self.assertTrue(isinstance(ih._buf, SegmentBuffer))
+        self.assertEqual([(0, 2), (5, 6)], ih.segments())
+        self.assertEqual([(0, 6)], ih.segments(min_gap=4))
+        del ih[1:]
+        self.assertEqual({0:1}, ih.todict())
+
+    def test_chunks_range(self):
+        sb = SegmentBuffer({0:1, 1:2, 5:3, 9:4})
+        self.assertEqual([0, 5, 9], [s for s, b in sb.chunks()])
+        self.assertEqual([0, 5], [s for s, b in sb.chunks(1, 6)])
+        self.assertEqual([5], [s for s, b in sb.chunks(2, 9)])
+        self.assertEqual([], [s for s, b in sb.chunks(6, 9)])
+        self.assertEqual([9], [s for s, b in sb.chunks(start=6)])
+
+    def test_binary_padding(self):
+        ih = IntelHex({1:1, 2:2, 0x10005:5})
+        ih.padding = 0
+        self.assertEqual(asbytes('\x00\x01\x02\x00'), ih.tobinstr(0, 3))
+        self.assertEqual(asbytes('\x01\x02'), ih.tobinstr(1, 2))
+        self.assertEqual(array.array('B', [2, 0, 0]), ih.tobinarray(2, 4))
+        bio = BytesIO()
+        ih.tobinfile(bio)
+        self.assertEqual(ih.tobinstr(), bio.getvalue())
+        self.assertEqual(0x10005, len(bio.getvalue()))     # from address 1
+        ih.padding = 0x100     # not a byte, but only needed for gaps
+        self.assertEqual(asbytes('\x01\x02'), ih.tobinstr(1, 2))
+        self.assertRaises(OverflowError, ih.tobinstr, 0, 2)
+        self.assertRaises(OverflowError, ih.tobinfile, BytesIO())
+
+    def test_merge_ignore_partial(self):
+        ih1 = IntelHex({2:1, 3:1, 6:1})
+        ih2 = IntelHex()
+        ih2.puts(0, asbytes('\x02'*8))
+        ih1.merge(ih2, overlap='ignore')
+        self.assertEqual(asbytes('\x02\x02\x01\x01\x02\x02\x01\x02'), ih1.tobinstr())
+
+    def test_memory_size(self):
+        ih = IntelHex()
+        ih.frombytes(asbytes('\x55'*65536), offset=0x08000000)
+        # bytearray storage - not tens of bytes per dict entry
+        self.assertTrue(ih.get_memory_size() < 2*65536)
+
+
 ##
 # MAIN
 if __name__ == '__main__':
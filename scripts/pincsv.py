@@ -0,0 +1,91 @@
+#!/bin/false
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Reads the csv files in boards/pins for pinutils.scan_pin_file/scan_pin_af_file.
+#
+# Many boards share the same chip's csv file, so each file is parsed (split into
+# fields, and each field stripped) just once and the result is cached in
+# gen/pin_cache/FILENAME.marshal (marshal is faster to load than pickle). The cache is
+# used if the csv file's modification time and size are the same, or if its SHA1 is.
+# PIN_CACHE=path moves the cache, PIN_CACHE=0 disables it
+# ----------------------------------------------------------------------------------------
+
+import sys;
+import os;
+import hashlib;
+import marshal;
+
+PIN_CACHE_VERSION = 1
+
+def get_pin_cache_dir():
+  cachedir = os.getenv("PIN_CACHE")
+  if cachedir=="0": return False
+  if not cachedir: cachedir = os.path.dirname(os.path.realpath(__file__))+"/../gen/pin_cache"
+  return cachedir
+
+# A parsed csv file. headings is the first line split on ',' exactly as it is in the
+# file (as it's used for the keys of pin["csv"]), and rows has every line (including the
+# first) as a list of stripped fields
+class PinCSV:
+  def __init__(self, path, headings, rows):
+    self.path = path
+    self.headings = headings
+    self.rows = rows
+
+def parse(path):
+  f = open(path)
+  lines = f.readlines()
+  f.close()
+  headings = lines[0].split(",") if lines else []
+  rows = [[field.strip() for field in line.split(",")] for line in lines]
+  return PinCSV(path, headings, rows)
+
+loadedFiles = {} # { path : PinCSV }, so a file is only read once per script
+def read(path):
+  path = os.path.realpath(path)
+  if path in loadedFiles: return loadedFiles[path]
+  stat = os.stat(path)
+  cachedir = get_pin_cache_dir()
+  cachefile = cachedir and cachedir+"/"+os.path.basename(path)+".marshal"
+  cached = False
+  if cachefile:
+    try:
+      cached = marshal.loads(open(cachefile, "rb").read())
+      # marshal's format can change between Python versions
+      if cached["version"]!=[PIN_CACHE_VERSION, sys.version] or cached["path"]!=path: cached = False
+    except (IOError, OSError, EOFError, KeyError, ValueError, TypeError):
+      cached = False # not cached, or cache file was corrupt
+  parsed = False
+  changed = True
+  if cached and cached["mtime"]==stat.st_mtime_ns and cached["size"]==stat.st_size:
+    parsed = PinCSV(path, cached["headings"], cached["rows"])
+    changed = False
+  else:
+    sha1 = hashlib.sha1(open(path, "rb").read()).hexdigest()
+    if cached and cached["sha1"]==sha1: # file was just touched - cache it with the new time
+      parsed = PinCSV(path, cached["headings"], cached["rows"])
+    else:
+      parsed = parse(path)
+  if cachefile and changed:
+    try:
+      if not os.path.isdir(cachedir): os.makedirs(cachedir, exist_ok=True)
+      # write then rename, so parallel builds never see a half-written file
+      tmpfile = cachefile+"."+str(os.getpid())
+      with open(tmpfile, "wb") as f:
+        f.write(marshal.dumps({ "version" : [PIN_CACHE_VERSION, sys.version], "path" : path,
+                                "mtime" : stat.st_mtime_ns, "size" : stat.st_size, "sha1" : sha1,
+                                "headings" : parsed.headings, "rows" : parsed.rows }))
+      os.replace(tmpfile, cachefile)
+    except (IOError, OSError, ValueError) as e:
+      # not print, as the output of some scripts is used directly
+      sys.stderr.write("WARNING: Unable to write pin cache "+cachefile+" - "+str(e)+"\n")
+  loadedFiles[path] = parsed
+  return parsed
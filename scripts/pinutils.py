@@ -18,6 +18,7 @@ import re;
 import json;
 import sys;
 import os;
+import pincsv;
 
 ALLOWED_PORTS = "ABCDEFGHIV";
 ALLOWED_FUNCTIONS = {}
@@ -137,8 +138,163 @@ def isvalidpin(pinname):
   return False
 
 
+# A list of pins that can also look pins up by name or by port and number, without
+# searching the list. It's a normal list, so board files can use it as they always have.
+# Every list method that changes the list counts the change, and the lookups are rebuilt
+# when next used if the list has changed (apart from append, which just adds to them).
+# As with searching the list, if more than one pin has the same name the first one is found.
+# It also keeps a list of the pins' functions by class (ADC, PWM, SPI, etc) - if a pin's
+# functions are changed, call functions_changed() so that's worked out again
+class PinSet(list):
+  def __add__(self, other):
+    return PinSet(list.__add__(self, other))
+
+  def __setitem__(self, idx, value):
+    self.changed()
+    list.__setitem__(self, idx, value)
+
+  def __delitem__(self, idx):
+    self.changed()
+    list.__delitem__(self, idx)
+
+  def __iadd__(self, pins):
+    self.changed()
+    return list.__iadd__(self, pins)
+
+  def __imul__(self, n):
+    self.changed()
+    return list.__imul__(self, n)
+
+  def insert(self, idx, pin):
+    self.changed()
+    list.insert(self, idx, pin)
+
+  def extend(self, pins):
+    self.changed()
+    list.extend(self, pins)
+
+  def pop(self, *args):
+    self.changed()
+    return list.pop(self, *args)
+
+  def remove(self, pin):
+    self.changed()
+    list.remove(self, pin)
+
+  def clear(self):
+    self.changed()
+    list.clear(self)
+
+  def sort(self, *args, **kwargs):
+    self.changed()
+    list.sort(self, *args, **kwargs)
+
+  def reverse(self):
+    self.changed()
+    list.reverse(self)
+
+  # Number of changes made to the list - the lookups are up to date if they were made
+  # after the same number of changes
+  def changes(self):
+    return self.__dict__.get("changeCount", 0)
+
+  def changed(self):
+    self.__dict__["changeCount"] = self.changes()+1
+
+  def functions_changed(self):
+    self.__dict__["classIndexedChanges"] = None
+
+  def append(self, pin):
+    indexed = self.__dict__.get("indexedChanges")==self.changes()
+    list.append(self, pin)
+    self.changed()
+    if indexed:
+      self.add_to_index(pin, len(self)-1)
+      self.indexedChanges = self.changes()
+
+  # Lookups aren't pickled/copied - they're rebuilt when next used
+  def __getstate__(self):
+    return None
+
+  def add_to_index(self, pin, position):
+    if not pin["name"] in self.byName: self.byName[pin["name"]] = pin
+    portNum = (pin.get("port"), pin.get("num"))
+    if not portNum in self.byPortNum: self.byPortNum[portNum] = pin
+    if not pin.get("port") in self.byPort: self.byPort[pin.get("port")] = []
+    self.byPort[pin.get("port")].append(pin)
+    if not id(pin) in self.positions: self.positions[id(pin)] = position
+
+  def update_index(self):
+    if self.__dict__.get("indexedChanges")==self.changes(): return
+    self.byName = {}
+    self.byPortNum = {}
+    self.byPort = {}
+    self.positions = {}
+    for position, pin in enumerate(self):
+      self.add_to_index(pin, position)
+    self.indexedChanges = self.changes()
+
+  # Return the pin with the given name (eg. "PA0"), or None
+  def find(self, pinname):
+    self.update_index()
+    return self.byName.get(pinname)
+
+  # Return the pin with the given port and number (eg. "A", "0"), or None
+  def find_port_num(self, port, num):
+    self.update_index()
+    return self.byPortNum.get((port, str(num)))
+
+  # Return a list of the pins on the given port, in the order they're in the list
+  def port_pins(self, port):
+    self.update_index()
+    return self.byPort.get(port, [])
+
+  # Like index(pin), but without searching
+  def position(self, pin):
+    self.update_index()
+    if id(pin) in self.positions: return self.positions[id(pin)]
+    return self.index(pin) # not one of our pins, but might be equal to one
+
+  def update_class_index(self):
+    if self.__dict__.get("classIndexedChanges")==self.changes(): return
+    self.functionClasses = []
+    self.byClass = {}
+    for pin in self:
+      for func in sorted(pin["functions"]):
+        if not func in CLASSES: continue
+        cls = CLASSES[func]
+        peripheral = cls
+        peripheralPin = ""
+        if cls=="SPI" or cls=="I2C" or cls=="USART":
+          fs = ALLOWED_FUNCTIONS[func].split("|")
+          peripheral = fs[0][4:]
+          peripheralPin = fs[1][fs[1].rfind("_")+1:]
+        info = { "pin" : pin, "function" : func, "class" : cls, "peripheral" : peripheral, "peripheralPin" : peripheralPin }
+        self.functionClasses.append(info)
+        if not cls in self.byClass: self.byClass[cls] = []
+        self.byClass[cls].append(info)
+    self.classIndexedChanges = self.changes()
+
+  # Return every pin function that has a class (see CLASSES), in pin order then sorted by
+  # function name, as { pin, function, class, peripheral, peripheralPin }. For SPI/I2C/USART
+  # peripheral/peripheralPin are eg. "SPI1"/"SCK", otherwise they're the class and ""
+  def function_classes(self):
+    self.update_class_index()
+    return self.functionClasses
+
+  # Return the pin functions (as for function_classes) with the given class, eg "ADC"
+  def functions_of_class(self, cls):
+    self.update_class_index()
+    return self.byClass.get(cls, [])
+
+  # Return a list of the classes of function that the pins have
+  def classes(self):
+    self.update_class_index()
+    return list(self.byClass)
+
 # Find/populate a pin
 def haspin(pins, pinname):
+  if isinstance(pins, PinSet): return pins.find(pinname)!=None
   for pin in pins:
     if pin["name"]==pinname:
       return True
@@ -147,9 +303,13 @@ def haspin(pins, pinname):
 # Find/populate a pin
 def findpin(pins, pinname, force):
   if pinname.find('-')!=-1: pinname = pinname[:pinname.find('-')]
-  for pin in pins:
-    if pin["name"]==pinname:
-      return pin
+  if isinstance(pins, PinSet):
+    pin = pins.find(pinname)
+    if pin: return pin
+  else:
+    for pin in pins:
+      if pin["name"]==pinname:
+        return pin
   if force:
     print("ERROR: pin "+pinname+" not found")
     exit(1);
@@ -163,14 +323,17 @@ def findpin(pins, pinname, force):
   pins.append(pin)
   return pin
 
+# Paths of the files read by scan_pin_af_file/scan_pin_file, so common.get_board knows
+# what the pins depend on
+pin_files_read = []
+
 # Code for scanning AF file
 def scan_pin_af_file(pins, filename, nameoffset, afoffset):
-  f = open(os.path.dirname(os.path.realpath(__file__))+'/../boards/pins/'+filename)
-  lines = f.readlines()
-  f.close()
-  for line in lines:
-    pindata = line.split(",")
-    pinname = pindata[nameoffset].strip()
+  pins = PinSet(pins)
+  path = os.path.realpath(os.path.dirname(os.path.realpath(__file__))+'/../boards/pins/'+filename)
+  pin_files_read.append(path)
+  for pindata in pincsv.read(path).rows:
+    pinname = pindata[nameoffset]
     if pinname.find('(')>0: pinname = pinname[:pinname.find('(')]
     if not isvalidpin(pinname): continue
     pin = findpin(pins, pinname, False)
@@ -186,28 +349,28 @@ def scan_pin_af_file(pins, filename, nameoffset, afoffset):
 
 # Code for scanning normal file
 def scan_pin_file(pins, filename, nameoffset, functionoffset, altfunctionoffset):
-  f = open(os.path.dirname(os.path.realpath(__file__))+'/../boards/pins/'+filename)
-  lines = f.readlines()
-  f.close()
-  headings = lines[0].split(",")
-  for line in lines:
-    pindata = line.split(",")
-    pinname = pindata[nameoffset].strip()
+  pins = PinSet(pins)
+  path = os.path.realpath(os.path.dirname(os.path.realpath(__file__))+'/../boards/pins/'+filename)
+  pin_files_read.append(path)
+  csv = pincsv.read(path)
+  headings = csv.headings
+  for pindata in csv.rows:
+    pinname = pindata[nameoffset]
 
     extrafunction = ""
-    if "BOOT1" in line: extrafunction="BOOT1"
+    if any("BOOT1" in field for field in pindata): extrafunction="BOOT1"
     if pinname.find('(')>0: pinname = pinname[:pinname.find('(')]
     if not isvalidpin(pinname): continue
     pin = findpin(pins, pinname, False)
     for i,head in enumerate(headings):
-      pin["csv"][head] = pindata[i].strip()
+      pin["csv"][head] = pindata[i]
     if extrafunction!="":
       pin["functions"][extrafunction] = 0
-    for fn in pindata[functionoffset].strip().split("/"):
+    for fn in pindata[functionoffset].split("/"):
       fname = fn.strip()
       pin["functions"][fname] = 0
     if altfunctionoffset>=0:
-      for fn in pindata[altfunctionoffset].strip().split("/"):
+      for fn in pindata[altfunctionoffset].split("/"):
         fname = fn.strip()
         pin["functions"][fname] = 1
 #    print pin["name"]+" : "+', '.join(pin["functions"])
@@ -215,7 +378,7 @@ def scan_pin_file(pins, filename, nameoffset, functionoffset, altfunctionoffset)
 
 # Create a simple list of pins
 def generate_pins(min_pin, max_pin, port_name="D"):
-  pins = []
+  pins = PinSet()
   for n in range(min_pin, max_pin+1):
     findpin(pins, "P"+port_name+str(n), False)
   return pins
@@ -241,7 +404,7 @@ def fill_gaps_in_pin_list(pins):
           print("Added fake pin "+newpin["name"])
     newpins.append(pin)
     prevpin = pin
-  return newpins
+  return PinSet(newpins)
 
 # Only return the pins for the specified package
 def only_from_package(pins, package):
@@ -252,7 +415,7 @@ def only_from_package(pins, package):
       pinnumber =  pin["csv"][package]
       if pinnumber!="" and pinnumber!="0":
         newpins.append(pin)
-  return newpins
+  return PinSet(newpins)
 
 def get_device_pins(board):
   pins = {}
@@ -272,6 +435,7 @@ def append_devices_to_pin_list(pins, board):
     if pin["name"] in devicepins:
       pins[i]["functions"][devicepins[pin["name"]]["device"]] = devicepins[pin["name"]]["function"]
 #      print pins[i]["functions"][devicepins[pin["name"]]["device"]]
+  if isinstance(pins, PinSet): pins.functions_changed()
   return pins
 
 # Get the utility timer for a specific board
@@ -323,4 +487,5 @@ def remove_used_pinfunctions(pins, board):
       for fidx,f in enumerate(pin["functions"]):
         if not f.startswith(used_function): newfunctions[f]=pin["functions"][f]
       pins[i]["functions"] = newfunctions
+    if isinstance(pins, PinSet): pins.functions_changed()
   return pins
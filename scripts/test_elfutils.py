@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Tests for elfutils.py. Run with: python3 -m unittest scripts/test_elfutils.py
+#
+# The fixture ELF files are made here rather than by a compiler, so the tests can run
+# without a toolchain. They're laid out like a linked firmware image, with .data loaded
+# from flash (LMA) but running from RAM (VMA).
+# ----------------------------------------------------------------------------------------
+
+import os;
+import sys;
+import struct;
+import tempfile;
+import unittest;
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import elfutils;
+
+TEXT_ADDR = 0x1000
+DATA_ADDR = 0x20000000
+DATA_LMA = 0x1100
+BSS_ADDR = 0x20000010
+
+def make_elf(endian="<", symbols=True):
+  text = bytes(range(0x40))
+  data = b"\x01\x02\x03\x04"
+  strtab = b"\0local_fn\0call_user_start\0_data_start\0external\0"
+  def strindex(name): return strtab.index(name.encode()+b"\0")
+  syms = b""
+  for name, value, size, info, shndx in [
+      (None, 0, 0, 0, 0),
+      ("local_fn", TEXT_ADDR+0x10, 8, (elfutils.STB_LOCAL<<4)|2, 1),
+      ("call_user_start", TEXT_ADDR+0x20, 16, (elfutils.STB_GLOBAL<<4)|2, 1),
+      ("_data_start", DATA_ADDR, 0, elfutils.STB_GLOBAL<<4, elfutils.SHN_ABS),
+      ("external", 0, 0, elfutils.STB_GLOBAL<<4, elfutils.SHN_UNDEF)]:
+    syms += struct.pack(endian+"IIIBBH", strindex(name) if name else 0, value, size, info, 0, shndx)
+  shstrtab = b"\0.text\0.data\0.bss\0.symtab\0.strtab\0.shstrtab\0"
+  def shindex(name): return shstrtab.index(name.encode()+b"\0")
+  # file layout: header, program headers, then section contents, then section headers
+  offset = 52 + 2*32
+  contents = b""
+  offsets = {}
+  for name, blob in [(".text", text), (".data", data), (".symtab", syms), (".strtab", strtab), (".shstrtab", shstrtab)]:
+    if name in (".symtab", ".strtab") and not symbols: continue
+    offsets[name] = offset + len(contents)
+    contents += blob
+  sections = [(0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+              (shindex(".text"), 1, 6, TEXT_ADDR, offsets[".text"], len(text), 0, 0, 4, 0),
+              (shindex(".data"), 1, 3, DATA_ADDR, offsets[".data"], len(data), 0, 0, 4, 0),
+              (shindex(".bss"), elfutils.SHT_NOBITS, 3, BSS_ADDR, offsets[".data"]+len(data), 0x20, 0, 0, 4, 0)]
+  if symbols:
+    sections += [(shindex(".symtab"), elfutils.SHT_SYMTAB, 0, 0, offsets[".symtab"], len(syms), 5, 2, 4, 16),
+                 (shindex(".strtab"), 3, 0, 0, offsets[".strtab"], len(strtab), 0, 0, 1, 0)]
+  sections.append((shindex(".shstrtab"), 3, 0, 0, offsets[".shstrtab"], len(shstrtab), 0, 0, 1, 0))
+  shoff = offset + len(contents)
+  header = b"\x7fELF" + bytes([elfutils.ELFCLASS32, elfutils.ELFDATA2MSB if endian==">" else elfutils.ELFDATA2LSB, 1]) + b"\0"*9
+  header += struct.pack(endian+"HHIIIIIHHHHHH", 2, 40, 1, TEXT_ADDR+0x20, 52, shoff, 0, 52, 32, 2, 40, len(sections), len(sections)-1)
+  segments = struct.pack(endian+"8I", elfutils.PT_LOAD, offsets[".text"], TEXT_ADDR, TEXT_ADDR, len(text), len(text), 5, 4)
+  segments += struct.pack(endian+"8I", elfutils.PT_LOAD, offsets[".data"], DATA_ADDR, DATA_LMA, len(data), BSS_ADDR+0x20-DATA_ADDR, 6, 4)
+  return header + segments + contents + b"".join(struct.pack(endian+"10I", *s) for s in sections)
+
+class TestElfFile(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+
+  def open_fixture(self, contents):
+    filename = os.path.join(self.tmpdir.name, "test.elf")
+    with open(filename, "wb") as f:
+      f.write(contents)
+    elf = elfutils.ElfFile(filename)
+    self.addCleanup(elf.close)
+    return elf
+
+  def check_elf(self, elf):
+    self.assertEqual([s.name for s in elf.sections], ["", ".text", ".data", ".bss", ".symtab", ".strtab", ".shstrtab"])
+    text = elf.section(".text")
+    self.assertEqual((text.addr, text.lma, text.size), (TEXT_ADDR, TEXT_ADDR, 0x40))
+    self.assertEqual(elf.section_data(text), bytes(range(0x40)))
+    data = elf.section(".data")
+    self.assertEqual((data.addr, data.lma, data.size), (DATA_ADDR, DATA_LMA, 4))
+    bss = elf.section(".bss")
+    self.assertEqual((bss.addr, bss.lma, bss.size), (BSS_ADDR, DATA_LMA+BSS_ADDR-DATA_ADDR, 0x20))
+    self.assertEqual(elf.section_data(bss), b"")
+    self.assertEqual(elf.section(".fs_data"), None)
+    self.assertEqual(elf.entry, TEXT_ADDR+0x20)
+
+  def test_sections(self):
+    self.check_elf(self.open_fixture(make_elf("<")))
+
+  def test_big_endian(self):
+    self.check_elf(self.open_fixture(make_elf(">")))
+
+  def test_symbols(self):
+    elf = self.open_fixture(make_elf())
+    self.assertEqual([s.name for s in elf.symbols()], ["", "local_fn", "call_user_start", "_data_start", "external"])
+    entry = elf.symbol("call_user_start")
+    self.assertEqual((entry.value, entry.size), (TEXT_ADDR+0x20, 16))
+    self.assertTrue(entry.is_global() and entry.is_defined())
+    self.assertEqual(elf.symbol("_data_start").shndx, elfutils.SHN_ABS)
+    self.assertFalse(elf.symbol("local_fn").is_global())
+    self.assertFalse(elf.symbol("external").is_defined())
+    self.assertEqual(elf.symbol("missing"), None)
+
+  def test_stripped(self):
+    elf = self.open_fixture(make_elf(symbols=False))
+    self.assertEqual(elf.symbols(), [])
+    self.assertEqual(elf.symbol("call_user_start"), None)
+    self.assertEqual(elf.section(".data").lma, DATA_LMA)
+
+  def test_not_elf(self):
+    self.assertRaises(ValueError, self.open_fixture, b"")
+    self.assertRaises(ValueError, self.open_fixture, b":020000040800F2\n")
+    self.assertRaises(ValueError, self.open_fixture, make_elf()[:4] + b"\x02" + make_elf()[5:])
+
+if __name__ == "__main__":
+  unittest.main()
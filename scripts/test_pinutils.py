@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# This file is part of Espruino, a JavaScript interpreter for Microcontrollers
+#
+# Copyright (C) 2013 Gordon Williams <gw@pur3.co.uk>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# ----------------------------------------------------------------------------------------
+# Tests for pinutils.PinSet. Run with: python3 -m unittest scripts/test_pinutils.py
+# ----------------------------------------------------------------------------------------
+
+import os;
+import sys;
+import copy;
+import pickle;
+import unittest;
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import pinutils;
+
+def make_pin(name, functions={}):
+  return { "name" : "P"+name, "sortingname" : name, "port" : name[0], "num" : name[1:],
+           "functions" : dict(functions), "csv" : {} }
+
+class TestPinSet(unittest.TestCase):
+  def setUp(self):
+    self.pins = pinutils.PinSet(make_pin(name) for name in ["D0", "D1", "D2"])
+
+  def check_index(self):
+    # the lookups must give the same answers as searching the list
+    pins = self.pins
+    for name in ["PD0", "PD1", "PD2", "PX9", "PY1"]:
+      found = [pin for pin in pins if pin["name"]==name]
+      self.assertIs(pins.find(name), found[0] if found else None, name)
+    for port in ["D", "X", "Y"]:
+      self.assertEqual([pin["name"] for pin in pins.port_pins(port)],
+                       [pin["name"] for pin in pins if pin["port"]==port])
+    for pin in pins: # the first position, if a pin is in the list twice
+      self.assertEqual(pins.position(pin), [p is pin for p in pins].index(True))
+
+  def test_find(self):
+    self.assertEqual(self.pins.find("PD1")["num"], "1")
+    self.assertIs(self.pins.find_port_num("D", 2), self.pins[2])
+    self.assertEqual(self.pins.find("PX9"), None)
+    self.check_index()
+
+  def test_append(self):
+    self.check_index()
+    self.pins.append(make_pin("X9"))
+    self.check_index()
+
+  def test_del_then_append(self):
+    self.check_index()
+    del self.pins[1]
+    self.pins.append(make_pin("X9")) # same length as before
+    self.assertEqual(self.pins.find("PD1"), None)
+    self.assertEqual(self.pins.find("PX9")["name"], "PX9")
+    self.check_index()
+
+  def test_mutators(self):
+    pins = self.pins
+    for change in [lambda: pins.insert(0, make_pin("X9")),
+                   lambda: pins.pop(),
+                   lambda: pins.pop(0),
+                   lambda: pins.extend([make_pin("Y1")]),
+                   lambda: pins.remove(pins[0]),
+                   lambda: pins.__setitem__(0, make_pin("X9")),
+                   lambda: pins.__setitem__(slice(0, 1), [make_pin("D2"), make_pin("D0")]),
+                   lambda: pins.__delitem__(slice(1, 2)),
+                   lambda: pins.sort(key=lambda pin: pin["name"]),
+                   lambda: pins.reverse(),
+                   lambda: pins.clear(),
+                   lambda: pins.append(make_pin("D3"))]:
+      self.check_index()
+      change()
+      self.check_index()
+
+  def test_iadd(self):
+    self.check_index()
+    pins = self.pins
+    pins += [make_pin("X9")]
+    self.assertIs(pins, self.pins)
+    self.check_index()
+    pins *= 2
+    self.assertIs(pins.find("PD0"), pins[0])
+    self.check_index()
+
+  def test_function_classes(self):
+    self.pins[0]["functions"]["ADC1_IN0"] = 0
+    self.assertEqual([f["function"] for f in self.pins.function_classes()], ["ADC1_IN0"])
+    self.pins.append(make_pin("D3", { "ADC1_IN3" : 0 }))
+    self.assertEqual([f["function"] for f in self.pins.function_classes()], ["ADC1_IN0", "ADC1_IN3"])
+    del self.pins[0]
+    self.pins.append(make_pin("D4"))
+    self.assertEqual([f["function"] for f in self.pins.function_classes()], ["ADC1_IN3"])
+
+  def test_copy(self):
+    self.check_index()
+    for pins in [copy.deepcopy(self.pins), pickle.loads(pickle.dumps(self.pins))]:
+      self.assertIsInstance(pins, pinutils.PinSet)
+      self.assertEqual(pins.find("PD2"), pins[2])
+      self.assertIsNot(pins.find("PD2"), self.pins[2])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -600,10 +600,13 @@ static void jslGetRawString() {
     length |= ((unsigned char)lex->currCh)<<8;
   }
   jsvUnLock(lex->tokenValue);
-  if (length > JSVAR_DATA_STRING_LEN) {
-    /* if it won't fit in a single string var, keep it in flash */
+  lex->tokenValue = 0;
+  if (!JSP_SHOULD_EXECUTE || length > JSVAR_DATA_STRING_LEN) {
+    /* if it won't fit in a single string var, keep it in flash. If we're not
+    executing we don't need the value at all (like jslLexString) */
     size_t stringPos = jsvStringIteratorGetIndex(&lex->it);
-    lex->tokenValue = jsvNewFromStringVar(lex->sourceVar, stringPos, length);
+    if (JSP_SHOULD_EXECUTE)
+      lex->tokenValue = jsvNewFromStringVar(lex->sourceVar, stringPos, length);
     // skip over string
     jsvLockAgain(lex->it.var); // jsvStringIteratorGoto assumes var was locked
     jsvStringIteratorGoto(&lex->it, lex->sourceVar, stringPos+length);
@@ -619,6 +622,14 @@ static void jslGetRawString() {
   jslGetNextCh(); // ensure we're all set up with next char (might be able to optimise slightly, but this is safe)
 }
 
+/* A pretokenised int - store it as token text like any other int, so we don't
+allocate a variable for it when we're not executing */
+static void jslSetRawInt(int value) {
+  lex->tk = LEX_INT;
+  itostr(value, lex->token, 10);
+  lex->tokenl = (unsigned char)strlen(lex->token);
+}
+
 void jslGetNextToken() {
   int lastToken = lex->tk;
   lex->tk = LEX_EOF;
@@ -651,19 +662,16 @@ void jslGetNextToken() {
       else if (lex->tk>=LEX_RAW_STRING8) {
         if (lex->tk == LEX_RAW_STRING8 || lex->tk == LEX_RAW_STRING16) jslGetRawString();
         else if (lex->tk == LEX_RAW_INT0) {
-          lex->tk = LEX_INT;
-          lex->tokenValue = jsvNewFromInteger(0);
+          jslSetRawInt(0);
         } else if (lex->tk == LEX_RAW_INT8) {
-          lex->tk = LEX_INT;
-          lex->tokenValue = jsvNewFromInteger((int8_t)lex->currCh);
+          jslSetRawInt((int8_t)lex->currCh);
           jslGetNextCh();
         } else if (lex->tk == LEX_RAW_INT16) {
-          lex->tk = LEX_INT;
           int16_t value = (unsigned char)lex->currCh;
           jslGetNextCh();
           value |= ((char)lex->currCh)<<8;
           jslGetNextCh();
-          lex->tokenValue = jsvNewFromInteger(value);
+          jslSetRawInt(value);
         }
       }
       break;
@@ -38,80 +38,7 @@ bool jshIsPinValid(Pin pin) {
   return pin < JSH_PIN_COUNT && (pinInfo[pin].port&JSH_PORT_MASK) != JSH_PORT_NONE;
 }
 
-Pin jshGetPinFromString(const char *s) {
-  if (((s[0]>='A' && s[0]<='I') || s[0]=='V') && s[1]) {
-    int port = (s[0]=='V') ? JSH_PORTV : JSH_PORTA+s[0]-'A';
-    int pin = -1;
-    if (s[1]>='0' && s[1]<='9') {
-      if (!s[2]) { // D0-D9
-        pin = (s[1]-'0');
-      } else if (s[2]>='0' && s[2]<='9') {
-        if (!s[3]) {
-          pin = ((s[1]-'0')*10 + (s[2]-'0'));
-#ifdef LINUX
-        } else if (!s[4] && s[3]>='0' && s[3]<='9') {
-          pin = ((s[1]-'0')*100 + (s[2]-'0')*10 + (s[3]-'0'));
-#endif
-        }
-      }
-    }
-    if (pin>=0) {
-#ifdef PIN_NAMES_DIRECT
-      int i;
-      for (i=0;i<JSH_PIN_COUNT;i++)
-        if ((pinInfo[i].port&JSH_PORT_MASK) == port && pinInfo[i].pin==pin)
-          return (Pin)i;
-#else
-      if (0) {
-#if JSH_PORTA_OFFSET!=-1
-      } else if (port == JSH_PORTA) {
-        if (pin<JSH_PORTA_COUNT) return (Pin)(JSH_PORTA_OFFSET + pin);
-#endif
-#if JSH_PORTB_OFFSET!=-1
-      } else if (port == JSH_PORTB) {
-        if (pin<JSH_PORTB_COUNT) return (Pin)(JSH_PORTB_OFFSET + pin);
-#endif
-#if JSH_PORTC_OFFSET!=-1
-      } else if (port == JSH_PORTC) {
-        if (pin<JSH_PORTC_COUNT) return (Pin)(JSH_PORTC_OFFSET + pin);
-#endif
-#if JSH_PORTD_OFFSET!=-1
-      } else if (port == JSH_PORTD) {
-        if (pin<JSH_PORTD_COUNT) return (Pin)(JSH_PORTD_OFFSET + pin);
-#endif
-#if JSH_PORTE_OFFSET!=-1
-      } else if (port == JSH_PORTE) {
-        if (pin<JSH_PORTE_COUNT) return (Pin)(JSH_PORTE_OFFSET + pin);
-#endif
-#if JSH_PORTF_OFFSET!=-1
-      } else if (port == JSH_PORTF) {
-        if (pin<JSH_PORTF_COUNT) return (Pin)(JSH_PORTF_OFFSET + pin);
-#endif
-#if JSH_PORTG_OFFSET!=-1
-      } else if (port == JSH_PORTG) {
-        if (pin<JSH_PORTG_COUNT) return (Pin)(JSH_PORTG_OFFSET + pin);
-#endif
-#if JSH_PORTH_OFFSET!=-1
-      } else if (port == JSH_PORTH) {
-        if (pin<JSH_PORTH_COUNT) return (Pin)(JSH_PORTH_OFFSET + pin);
-#endif
-#if JSH_PORTI_OFFSET!=-1
-      } else if (port == JSH_PORTI) {
-        if (pin<JSH_PORTI_COUNT) return (Pin)(JSH_PORTI_OFFSET + pin);
-#endif
-#if JSH_PORTV_OFFSET!=-1
-      } else if (port == JSH_PORTV) {
-        if (pin<JSH_PORTV_COUNT) return (Pin)(JSH_PORTV_OFFSET + pin);
-#endif
-      }
-#endif
-    }
-  }
-
-  return PIN_UNDEFINED;
-}
-
-
+// jshGetPinFromString is in jspininfo.c, as build_pininfo.py generates it for each board
 
 /** Write the pin name to a string. String must have at least 10 characters (to be safe) */
 void jshGetPinString(char *result, Pin pin) {
@@ -310,8 +237,8 @@ JshPinFunction NO_INLINE jshGetPinFunctionForPin(Pin pin, JshPinFunction functio
   if (!jshIsPinValid(pin)) return 0;
   int i;
   for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-    if ((pinInfo[pin].functions[i]&JSH_MASK_TYPE) == functionType)
-      return pinInfo[pin].functions[i];
+    if ((JSH_PININFO_FUNCTION(pin,i)&JSH_MASK_TYPE) == functionType)
+      return JSH_PININFO_FUNCTION(pin,i);
   }
   return 0;
 }
@@ -340,15 +267,15 @@ Pin NO_INLINE jshFindPinForFunction(JshPinFunction functionType, JshPinFunction
   // first, try and find the pin with an AF of 0 - this is usually the 'default'
   for (i=0;i<JSH_PIN_COUNT;i++)
     for (j=0;j<JSH_PININFO_FUNCTIONS;j++)
-      if ((pinInfo[i].functions[j]&JSH_MASK_AF) == JSH_AF0 &&
-          (pinInfo[i].functions[j]&JSH_MASK_TYPE) == functionType &&
-          (pinInfo[i].functions[j]&JSH_MASK_INFO) == functionInfo)
+      if ((JSH_PININFO_FUNCTION(i,j)&JSH_MASK_AF) == JSH_AF0 &&
+          (JSH_PININFO_FUNCTION(i,j)&JSH_MASK_TYPE) == functionType &&
+          (JSH_PININFO_FUNCTION(i,j)&JSH_MASK_INFO) == functionInfo)
         return i;
   // otherwise just try and find anything
   for (i=0;i<JSH_PIN_COUNT;i++)
     for (j=0;j<JSH_PININFO_FUNCTIONS;j++)
-      if ((pinInfo[i].functions[j]&JSH_MASK_TYPE) == functionType &&
-          (pinInfo[i].functions[j]&JSH_MASK_INFO) == functionInfo)
+      if ((JSH_PININFO_FUNCTION(i,j)&JSH_MASK_TYPE) == functionType &&
+          (JSH_PININFO_FUNCTION(i,j)&JSH_MASK_INFO) == functionInfo)
         return i;
   return PIN_UNDEFINED;
 }
@@ -429,11 +356,11 @@ void NO_INLINE jshPrintCapablePins(Pin existingPin, const char *functionName, Js
       has = pinInfo[pin].analog!=JSH_ANALOG_NONE;
     } else {
       for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-        JshPinFunction type = pinInfo[pin].functions[i] & JSH_MASK_TYPE;
-        if (type>=typeMin && type<=typeMax && ((pinInfo[pin].functions[i]&pMask)==pData)) {
+        JshPinFunction type = JSH_PININFO_FUNCTION(pin,i) & JSH_MASK_TYPE;
+        if (type>=typeMin && type<=typeMax && ((JSH_PININFO_FUNCTION(pin,i)&pMask)==pData)) {
           has = true;
 #ifdef STM32F1
-          af = pinInfo[pin].functions[i] & JSH_MASK_AF;
+          af = JSH_PININFO_FUNCTION(pin,i) & JSH_MASK_AF;
 #endif
         }
       }
@@ -457,7 +384,7 @@ JshPinFunction jshGetDeviceFor(JshPinFunction deviceMin, JshPinFunction deviceMa
   if (!jshIsPinValid(pin)) return JSH_NOTHING;
   int i;
   for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-    JshPinFunction f = pinInfo[pin].functions[i];
+    JshPinFunction f = JSH_PININFO_FUNCTION(pin,i);
     if ((f&JSH_MASK_TYPE) >= deviceMin &&
         (f&JSH_MASK_TYPE) <= deviceMax)
       return f;
@@ -1615,6 +1615,35 @@ void jswrap_espruino_dumpFreeList() {
 }
 #endif
 
+/*JSON{
+  "type" : "staticmethod",
+  "class" : "E",
+  "name" : "getBuiltinProfile",
+  "ifdef" : "ESPR_BUILTIN_PROFILE",
+  "generate_full" : "jswGetBuiltinProfile(reset)",
+  "params" : [
+    ["reset","bool","If true, the counts are cleared after being returned"]
+  ],
+  "return" : ["JsVar","An object containing `{calls, time}` for each builtin function that has been called"]
+}
+**Only available in builds with `ESPR_BUILTIN_PROFILE` defined.** Return how
+many times each builtin function has been called, and the total time in
+milliseconds spent in it (which includes time spent in any functions it calls),
+for example:
+
+```
+{
+  "Math.sin": { "calls": 100, "time": 0.12 },
+  "String.prototype.charAt": { "calls": 2000, "time": 1.5 },
+  ...
+}
+```
+
+Output from several runs can be saved with
+`print(JSON.stringify(E.getBuiltinProfile()))` and combined with
+`scripts/builtin_profile_report.py`.
+*/
+
 /*JSON{
   "type" : "staticmethod",
   "class" : "E",
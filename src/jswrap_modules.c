@@ -105,15 +105,12 @@ JsVar *jswrap_require(JsVar *moduleName) {
 #endif
 
   // Ok - it's not built-in as native or storage.
-  // Look and see if it's compiled-in as a C-String of JS - if so get the actual text and execute it
+  // Look and see if it's compiled-in as JS (maybe pretokenised/compressed) - if so get the actual code and execute it
   if (!moduleExport) {
-    const char *builtInJS = jswGetBuiltInJSLibrary(moduleNameBuf);
-    if (builtInJS) {
-      JsVar *fileContents = jsvNewNativeString((char*)builtInJS, strlen(builtInJS));
-      if (fileContents) {
-        moduleExport = jspEvaluateModule(fileContents);
-        jsvUnLock(fileContents);
-      }
+    JsVar *fileContents = jswGetBuiltInJSLibrary(moduleNameBuf);
+    if (fileContents) {
+      moduleExport = jspEvaluateModule(fileContents);
+      jsvUnLock(fileContents);
     }
   }
 
@@ -321,15 +321,16 @@ JsVar *jswrap_pin_getInfo(
   if (funcs) {
     int i;
     for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-      if (inf->functions[i]) {
+      JshPinFunction f = JSH_PININFO_FUNCTION(pin,i);
+      if (f) {
         JsVar *func = jsvNewObject();
         if (func) {
           char buf[16];
-          jshPinFunctionToString(inf->functions[i], JSPFTS_TYPE, buf, sizeof(buf));
+          jshPinFunctionToString(f, JSPFTS_TYPE, buf, sizeof(buf));
           jsvObjectSetStringChild(func, "type", buf);
-          jsvObjectSetIntChild(func, "af", inf->functions[i] & JSH_MASK_AF);
+          jsvObjectSetIntChild(func, "af", f & JSH_MASK_AF);
 
-          jshPinFunctionToString(inf->functions[i], JSPFTS_DEVICE|JSPFTS_DEVICE_NUMBER, buf, sizeof(buf));
+          jshPinFunctionToString(f, JSPFTS_DEVICE|JSPFTS_DEVICE_NUMBER, buf, sizeof(buf));
           jsvObjectSetChildAndUnLock(funcs, buf, func);
         }
       }
@@ -110,12 +110,21 @@ typedef struct {
 
 /// Information for each list of built-in symbols
 typedef struct {
+  // pointers first, so they are aligned even though the struct is packed
   const JswSymPtr *symbols;
   const char *symbolChars;
+#ifdef ESPR_SYMBOL_HASH // Perfect hash of symbol names, generated by build_jswrapper.py
+  const unsigned char *hashDisplacements; ///< per-bucket offset added to the hash to get the slot
+  const unsigned char *hashIndex; ///< symbolCount entries - hash slot -> index in symbols
+#endif
   unsigned char symbolCount;
+#ifdef ESPR_SYMBOL_HASH
+  unsigned char hashSeed; ///< seed for jswSymbolHash
+  unsigned char hashBuckets; ///< number of entries in hashDisplacements, or 0 if no hash (use binary search)
+#endif
 } PACKED_JSW_SYM JswSymList;
 
-/// Do a binary search of the symbol table list
+/// Do a binary search of the symbol table list (or a perfect hash lookup if ESPR_SYMBOL_HASH)
 JsVar *jswBinarySearch(const JswSymList *symbolsPtr, JsVar *parent, const char *name);
 
 /** If 'name' is something that belongs to an internal function, return it (it'll be created on demand).  */
@@ -165,7 +174,9 @@ void jswOnCustomEvent(IOEventFlags eventFlags, uint8_t *data, int dataLen);
   pointer of the object's constructor */
 void *jswGetBuiltInLibrary(const char *name);
 
-/** If we have a built-in JS module with the given name, return the module's contents - or 0.
+/** If we have a built-in JS module with the given name, return a String of the module's
+ * contents - or 0. The contents may be pretokenised or compressed (see ESPR_PRETOKENISE_JSMODULES
+ * and ESPR_COMPRESS_JSMODULES in README_BuildProcess.md), so this must be unlocked after use.
  * These can be added using teh followinf in the Makefile/BOARD.py file:
  *
  * JSMODULESOURCES+=path/to/modulename:path.js
@@ -173,14 +184,21 @@ void *jswGetBuiltInLibrary(const char *name);
  * JSMODULESOURCES+=_:code_to_run_at_startup.js
  *
  *  */
-const char *jswGetBuiltInJSLibrary(const char *name);
+JsVar *jswGetBuiltInJSLibrary(const char *name);
 
 /** Return a comma-separated list of built-in libraries */
 const char *jswGetBuiltInLibraryNames();
 
+#ifdef ESPR_BUILTIN_PROFILE
+/** Return an object of { calls, time } (time in milliseconds) for every builtin function that has been
+ * called, keyed by name. If reset is set, the counts are cleared afterwards. See E.getBuiltinProfile */
+JsVar *jswGetBuiltinProfile(bool reset);
+#endif
+
 #ifdef USE_CALLFUNCTION_HACK
 // on Emscripten and i386 we cant easily hack around function calls with floats/etc, plus we have enough
-// resources, so just brute-force by handling every call pattern we use in a switch
+// resources, so just brute-force by handling every call pattern we use - each argument specifier is looked
+// up in a table to find a trampoline for its 'shape' (return type and int/float arguments)
 JsVar *jswCallFunctionHack(void *function, JsnArgumentType argumentSpecifier, JsVar *thisParam, JsVar **paramData, int paramCount);
 #endif
 
@@ -546,7 +546,7 @@ JshPinFunction jshGetCurrentPinFunction(Pin pin) {
   if (jshIsPinValid(pin)) {
     int i;
     for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-      JshPinFunction func = pinInfo[pin].functions[i];
+      JshPinFunction func = JSH_PININFO_FUNCTION(pin,i);
       if (JSH_PINFUNCTION_IS_TIMER(func) ||
           JSH_PINFUNCTION_IS_DAC(func))
         return func;
@@ -33,11 +33,13 @@
 import string
 import sys
 import os
-import re
 import binascii
 import struct
 import zlib
 
+sys.path.append(os.path.dirname(os.path.realpath(__file__))+"/../../scripts")
+import elfutils
+
 
 TEXT_ADDRESS = 0x40100000
 # app_entry = 0
@@ -149,48 +151,23 @@ def gen_appbin():
     data_str = ''
     sum_size = 0
 
-    if os.getenv('COMPILE')=='gcc' :
-        cmd = 'xtensa-lx106-elf-nm -g ' + elf_file + ' > eagle.app.sym'
-    else :
-        cmd = 'xt-nm -g ' + elf_file + ' > eagle.app.sym'
-
-    os.system(cmd)
-
-    fp = open('./eagle.app.sym')
-    if fp is None:
-        print("open sym file error\n")
-        sys.exit(0)
-
-    lines = fp.readlines()
-    fp.close()
+    # read the symbols directly rather than with 'xtensa-lx106-elf-nm -g'
+    elf = elfutils.ElfFile(elf_file)
 
-    entry_addr = None
-    p = re.compile(r'(\w*)(\sT\s)(call_user_start)$')
-    for line in lines:
-        m = p.search(line)
-        if m != None:
-            entry_addr = m.group(1)
-            # print(entry_addr)
+    def global_symbol(name):
+        sym = elf.symbol(name)
+        if sym is None or not sym.is_global() or not sym.is_defined():
+            return None
+        return '%x' % sym.value
 
+    entry_addr = global_symbol('call_user_start')
     if entry_addr is None:
         print('no entry point!!')
         sys.exit(0)
 
-    data_start_addr = '0'
-    p = re.compile(r'(\w*)(\sA\s)(_data_start)$')
-    for line in lines:
-        m = p.search(line)
-        if m != None:
-            data_start_addr = m.group(1)
-            # print(data_start_addr)
-
-    rodata_start_addr = '0'
-    p = re.compile(r'(\w*)(\sA\s)(_rodata_start)$')
-    for line in lines:
-        m = p.search(line)
-        if m != None:
-            rodata_start_addr = m.group(1)
-            # print(rodata_start_addr)
+    data_start_addr = global_symbol('_data_start') or '0'
+    rodata_start_addr = global_symbol('_rodata_start') or '0'
+    elf.close()
 
     # write flash bin header
     #============================
@@ -280,8 +257,6 @@ def gen_appbin():
             all_bin_crc = abs(all_bin_crc) + 1
         print(all_bin_crc)
         write_file(flash_bin_name,chr((all_bin_crc & 0x000000FF))+chr((all_bin_crc & 0x0000FF00) >> 8)+chr((all_bin_crc & 0x00FF0000) >> 16)+chr((all_bin_crc & 0xFF000000) >> 24))
-    cmd = 'rm eagle.app.sym'
-    os.system(cmd)
 
 if __name__=='__main__':
     gen_appbin()
@@ -2001,12 +2001,12 @@ JshPinFunction jshPinAnalogOutput(Pin pin, JsVarFloat value, JsVarFloat freq, Js
   if (jshIsPinValid(pin) && !(flags&JSAOF_FORCE_SOFTWARE)) {
     int i;
     for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-      if (freq<=0 && JSH_PINFUNCTION_IS_DAC(pinInfo[pin].functions[i])) {
+      if (freq<=0 && JSH_PINFUNCTION_IS_DAC(JSH_PININFO_FUNCTION(pin,i))) {
         // note: we don't use DAC if a frequency is specified
-        func = pinInfo[pin].functions[i];
+        func = JSH_PININFO_FUNCTION(pin,i);
       }
-      if (func==0 && JSH_PINFUNCTION_IS_TIMER(pinInfo[pin].functions[i])) {
-        func = pinInfo[pin].functions[i];
+      if (func==0 && JSH_PINFUNCTION_IS_TIMER(JSH_PININFO_FUNCTION(pin,i))) {
+        func = JSH_PININFO_FUNCTION(pin,i);
       }
     }
   }
@@ -2990,7 +2990,7 @@ JshPinFunction jshGetCurrentPinFunction(Pin pin) {
   if (jshIsPinValid(pin)) {
     int i;
     for (i=0;i<JSH_PININFO_FUNCTIONS;i++) {
-      JshPinFunction func = pinInfo[pin].functions[i];
+      JshPinFunction func = JSH_PININFO_FUNCTION(pin,i);
       if (JSH_PINFUNCTION_IS_TIMER(func) ||
           JSH_PINFUNCTION_IS_DAC(func))
         return func;